@@ -0,0 +1,379 @@
+"""
+Benchmarks for the Lego configuration management tool.
+
+Generates synthetic builder files, builds each one twice against a temporary
+root and a stub apt module, once cold and once warm, and reports wall time,
+I/O syscalls and peak RSS of every run. Every run happens in its own process,
+so peak RSS is not shared between runs.
+"""
+
+
+from __future__ import print_function
+
+import argparse
+import grp
+import json
+import logging
+import os
+import pwd
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import oyaml as yaml  # pylint: disable=wrong-import-position
+import stub_apt  # pylint: disable=wrong-import-position
+from lego.builder import Builder  # pylint: disable=wrong-import-position
+from lego.context import BuildContext  # pylint: disable=wrong-import-position
+from lego.profiler import CLOCK  # pylint: disable=wrong-import-position
+
+
+SCENARIOS = [
+    'files',
+    'packages',
+    'commands',
+    'mixed'
+]
+
+# Number of file entries, package bricks and command bricks at each scale.
+# Mixed builds have this many package bricks, after file bricks.
+SCALES = {
+    'small': {'files': 10, 'packages': 10, 'commands': 10, 'mixed': 10},
+    'medium': {'files': 1000, 'packages': 100, 'commands': 100, 'mixed': 100},
+    'large': {'files': 50000, 'packages': 1000, 'commands': 1000, 'mixed': 1000}
+}
+
+# File entries managed before the package bricks of a mixed build, per package brick.
+MIXED_FILES_PER_PACKAGE_BRICK = 100
+
+FILES_PER_BRICK = 500
+FILES_PER_DIRECTORY = 1000
+SOURCE_FILES = 100
+SOURCE_FILE_SIZE = 4096
+PACKAGES_PER_BRICK = 3
+
+BRICK_SET = 'bench'
+
+# Keys of /proc/self/io to report.
+IO_COUNTERS = [
+    'syscr',
+    'syscw',
+    'read_bytes',
+    'write_bytes'
+]
+
+
+def write_yaml(path, data):
+    """
+    Write a YAML file, dated an hour back so its compiled cache is written
+    on the first load.
+    Args:
+        path (str): File to write.
+        data (object): Document to write.
+    Returns:
+        None
+    Raises:
+        IOError: Raises IOError if the file can not be written.
+    """
+    with open(path, 'w') as stream:
+        yaml.safe_dump(data, stream, default_flow_style=False)
+    an_hour_ago = time.time() - 3600
+    os.utime(path, (an_hour_ago, an_hour_ago))
+
+
+def file_bricks(brick_set_dir, root, count):
+    """
+    Make file bricks with `count` file entries in total, sharing a pool of
+    source files.
+    Args:
+        brick_set_dir (str): Directory of the brick set.
+        root (str): Directory the files are managed in.
+        count (int): Number of file entries.
+    Returns:
+        dict: Brick name to brick attributes.
+    Raises:
+        IOError: Raises IOError if a file can not be written.
+    """
+    files_dir = os.path.join(brick_set_dir, 'files')
+    os.makedirs(files_dir)
+    for index in range(SOURCE_FILES):
+        with open(os.path.join(files_dir, "source{0}.conf".format(index)), 'wb') as stream:
+            stream.write(os.urandom(SOURCE_FILE_SIZE))
+
+    owner = pwd.getpwuid(os.getuid()).pw_name
+    group = grp.getgrgid(os.getgid()).gr_name
+    bricks = {}
+    for first in range(0, count, FILES_PER_BRICK):
+        files = []
+        for index in range(first, min(first + FILES_PER_BRICK, count)):
+            directory = os.path.join(root, "d{0}".format(index // FILES_PER_DIRECTORY))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            files.append({'source': "source{0}.conf".format(index % SOURCE_FILES),
+                          'destination': os.path.join(directory, "f{0}.conf".format(index))})
+        bricks["Files {0}".format(first // FILES_PER_BRICK)] = {
+            'type': 'file',
+            'state': 'present',
+            'owner': owner,
+            'group': group,
+            'mode': 0o644,
+            'files': files
+        }
+    return bricks
+
+
+def package_bricks(count):
+    """
+    Make `count` package bricks, each installing its own packages.
+    Args:
+        count (int): Number of package bricks.
+    Returns:
+        dict: Brick name to brick attributes.
+    Raises:
+        None
+    """
+    return dict(("Packages {0}".format(index), {
+        'type': 'package',
+        'provider': 'apt',
+        'state': 'present',
+        'packages': ["package{0}-{1}".format(index, number)
+                     for number in range(PACKAGES_PER_BRICK)]
+    }) for index in range(count))
+
+
+def command_bricks(count):
+    """
+    Make `count` command bricks, each running `true`.
+    Args:
+        count (int): Number of command bricks.
+    Returns:
+        dict: Brick name to brick attributes.
+    Raises:
+        None
+    """
+    return dict(("Command {0}".format(index), {
+        'type': 'command',
+        'commands': ['true']
+    }) for index in range(count))
+
+
+def generate(workdir, scenario, count):
+    """
+    Generate a builder file with one brick set for a scenario.
+    Args:
+        workdir (str): Empty directory to generate the builder file in.
+        scenario (str): One of SCENARIOS.
+        count (int): Number of file entries, package bricks or command bricks.
+    Returns:
+        None
+    Raises:
+        IOError: Raises IOError if a file can not be written.
+    """
+    brick_set_dir = os.path.join(workdir, 'brick_sets', BRICK_SET)
+    os.makedirs(brick_set_dir)
+    if scenario == 'files':
+        bricks = file_bricks(brick_set_dir, os.path.join(workdir, 'root'), count)
+    elif scenario == 'packages':
+        bricks = package_bricks(count)
+    elif scenario == 'mixed':
+        # Brick names sort the file bricks first.
+        bricks = file_bricks(brick_set_dir, os.path.join(workdir, 'root'),
+                             count * MIXED_FILES_PER_PACKAGE_BRICK)
+        bricks.update(package_bricks(count))
+    else:
+        bricks = command_bricks(count)
+
+    available = [package for brick in bricks.values() for package in brick.get('packages', [])]
+    with open(os.path.join(workdir, 'apt_available.json'), 'w') as stream:
+        json.dump(available, stream)
+    write_yaml(os.path.join(brick_set_dir, 'bricks.yaml'),
+               dict((name, bricks[name]) for name in sorted(bricks)))
+    write_yaml(os.path.join(workdir, 'server.yaml'), {'brick_sets': [BRICK_SET]})
+
+
+def io_counters():
+    """
+    Read the I/O counters of this process.
+    Args:
+        None
+    Returns:
+        dict: Counter name to value, empty if /proc/self/io can not be read.
+    Raises:
+        None
+    """
+    counters = {}
+    try:
+        with open('/proc/self/io', 'r') as stream:
+            for line in stream:
+                name, value = line.split(':', 1)
+                counters[name] = int(value)
+    except (IOError, OSError, ValueError):
+        return {}
+    return dict((name, counters.get(name)) for name in IO_COUNTERS)
+
+
+def run_build(workdir, jobs,  # pylint: disable=too-many-arguments
+              update_latency, commit_latency, fetch_latency, prefetch):
+    """
+    Build a generated builder file and print its measurements as JSON.
+    Args:
+        workdir (str): Directory the builder file was generated in.
+        jobs (int): Maximum number of bricks to run at the same time.
+        update_latency (float): Seconds a stub package list update takes.
+        commit_latency (float): Seconds a stub apt commit takes.
+        fetch_latency (float): Seconds downloading a stub package archive takes.
+        prefetch (bool): Download package archives in the background.
+    Returns:
+        None
+    Raises:
+        LegoException: Raises LegoException if the build fails.
+    """
+    os.chdir(workdir)
+    with open('apt_available.json', 'r') as stream:
+        available = json.load(stream)
+    stub_apt.install(state_file=os.path.join(workdir, 'apt_installed.json'),
+                     available=available,
+                     update_latency=update_latency,
+                     commit_latency=commit_latency,
+                     fetch_latency=fetch_latency)
+
+    before = io_counters()
+    start = CLOCK()
+    context = BuildContext(state_dir=os.path.join(workdir, 'state'), prefetch=prefetch)
+    Builder(builder_file='server.yaml', context=context).build(jobs=jobs)
+    wall = CLOCK() - start
+    after = io_counters()
+
+    print(json.dumps({
+        'wall': wall,
+        'io': dict((name, after[name] - before[name]) for name in after),
+        # Kilobytes on Linux.
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }))
+
+
+def measure(workdir, args):
+    """
+    Run one build in a new process.
+    Args:
+        workdir (str): Directory the builder file was generated in.
+        args (argparse.Namespace): Parsed command line arguments.
+    Returns:
+        dict: Measurements of the build.
+    Raises:
+        subprocess.CalledProcessError: Raises CalledProcessError if the build fails.
+    """
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                      '--run-build', workdir,
+                                      '--jobs', str(args.jobs),
+                                      '--apt-update-latency', str(args.apt_update_latency),
+                                      '--apt-commit-latency', str(args.apt_commit_latency),
+                                      '--apt-fetch-latency', str(args.apt_fetch_latency)] +
+                                     ([] if args.prefetch else ['--no-prefetch']))
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def format_row(cells):
+    """
+    Format a row of the results table.
+    Args:
+        cells (list): Values of the row.
+    Returns:
+        str: Formatted row.
+    Raises:
+        None
+    """
+    return "{0:<10} {1:<8} {2:<6} {3:>10} {4:>10} {5:>10} {6:>12} {7:>12} {8:>10}".format(*cells)
+
+
+def benchmark(args):
+    """
+    Generate and build every requested scenario at every requested scale.
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+    Returns:
+        list: Measurements of every build.
+    Raises:
+        subprocess.CalledProcessError: Raises CalledProcessError if a build fails.
+    """
+    results = []
+    print(format_row(['scenario', 'scale', 'run', 'wall s', 'syscr', 'syscw',
+                      'read bytes', 'write bytes', 'rss MiB']))
+    for scenario in args.scenarios:
+        for scale in args.scales:
+            workdir = tempfile.mkdtemp(prefix="lego-bench-{0}-{1}-".format(scenario, scale))
+            try:
+                generate(workdir, scenario, SCALES[scale][scenario])
+                for run in ['cold', 'warm']:
+                    result = measure(workdir, args)
+                    result.update({'scenario': scenario, 'scale': scale, 'run': run})
+                    results.append(result)
+                    print(format_row([scenario, scale, run,
+                                      "{0:.3f}".format(result['wall'])] +
+                                     [result['io'].get(name, '-') for name in IO_COUNTERS] +
+                                     ["{0:.1f}".format(result['max_rss_kb'] / 1024.0)]))
+                    sys.stdout.flush()
+            finally:
+                if args.keep:
+                    print("Kept `{0}`".format(workdir))
+                else:
+                    shutil.rmtree(workdir)
+    return results
+
+
+def main():
+    """
+    Main function to run the benchmarks.
+    Args:
+        None
+    Returns:
+        None
+    Raises:
+        None
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', dest='scenarios', action='append', choices=SCENARIOS,
+                        help="Scenario to run, may be given more than once. "
+                        "Defaults to all of them")
+    parser.add_argument('--scale', dest='scales', action='append', choices=sorted(SCALES),
+                        help="Scale to run, may be given more than once. "
+                        "Defaults to small and medium")
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="Number of bricks that may run at the same time")
+    parser.add_argument('--apt-update-latency', type=float, default=0.5,
+                        help="Seconds a stub package list update takes")
+    parser.add_argument('--apt-commit-latency', type=float, default=0.05,
+                        help="Seconds a stub apt commit takes")
+    parser.add_argument('--apt-fetch-latency', type=float, default=0.02,
+                        help="Seconds downloading a stub package archive takes")
+    parser.add_argument('--no-prefetch', dest='prefetch', default=True, action='store_false',
+                        help="Do not download package archives in the background")
+    parser.add_argument('--output', default=None,
+                        help="Also write the results to this JSON file")
+    parser.add_argument('--keep', default=False, action='store_true',
+                        help="Keep the generated builder files")
+    parser.add_argument('--run-build', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.run_build:
+        run_build(args.run_build, args.jobs, args.apt_update_latency, args.apt_commit_latency,
+                  args.apt_fetch_latency, args.prefetch)
+        return
+
+    args.scenarios = args.scenarios or SCENARIOS
+    args.scales = args.scales or ['small', 'medium']
+    results = benchmark(args)
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(results, stream, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Stand in for the python-apt module, so package bricks can be benchmarked
+without a Debian system. Installed packages are kept in a JSON file, so a
+warm run sees what the cold run installed. Like python-apt, a cache only
+sees what a commit changed once it is opened again.
+"""
+
+
+import json
+import os
+import sys
+import threading
+import time
+import types
+
+
+class StubPackage(object):
+    """
+    Package in the stub apt cache.
+    """
+
+    def __init__(self, cache, name):
+        self.cache = cache
+        self.name = name
+
+    @property
+    def is_installed(self):
+        """
+        Return whether the package is installed.
+        Args:
+            None
+        Returns:
+            bool: True if the package is installed, false otherwise.
+        Raises:
+            None
+        """
+        return self.name in self.cache.installed
+
+    def mark_install(self):
+        """
+        Mark the package for install.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.cache.marks[self.name] = True
+
+    def mark_delete(self, auto_fix=True, purge=False):  # pylint: disable=unused-argument
+        """
+        Mark the package for removal.
+        Args:
+            auto_fix (bool): Ignored.
+            purge (bool): Ignored.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.cache.marks[self.name] = False
+
+
+class StubCache(object):
+    """
+    Apt cache whose update, downloads and commit only sleep.
+    """
+
+    state_file = None
+    available = frozenset()
+    update_latency = 0.0
+    commit_latency = 0.0
+    fetch_latency = 0.0
+    # Installed packages of the stub system, when there is no state file.
+    system_installed = set()
+    # Packages whose archive is in the stub archive cache, shared by all caches.
+    archives = set()
+    archives_lock = threading.Lock()
+
+    def __init__(self, rootdir=None, progress=None):  # pylint: disable=unused-argument
+        self.marks = {}
+        self.installed = set()
+        self.__lock = threading.Lock()
+        self.open()
+
+    def update(self, *args, **kwargs):  # pylint: disable=unused-argument
+        """
+        Pretend to refresh the package lists.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        time.sleep(self.update_latency)
+
+    def open(self, *args, **kwargs):  # pylint: disable=unused-argument
+        """
+        Read the installed packages from the state file and drop all marks.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.marks = {}
+        self.installed = self.__system_installed()
+
+    def clear(self):
+        """
+        Drop all marks.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.marks = {}
+
+    def __system_installed(self):
+        """
+        Read the packages installed on the stub system.
+        Args:
+            None
+        Returns:
+            set: Names of the installed packages.
+        Raises:
+            None
+        """
+        if not self.state_file:
+            return set(StubCache.system_installed)
+        if not os.path.isfile(self.state_file):
+            return set()
+        with open(self.state_file, 'r') as stream:
+            return set(json.load(stream))
+
+    def __getitem__(self, name):
+        if name not in self.available:
+            raise KeyError(name)
+        return StubPackage(self, name)
+
+    def __download(self):
+        """
+        Download the archives of the packages marked for install that are
+        not in the archive cache yet, sleeping for the fetch latency each.
+        Args:
+            None
+        Returns:
+            int: Number of archives downloaded.
+        Raises:
+            None
+        """
+        downloaded = 0
+        with StubCache.archives_lock:
+            for name, install in sorted(self.marks.items()):
+                if install and name not in StubCache.archives:
+                    time.sleep(self.fetch_latency)
+                    StubCache.archives.add(name)
+                    downloaded += 1
+        return downloaded
+
+    def fetch_archives(self, *args, **kwargs):  # pylint: disable=unused-argument
+        """
+        Download the archives of the packages marked for install.
+        Args:
+            None
+        Returns:
+            int: Number of archives downloaded.
+        Raises:
+            None
+        """
+        return self.__download()
+
+    def commit(self, *args, **kwargs):  # pylint: disable=unused-argument
+        """
+        Download the archives that are missing and apply the marked packages
+        to the stub system after sleeping for the commit latency. The cache
+        itself, and its marks, are left as they are until it is opened again.
+        Args:
+            None
+        Returns:
+            bool: Always True.
+        Raises:
+            None
+        """
+        with self.__lock:
+            self.__download()
+            time.sleep(self.commit_latency)
+            installed = self.__system_installed()
+            for name, install in self.marks.items():
+                if install:
+                    installed.add(name)
+                else:
+                    installed.discard(name)
+            if self.state_file:
+                with open(self.state_file, 'w') as stream:
+                    json.dump(sorted(installed), stream)
+            else:
+                StubCache.system_installed = installed
+        return True
+
+
+def install(state_file, available,  # pylint: disable=too-many-arguments
+            update_latency=0.0, commit_latency=0.0, fetch_latency=0.0):
+    """
+    Make `import apt` return the stub module.
+    Args:
+        state_file (str): JSON file to keep installed packages in.
+        available (iterable): Names of the packages in the stub cache.
+        update_latency (float): Seconds a package list update takes.
+        commit_latency (float): Seconds a commit takes.
+        fetch_latency (float): Seconds downloading a package archive takes.
+    Returns:
+        module: Stub apt module.
+    Raises:
+        None
+    """
+    StubCache.state_file = state_file
+    StubCache.available = frozenset(available)
+    StubCache.update_latency = update_latency
+    StubCache.commit_latency = commit_latency
+    StubCache.fetch_latency = fetch_latency
+    StubCache.system_installed = set()
+    StubCache.archives = set()
+
+    apt_module = types.ModuleType('apt')
+    cache_module = types.ModuleType('apt.cache')
+    cache_module.Cache = StubCache
+    apt_module.cache = cache_module
+    apt_module.Cache = StubCache
+    sys.modules['apt'] = apt_module
+    sys.modules['apt.cache'] = cache_module
+    return apt_module
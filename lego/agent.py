@@ -0,0 +1,165 @@
+"""
+Long running agent that applies a builder file again whenever its inputs change.
+"""
+
+
+import logging
+import os
+from lego.builder import Builder, select_bricks
+from lego.common import LegoException
+from lego.context import BuildContext
+from lego.watcher import make_watcher
+
+
+class Agent(object):
+    """
+    Keeps a builder file loaded and its caches warm, and re-applies the
+    bricks whose files change. Changing the builder file or a bricks file
+    reloads the build, and every brick whose fingerprint changed runs again.
+    """
+
+    def __init__(self, builder_file, context=None,  # pylint: disable=too-many-arguments
+                 use_cache=True, jobs=1, debounce=0.2, watcher=None):
+        self.__logger = logging.getLogger('lego.agent.Agent')
+        self.__builder_file = builder_file
+        self.__context = context if context is not None else BuildContext()
+        self.__use_cache = use_cache
+        self.__jobs = jobs
+        self.__debounce = debounce
+        self.__watcher = watcher if watcher is not None else make_watcher()
+        self.__builder = None
+        self.__plan = None
+        self.__config_paths = set()
+        self.__bricks_by_path = {}
+
+    def __load(self):
+        """
+        Load and compile the builder file and start watching everything it uses.
+        A build that fails to load is reported and the last good one, if
+        any, is kept along with the brick sets directory and variables it
+        was loaded with. The builder file and bricks files are watched
+        either way, so fixing them is picked up.
+        Args:
+            None
+        Returns:
+            bool: True if the build was loaded, false otherwise.
+        Raises:
+            None
+        """
+        builder = None
+        # Loading sets these on the shared context before it can fail.
+        loaded_with = (self.__context.brick_sets_dir, self.__context.variables)
+        try:
+            builder = Builder(builder_file=self.__builder_file, context=self.__context,
+                              use_cache=self.__use_cache)
+            plan = builder.compile()
+        except LegoException as lego_ex:
+            files = builder.files if builder is not None else [self.__builder_file]
+            self.__context.brick_sets_dir, self.__context.variables = loaded_with
+            self.__config_paths |= set(os.path.abspath(path) for path in files)
+            self.__watcher.watch(self.__config_paths)
+            if self.__plan is None:
+                self.__logger.error("Could not load `%s`, nothing is applied until it is "
+                                    "fixed. Error: %s", self.__builder_file, lego_ex)
+            else:
+                self.__logger.error("Could not load `%s`, keeping the last good build. "
+                                    "Error: %s", self.__builder_file, lego_ex)
+            return False
+
+        bricks_by_path = {}
+        for planned_brick in plan.bricks:
+            for path in planned_brick.brick.watch_paths():
+                bricks_by_path.setdefault(os.path.abspath(path), set()).add(
+                    planned_brick.brick_id)
+        self.__builder = builder
+        self.__plan = plan
+        self.__config_paths = set(os.path.abspath(path) for path in builder.files)
+        self.__bricks_by_path = bricks_by_path
+        self.__watcher.watch(self.__config_paths | set(bricks_by_path))
+        self.__logger.info("Watching %s path(s) for %s brick(s)",
+                           len(self.__config_paths) + len(bricks_by_path), len(plan.bricks))
+        return True
+
+    def apply(self, changed=None):
+        """
+        Apply the bricks affected by changed paths.
+        Args:
+            changed (set): Changed paths, None to apply every brick.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if changed is not None:
+            self.__refresh_packages(changed)
+        if changed is None or changed & self.__config_paths:
+            if not self.__load() and self.__plan is None:
+                return
+            plan = self.__plan
+        else:
+            brick_ids = set()
+            for path in changed:
+                brick_ids.update(self.__bricks_by_path.get(path, ()))
+            if not brick_ids:
+                return
+            self.__logger.info("Applying %s brick(s) affected by %s changed path(s)",
+                               len(brick_ids), len(changed))
+            plan = select_bricks(self.__plan, brick_ids)
+
+        try:
+            self.__builder.build(jobs=self.__jobs, plan=plan)
+        except Exception as ex:  # pylint: disable=broad-except
+            self.__logger.error("Applying `%s` failed with error %s", self.__builder_file, ex)
+
+    def __refresh_packages(self, changed):
+        """
+        Read the installed packages into the apt cache again if dpkg changed
+        them, E.G a package was removed by hand.
+        Args:
+            changed (set): Changed paths.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        from lego.brick_modules.packages import DPKG_STATUS_FILE
+        if os.path.abspath(self.__context.rebase(DPKG_STATUS_FILE)) in changed:
+            self.__context.apt_cache_manager.reopen()
+
+    def __wait(self):
+        """
+        Wait for a change, then for the changes to settle, so a burst of
+        changes is applied once.
+        Args:
+            None
+        Returns:
+            set: Changed paths.
+        Raises:
+            OSError: Raises OSError.
+        """
+        changed = set(self.__watcher.wait())
+        while True:
+            more = self.__watcher.wait(self.__debounce)
+            if not more:
+                return changed
+            changed.update(more)
+
+    def run(self):
+        """
+        Apply every brick, then keep applying the bricks affected by changes
+        until interrupted.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.apply()
+        try:
+            while True:
+                self.apply(self.__wait())
+        except KeyboardInterrupt:
+            self.__logger.info('Stopping agent')
+        finally:
+            self.__watcher.close()
@@ -4,7 +4,30 @@ Brick modle and related items.
 
 
 import logging
+from collections import OrderedDict
 from lego.common import LegoException
+from lego.context import BuildContext
+
+
+# Attribute schemas compiled to sets, keyed by the supported and compulsory attributes.
+SCHEMAS = {}
+
+
+def make_drift(target, attribute, expected, actual):
+    """
+    Describe a difference between the system and a brick, as found by `check`.
+    Args:
+        target (str): File, package or command that differs.
+        attribute (str): What differs, E.G `content` or `mode`.
+        expected (object): Value the brick asks for.
+        actual (object): Value found on the system.
+    Returns:
+        dict: Description of the difference.
+    Raises:
+        None
+    """
+    return OrderedDict([('target', target), ('attribute', attribute),
+                        ('expected', expected), ('actual', actual)])
 
 
 class Brick(object):  # pylint: disable=too-few-public-methods
@@ -12,12 +35,20 @@ class Brick(object):  # pylint: disable=too-few-public-methods
     Models a brick object.
     """
 
+    # Attributes every brick accepts to order itself against other bricks.
+    scheduling_attributes = [
+        'requires',
+        'before'
+    ]
+
     def __init__(self,  # pylint: disable=too-many-arguments
                  name,
                  provided_attributes,
                  supported_attributes,
-                 compulsory_attributes):
+                 compulsory_attributes,
+                 context=None):
         self.name = name
+        self.context = context if context is not None else BuildContext()
         self.logger = logging.getLogger("lego.brick_modules.package_brick.{0}".format(name))
         self.provided_attributes = provided_attributes
         self.supported_attributes = supported_attributes
@@ -25,6 +56,7 @@ class Brick(object):  # pylint: disable=too-few-public-methods
         self.logger.info("Validating provided main attributes for the brick `%s`", name)
         if not self.__validate_attributes():
             raise LegoException('Attribute validation failed')
+        self.validate()
 
     def __validate_attributes(self):
         """
@@ -41,18 +73,52 @@ class Brick(object):  # pylint: disable=too-few-public-methods
                           "and compulsory_attributes `%s`",
                           self.provided_attributes, self.supported_attributes,
                           self.compulsory_attributes)
-        for provided_attribute in self.provided_attributes:
-            if provided_attribute not in self.supported_attributes:
-                self.logger.error("Unknown attribute `%s`. Supported attributes are `%s`",
-                                  provided_attribute, self.supported_attributes)
-                return False
-        for compulsory_attribute in self.compulsory_attributes:
-            if compulsory_attribute not in self.provided_attributes:
-                self.logger.error("Compulsory attribute `%s` is not provided",
-                                  compulsory_attribute)
-                return False
+        supported, compulsory = self.__schema()
+        unknown = [attribute for attribute in self.provided_attributes
+                   if attribute not in supported]
+        if unknown:
+            self.logger.error("Unknown attribute `%s`. Supported attributes are `%s`",
+                              unknown[0], self.supported_attributes)
+            return False
+        missing = compulsory.difference(self.provided_attributes)
+        if missing:
+            self.logger.error("Compulsory attribute `%s` is not provided",
+                              sorted(missing)[0])
+            return False
         return True
 
+    def __schema(self):
+        """
+        Get the supported and compulsory attributes of this brick as sets.
+        The sets are built once and shared by every brick with the same attributes.
+        Args:
+            None
+        Returns:
+            tuple: Supported attributes and compulsory attributes, as frozensets.
+        Raises:
+            None
+        """
+        key = (tuple(self.supported_attributes), tuple(self.compulsory_attributes))
+        schema = SCHEMAS.get(key)
+        if schema is None:
+            schema = (frozenset(self.supported_attributes) | frozenset(Brick.scheduling_attributes),
+                      frozenset(self.compulsory_attributes))
+            SCHEMAS[key] = schema
+        return schema
+
+    def validate(self):
+        """
+        Check the values of the provided attributes, before anything runs.
+        If needed must be overwritten by the subclasses.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException if an attribute is invalid.
+        """
+        pass
+
     def __run_setup(self):
         """
         Do any setup work needed by bricks.
@@ -66,6 +132,63 @@ class Brick(object):  # pylint: disable=too-few-public-methods
         """
         pass
 
+    def fingerprint(self):
+        """
+        Fingerprint the brick attributes and the current state of its targets.
+        Bricks with an unchanged fingerprint since their last successful run
+        are skipped. Must be overwritten by subclasses that can be skipped.
+        Args:
+            None
+        Returns:
+            str: Fingerprint, or None if the brick must always run.
+        Raises:
+            None
+        """
+        return None
+
+    def watch_paths(self):
+        """
+        List the paths whose changes mean this brick has to be applied again,
+        E.G its source and destination files. Used by `lego agent`.
+        If needed must be overwritten by the subclasses.
+        Args:
+            None
+        Returns:
+            list: Paths to watch.
+        Raises:
+            None
+        """
+        return []
+
+    def prefetch(self):
+        """
+        Start fetching what this brick will need, E.G package archives, in
+        the background. Called for every brick when a build starts, so it must
+        return quickly. If needed must be overwritten by the subclasses.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        pass
+
+    def check(self):
+        """
+        Compare the system with this brick, without changing anything.
+        If needed must be overwritten by the subclasses.
+        Args:
+            None
+        Returns:
+            list: Differences found, each a dict with the `target`, the
+                  `attribute` that differs and its `expected` and `actual`
+                  values. None if this brick can not be checked.
+        Raises:
+            LegoException: Raises LegoException if the check can not be done.
+        """
+        return None
+
     def run_brick(self):
         """
         Run this brick.
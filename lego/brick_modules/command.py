@@ -3,9 +3,102 @@ Module to manage services on the system.
 """
 
 
-from os import system
-from lego.brick import Brick
+import os
+import signal
+import subprocess
+import sys
+import threading
+from os.path import exists
+from lego.brick import Brick, make_drift
 from lego.common import LegoException
+from lego.scheduler import run_keyed
+
+
+COMMAND_ATTRIBUTES = [
+    'command',
+    'timeout',
+    'creates',
+    'unless',
+    'onlyif'
+]
+
+GUARD_ATTRIBUTES = [
+    'creates',
+    'unless',
+    'onlyif'
+]
+
+OUTPUT_MODES = [
+    'stream',
+    'capture'
+]
+
+# Run every command in its own session so a timeout can kill its children too.
+if sys.version_info[0] >= 3:
+    SESSION_ARGUMENTS = {'start_new_session': True}
+else:
+    SESSION_ARGUMENTS = {'preexec_fn': os.setsid}
+
+
+def check_timeout(timeout):
+    """
+    Check a `timeout` given for a brick or a command.
+    Args:
+        timeout (object): Seconds to wait before a command is killed, None to wait forever.
+    Returns:
+        None
+    Raises:
+        LegoException: Raises LegoException if the timeout is not a positive number.
+    """
+    if timeout is None:
+        return
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0:
+        raise LegoException("Timeout `{0}` must be a positive number".format(timeout))
+
+
+def run_command(command, timeout=None, capture=False, env=None):
+    """
+    Run a shell command.
+    Args:
+        command (str): Command to run.
+        timeout (int): Seconds to wait before the command is killed, None to wait forever.
+        capture (bool): Capture stdout and stderr instead of streaming them.
+        env (dict): Environment of the command, None to inherit the environment.
+    Returns:
+        tuple: Exit code and the captured output, None if not captured.
+    Raises:
+        LegoException: Raises LegoException if the command timed out.
+    """
+    pipe = subprocess.PIPE if capture else None
+    process = subprocess.Popen(command, shell=True, stdout=pipe,
+                               stderr=subprocess.STDOUT if capture else None,
+                               env=env, **SESSION_ARGUMENTS)
+    timed_out = []
+
+    def kill():
+        timed_out.append(True)
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+    try:
+        output, _ = process.communicate()
+    finally:
+        if timer is not None:
+            timer.cancel()
+            timer.join()
+    if timed_out:
+        raise LegoException("Command `{0}` timed out after {1} "
+                            "seconds".format(command, timeout))
+    if output is not None and not isinstance(output, str):
+        output = output.decode('utf-8', 'replace')
+    return process.returncode, output
 
 
 class CommandBrick(Brick):  # pylint: disable=too-few-public-methods
@@ -13,21 +106,29 @@ class CommandBrick(Brick):  # pylint: disable=too-few-public-methods
     Modles a command brick.
     """
 
-    supported_attributes = compulsory_attributes = [
+    compulsory_attributes = [
         'type',
         'commands'
     ]
 
-    def __init__(self, provided_attributes):
+    supported_attributes = compulsory_attributes + [
+        'parallel',
+        'timeout',
+        'output'
+    ]
+
+    def __init__(self, provided_attributes, context=None, brick_set_name=None):
+        self.brick_set_name = brick_set_name
         self.provided_attributes = provided_attributes
         super(CommandBrick, self).__init__(name='command_brick',
                                            provided_attributes=self.provided_attributes,
                                            supported_attributes=CommandBrick.supported_attributes,
-                                           compulsory_attributes=CommandBrick.compulsory_attributes)
+                                           compulsory_attributes=CommandBrick.compulsory_attributes,
+                                           context=context)
 
-    def run_brick(self):
+    def validate(self):
         """
-        Manage a given set of commands.
+        Check the output mode, parallelism, timeout and every command entry.
         Args:
             None
         Returns:
@@ -35,9 +136,180 @@ class CommandBrick(Brick):  # pylint: disable=too-few-public-methods
         Raises:
             LegoException: Raises LegoException.
         """
+        if self.provided_attributes.get('output', 'stream') not in OUTPUT_MODES:
+            raise LegoException("Unsupported output `{0}`. Supported outputs "
+                                "are `{1}`".format(self.provided_attributes['output'],
+                                                   OUTPUT_MODES))
+        parallel = self.provided_attributes.get('parallel') or 1
+        if not isinstance(parallel, int) or parallel < 1:
+            raise LegoException("Parallel `{0}` must be a positive integer".format(parallel))
+        check_timeout(self.provided_attributes.get('timeout'))
         for each_command in self.provided_attributes['commands']:
-            self.logger.info("Command `%s` will run on the system", each_command)
-            return_code = system(each_command)
+            self.__command_details(each_command)
+
+    def __command_details(self, each_command):
+        """
+        Normalise a command entry, which is either a command or a mapping.
+        Args:
+            each_command (str or dict): Command entry.
+        Returns:
+            dict: Command entry with at least `command` and `timeout`.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        if not isinstance(each_command, dict):
+            each_command = {'command': each_command}
+        for attribute in each_command:
+            if attribute not in COMMAND_ATTRIBUTES:
+                raise LegoException("Unknown attribute `{0}` for command `{1}`. Supported "
+                                    "attributes are `{2}`".format(attribute, each_command,
+                                                                  COMMAND_ATTRIBUTES))
+        if 'command' not in each_command:
+            raise LegoException("Command `{0}` is missing `command`".format(each_command))
+        check_timeout(each_command.get('timeout'))
+        details = dict(each_command)
+        details.setdefault('timeout', self.provided_attributes.get('timeout'))
+        return details
+
+    def __environment(self):
+        """
+        Get the environment commands run with. `LEGO_ROOT` is set to the
+        root the build applies to.
+        Args:
+            None
+        Returns:
+            dict: Environment variables.
+        Raises:
+            None
+        """
+        environment = dict(os.environ)
+        environment['LEGO_ROOT'] = self.context.root or '/'
+        return environment
+
+    def __guard_skips(self, details):
+        """
+        Check the `creates`, `onlyif` and `unless` guards of a command.
+        `creates` only needs a stat, so it is checked before anything is spawned.
+        It is a path under the build root.
+        Args:
+            details (dict): Normalised command entry.
+        Returns:
+            str: Reason to skip the command, or None if it must run.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        if 'creates' in details and exists(self.context.rebase(details['creates'])):
+            return "`{0}` exists".format(details['creates'])
+        if 'onlyif' in details:
+            return_code, _ = run_command(details['onlyif'], timeout=details['timeout'],
+                                         capture=True, env=self.__environment())
             if return_code != 0:
-                raise LegoException("None 0 exit code `{0}` returned from "
-                                    "command `{1}`".format(return_code, each_command))
+                return "`{0}` exited with `{1}`".format(details['onlyif'], return_code)
+        if 'unless' in details:
+            return_code, _ = run_command(details['unless'], timeout=details['timeout'],
+                                         capture=True, env=self.__environment())
+            if return_code == 0:
+                return "`{0}` succeeded".format(details['unless'])
+        return None
+
+    def __run_command(self, each_command):
+        """
+        Run a single command entry, timing it with the build profiler.
+        Args:
+            each_command (str or dict): Command entry.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        details = self.__command_details(each_command)
+        with self.context.profiler.span(details['command'], 'command'):
+            self.__run_command_details(details)
+
+    def __run_command_details(self, details):
+        """
+        Run a single command entry, unless its guards say it is not needed.
+        Args:
+            details (dict): Normalised command entry.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        skip_reason = self.__guard_skips(details)
+        if skip_reason is not None:
+            self.logger.info("Skipping command `%s`, %s", details['command'], skip_reason)
+            return
+
+        self.logger.info("Command `%s` will run on the system", details['command'])
+        capture = self.provided_attributes.get('output', 'stream') == 'capture'
+        return_code, output = run_command(details['command'], timeout=details['timeout'],
+                                          capture=capture, env=self.__environment())
+        if output:
+            self.logger.info("Output of command `%s`:\n%s", details['command'], output.rstrip())
+        if return_code != 0:
+            raise LegoException("None 0 exit code `{0}` returned from "
+                                "command `{1}`".format(return_code, details['command']))
+
+    def watch_paths(self):
+        """
+        List the `creates` paths of the commands of this brick.
+        Args:
+            None
+        Returns:
+            list: Paths to watch.
+        Raises:
+            None
+        """
+        return [self.context.rebase(details['creates'])
+                for details in (self.__command_details(each_command)
+                                for each_command in self.provided_attributes['commands'])
+                if 'creates' in details]
+
+    def check(self):
+        """
+        Evaluate the guards of the commands of this brick, without running
+        the commands. A command whose guards say it would run is reported.
+        Commands without guards always run, so they are not checked.
+        Args:
+            None
+        Returns:
+            list: Differences found.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        drift = []
+        for each_command in self.provided_attributes['commands']:
+            details = self.__command_details(each_command)
+            if not any(attribute in details for attribute in GUARD_ATTRIBUTES):
+                continue
+            if self.__guard_skips(details) is None:
+                drift.append(make_drift(details['command'], 'would_run', False, True))
+        return drift
+
+    def run_brick(self):
+        """
+        Manage a given set of commands.
+        Commands run one after another and stop at the first failure, unless
+        `parallel` is set above 1, in which case up to that many independent
+        commands run at the same time and all failures are reported together.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        parallel = self.provided_attributes.get('parallel') or 1
+        if parallel == 1:
+            for each_command in self.provided_attributes['commands']:
+                self.__run_command(each_command)
+            return
+
+        failures = run_keyed(items=list(enumerate(self.provided_attributes['commands'])),
+                             key=lambda indexed_command: indexed_command[0],
+                             func=lambda indexed_command: self.__run_command(indexed_command[1]),
+                             jobs=parallel)
+        if failures:
+            raise LegoException("{0} command(s) failed: {1}".format(
+                len(failures), '; '.join(str(error) for _, error in failures)))
@@ -3,15 +3,45 @@ Module to manage files on the system.
 """
 
 
+import errno
+import glob
+import hashlib
+import io
 import logging
-from os.path import isfile
-from os import chmod, chown
-from hashlib import md5
-from shutil import copyfile, rmtree
+import threading
+from os.path import dirname, isdir, isfile, join, relpath
+from os import chmod, chown, lchown, lstat, makedirs, stat, walk
+from stat import S_IMODE, S_ISLNK
 import pwd
 import grp
-from lego.brick import Brick
+from lego.brick import Brick, make_drift
 from lego.common import LegoException
+from lego.copier import atomic_copy, atomic_write, delta_copy
+from lego.digests import get_checksum, get_data_checksum
+from lego.journal import make_fingerprint
+from lego.remover import remove
+from lego.scheduler import run_keyed
+from lego.templates import render_template, template_variables
+
+
+# Loggers of the functions run for every file entry, created once instead of on every call.
+CREATE_FILE_LOGGER = logging.getLogger('lego.brick_modules.files.create_file')
+REMOVE_PATH_LOGGER = logging.getLogger('lego.brick_modules.files.remove_path')
+RECONCILE_METADATA_LOGGER = logging.getLogger('lego.brick_modules.files.reconcile_metadata')
+WRITE_FILE_LOGGER = logging.getLogger('lego.brick_modules.files.write_file')
+
+# File entries that stand for many files, expanded one file at a time as they are managed.
+EXPANDED_ENTRIES = [
+    'glob',
+    'directory',
+    'manifest'
+]
+
+# Attributes a glob, directory or manifest entry accepts besides its own key.
+EXPANDED_ENTRY_ATTRIBUTES = [
+    'destination',
+    'delta'
+]
 
 
 def get_md5_checksum(file_to_get_md5):
@@ -24,105 +54,311 @@ def get_md5_checksum(file_to_get_md5):
     Raises:
         None
     """
-    hash_md5 = md5()
-    with open(file_to_get_md5, "rb") as open_file:
-        for chunk in iter(lambda: open_file.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
+    return get_checksum(file_to_get_md5, algorithm='md5')
 
 
-def create_file(destination, source=None):
+def create_file(destination, source=None,  # pylint: disable=too-many-arguments
+                digest_index=None, mode=None, uid=None, gid=None, delta=False):
     """
     Create a file based on a source and a destination.
     If no source is provided, this function will simply return.
+    The file is written next to the destination and renamed into place with
+    the given mode and owner, so it is never seen partially written.
+    In delta mode, an existing destination is updated by only rewriting the
+    blocks that differ from the source.
     Args:
         destination (str): Destination file to be created.
         source (str): Source file to use for creating the destination.
+        digest_index (DigestIndex): Index to look up file digests in, if any.
+        mode (int): Mode to create the file with.
+        uid (int): User id to create the file with.
+        gid (int): Group id to create the file with.
+        delta (bool): Update an existing destination block by block.
     Returns:
-        None
+        bool: True if the file was written, false if it was left unchanged.
     Raises:
         None
     """
-    logger = logging.getLogger('lego.brick_modules.files.create_file')
+    logger = CREATE_FILE_LOGGER
 
     if not source:
         logger.info("No source file provided for destination file `%s`. File will not be changed",
                     destination)
-        return
+        return False
 
     logger.info("Creating file `%s` from `%s`", destination, source)
 
     # Check if destination file exisits
     if isfile(destination):
-        source_file_md5 = get_md5_checksum(file_to_get_md5=source)
-        destination_file_md5 = get_md5_checksum(file_to_get_md5=destination)
-        if source_file_md5 == destination_file_md5:
-            logger.info("Both source file `%s` and destination file `%s` "
-                        "are the same with md5 checksum `%s`",
-                        source, destination, source_file_md5)
-            logger.info('Skipping - Nothing to do')
-            return
-        logger.info("Destination file `%s` exists, but different to the source `%s`. "
-                    "It'll be overwritten.", destination, source)
-    copyfile(source, destination)
-
-def remove_path(path):
-    """
-    Remove a given file or directory.
+        source_stat = stat(source)
+        destination_stat = stat(destination)
+        if source_stat.st_size != destination_stat.st_size:
+            logger.info("Destination file `%s` exists, but its size differs from the "
+                        "source `%s`. It'll be overwritten.", destination, source)
+        else:
+            if digest_index is not None:
+                source_file_digest = digest_index.digest(source, source_stat)
+                destination_file_digest = digest_index.digest(destination, destination_stat)
+            else:
+                source_file_digest = get_checksum(file_to_hash=source)
+                destination_file_digest = get_checksum(file_to_hash=destination)
+            if source_file_digest == destination_file_digest:
+                logger.info("Both source file `%s` and destination file `%s` "
+                            "are the same with checksum `%s`",
+                            source, destination, source_file_digest)
+                logger.info('Skipping - Nothing to do')
+                return False
+            logger.info("Destination file `%s` exists, but different to the source `%s`. "
+                        "It'll be overwritten.", destination, source)
+        if delta:
+            written = delta_copy(source, destination, mode=mode, uid=uid, gid=gid)
+            logger.info("Updated `%s` from `%s` with %s of %s bytes written",
+                        destination, source, written, source_stat.st_size)
+            return True
+    atomic_copy(source, destination, mode=mode, uid=uid, gid=gid)
+    return True
+
+
+def write_file(destination, data,  # pylint: disable=too-many-arguments
+               digest_index=None, mode=None, uid=None, gid=None):
+    """
+    Create a file with the given contents, E.G a rendered template.
+    The contents are hashed in memory and compared with the digest of the
+    destination, so a destination that is up to date is not written.
+    Args:
+        destination (str): Destination file to be created.
+        data (bytes): Contents of the file.
+        digest_index (DigestIndex): Index to look up file digests in, if any.
+        mode (int): Mode to create the file with.
+        uid (int): User id to create the file with.
+        gid (int): Group id to create the file with.
+    Returns:
+        bool: True if the file was written, false if it was left unchanged.
+    Raises:
+        None
+    """
+    logger = WRITE_FILE_LOGGER
+    logger.info("Writing file `%s`", destination)
+
+    if isfile(destination):
+        destination_stat = stat(destination)
+        if destination_stat.st_size == len(data):
+            if digest_index is not None:
+                data_digest = get_data_checksum(data, algorithm=digest_index.algorithm)
+                destination_digest = digest_index.digest(destination, destination_stat)
+            else:
+                data_digest = get_data_checksum(data)
+                destination_digest = get_checksum(file_to_hash=destination)
+            if data_digest == destination_digest:
+                logger.info("Destination file `%s` is up to date with checksum `%s`",
+                            destination, data_digest)
+                logger.info('Skipping - Nothing to do')
+                return False
+        logger.info("Destination file `%s` exists, but its contents differ. "
+                    "It'll be overwritten.", destination)
+    atomic_write(data, destination, mode=mode, uid=uid, gid=gid)
+    return True
+
+
+def make_parents(path):
+    """
+    Create the missing parent directories of a path.
+    Args:
+        path (str): Path whose parent directories must exist.
+    Returns:
+        None
+    Raises:
+        OSError: Raises OSError.
+    """
+    parent = dirname(path)
+    if not parent or isdir(parent):
+        return
+    try:
+        makedirs(parent)
+    except OSError as ex:
+        # Another thread may have just created it.
+        if ex.errno != errno.EEXIST or not isdir(parent):
+            raise
+
+
+def iglob(pattern):
+    """
+    Lazily find the paths matching a pattern, with `**` matching any number
+    of directories where supported.
+    Args:
+        pattern (str): Glob pattern.
+    Returns:
+        iterator: Matching paths.
+    Raises:
+        None
+    """
+    try:
+        return glob.iglob(pattern, recursive=True)
+    except TypeError:  # Python 2
+        return glob.iglob(pattern)
+
+
+def remove_path(path, jobs=1, background=False):
+    """
+    Remove a given file, symlink or directory. A path that does not exist is left alone.
     Args:
         path (str): Path to remove.
+        jobs (int): Maximum number of subtrees of a directory to remove at the same time.
+        background (bool): Rename a directory aside and delete it in the background.
     Returns:
-        None.
+        bool: True if the path was removed, false if it did not exist.
     Raises:
         LegoException: Raises LegoException.
     """
-    logger = logging.getLogger('lego.brick_modules.files.remove_path')
+    logger = REMOVE_PATH_LOGGER
     try:
-        logger.info("Removing path `%s`", path)
-        rmtree(path)
+        logger.info("Removing path `%s`%s", path, ' in the background' if background else '')
+        removed = remove(path, jobs=jobs, background=background)
     except OSError as os_ex:
         raise LegoException("Failed to remove `{0}` with "
                             "error `{1}`".format(path, os_ex))
+    if not removed:
+        logger.info("Path `%s` does not exist. Skipping - Nothing to do", path)
+    return removed
 
 
-def run_chown(path, user, group):
+def read_id_database(path):
     """
-    Set the owner and group of a given file.
+    Read the name to id mapping of a passwd or group file.
     Args:
-        path (str): Path the file.
-        user (str): User file ownership is set to.
-        group (str): Group file ownership is set to.
+        path (str): File in the format of /etc/passwd or /etc/group.
     Returns:
-        None
+        dict: Name to id.
     Raises:
-        None
+        IOError: Raises IOError if the file can not be read.
+    """
+    ids = {}
+    with open(path, 'r') as stream:
+        for line in stream:
+            fields = line.strip().split(':')
+            if len(fields) > 2 and not fields[0].startswith('#'):
+                try:
+                    ids.setdefault(fields[0], int(fields[2]))
+                except ValueError:
+                    continue
+    return ids
+
+
+class IdResolver(object):
+    """
+    Resolves user and group names to ids, looking each name up only once.
+    With a root other than `/`, names are looked up in the passwd and group
+    files of the root, if it has them.
     """
-    logger = logging.getLogger('lego.brick_modules.files.run_chown')
-    uid = pwd.getpwnam(user).pw_uid
-    gid = grp.getgrnam(group).gr_gid
-    logger.info("Changing user to `%s(%s)` and group to `%s(%s)` for `%s`",
-                user, uid, group, gid, path)
-    chown(path, uid, gid)
+
+    def __init__(self, root=None):
+        self.root = root
+        self.__uids = {}
+        self.__gids = {}
+        self.__databases = {}
+        self.__lock = threading.Lock()
+
+    def __root_ids(self, database):
+        """
+        Get the ids from a database file of the root.
+        Args:
+            database (str): `passwd` or `group`.
+        Returns:
+            dict: Name to id, or None to use the databases of this system.
+        Raises:
+            None
+        """
+        if not self.root or self.root == '/':
+            return None
+        if database not in self.__databases:
+            try:
+                self.__databases[database] = read_id_database(
+                    join(self.root, 'etc', database))
+            except (IOError, OSError):
+                self.__databases[database] = None
+        return self.__databases[database]
+
+    def uid(self, user):
+        """
+        Get the id of a user.
+        Args:
+            user (str): User name.
+        Returns:
+            int: User id.
+        Raises:
+            LegoException: Raises LegoException if the user does not exist.
+        """
+        with self.__lock:
+            if user not in self.__uids:
+                root_ids = self.__root_ids('passwd')
+                try:
+                    if root_ids is not None:
+                        self.__uids[user] = root_ids[user]
+                    else:
+                        self.__uids[user] = pwd.getpwnam(user).pw_uid
+                except KeyError:
+                    raise LegoException("User `{0}` does not exist".format(user))
+            return self.__uids[user]
+
+    def gid(self, group):
+        """
+        Get the id of a group.
+        Args:
+            group (str): Group name.
+        Returns:
+            int: Group id.
+        Raises:
+            LegoException: Raises LegoException if the group does not exist.
+        """
+        with self.__lock:
+            if group not in self.__gids:
+                root_ids = self.__root_ids('group')
+                try:
+                    if root_ids is not None:
+                        self.__gids[group] = root_ids[group]
+                    else:
+                        self.__gids[group] = grp.getgrnam(group).gr_gid
+                except KeyError:
+                    raise LegoException("Group `{0}` does not exist".format(group))
+            return self.__gids[group]
 
 
-def run_chmod(path, mode):
+def reconcile_metadata(path, mode, uid, gid):
     """
-    Set the mode on a given file.
+    Set the mode, owner and group of a given path, only issuing the calls
+    needed to fix what differs. Symlinks themselves are changed, not their target.
     Args:
-        path (str): Path the file.
-        mode (int): Mode to set on the file.
+        path (str): Path to reconcile.
+        mode (int): Mode the path should have.
+        uid (int): User id the path should be owned by.
+        gid (int): Group id the path should be owned by.
     Returns:
-        None
+        bool: True if anything was changed, false otherwise.
     Raises:
         LegoException: Raises LegoException.
     """
-    logger = logging.getLogger('lego.brick_modules.files.run_chmod')
-    if len(str(mode)) == 4 and mode.isdigit():
+    logger = RECONCILE_METADATA_LOGGER
+    if not isinstance(mode, int) or isinstance(mode, bool):
         raise LegoException("Mode `{0}` provided for file "
                             "`{1}` is invalid".format(mode, path))
-    logger.info("Setting mode to `%s` on `%s`", mode, path)
-    chmod(path, mode)
-
+    path_stat = lstat(path)
+    changed = False
+    if S_ISLNK(path_stat.st_mode):
+        if (path_stat.st_uid, path_stat.st_gid) != (uid, gid):
+            logger.info("Changing owner of symlink `%s` to `%s:%s`", path, uid, gid)
+            lchown(path, uid, gid)
+            changed = True
+    else:
+        if S_IMODE(path_stat.st_mode) != mode:
+            logger.info("Setting mode to `%s` on `%s`", oct(mode), path)
+            chmod(path, mode)
+            changed = True
+        if (path_stat.st_uid, path_stat.st_gid) != (uid, gid):
+            logger.info("Changing owner to `%s:%s` for `%s`", uid, gid, path)
+            chown(path, uid, gid)
+            changed = True
+    logger.info("Metadata of `%s` %s", path, 'changed' if changed else 'unchanged')
+    return changed
 
 
 class FileBrick(Brick):  # pylint: disable=too-few-public-methods
@@ -130,7 +366,7 @@ class FileBrick(Brick):  # pylint: disable=too-few-public-methods
     Models a file brick.
     """
 
-    supported_attributes = compulsory_attributes = [
+    compulsory_attributes = [
         'type',
         'state',
         'owner',
@@ -139,17 +375,24 @@ class FileBrick(Brick):  # pylint: disable=too-few-public-methods
         'files'
     ]
 
-    def __init__(self, brick_set_name, provided_attributes):
+    supported_attributes = compulsory_attributes + [
+        'concurrency'
+    ]
+
+    def __init__(self, brick_set_name, provided_attributes, context=None):
         self.brick_set_name = brick_set_name
         self.provided_attributes = provided_attributes
         super(FileBrick, self).__init__(name='file_brick',
                                         provided_attributes=self.provided_attributes,
                                         supported_attributes=FileBrick.supported_attributes,
-                                        compulsory_attributes=FileBrick.compulsory_attributes)
+                                        compulsory_attributes=FileBrick.compulsory_attributes,
+                                        context=context)
 
-    def run_brick(self):
+    def validate(self):
         """
-        Manage a given set of files.
+        Check the state, mode and concurrency, and that every file entry has a
+        destination and an existing source. Glob, directory and manifest
+        entries are checked without expanding them.
         Args:
             None
         Returns:
@@ -157,31 +400,574 @@ class FileBrick(Brick):  # pylint: disable=too-few-public-methods
         Raises:
             LegoException: Raises LegoException.
         """
-        for each_file in self.provided_attributes['files']:
-            if 'source' in each_file.keys():
-                source_file = "brick_sets/{0}/files/{1}".format(self.brick_set_name,
-                                                                each_file['source'])
-            else:
-                source_file = None
+        if self.provided_attributes['state'] not in ['present', 'absent']:
+            raise LegoException("Unsupported state `{0}` for files "
+                                "`{1}`".format(self.provided_attributes['state'],
+                                               self.provided_attributes['files']))
+
+        mode = self.provided_attributes['mode']
+        if not isinstance(mode, int) or isinstance(mode, bool):
+            raise LegoException("Mode `{0}` provided for files `{1}` is "
+                                "invalid".format(mode, self.provided_attributes['files']))
 
+        concurrency = self.provided_attributes.get('concurrency') or 1
+        if not isinstance(concurrency, int) or concurrency < 1:
+            raise LegoException("Concurrency `{0}` must be a positive "
+                                "integer".format(concurrency))
+
+        for each_file in self.provided_attributes['files']:
+            if any(kind in each_file for kind in EXPANDED_ENTRIES):
+                self.__validate_expanded_entry(each_file)
+                continue
             if 'destination' not in each_file.keys():
                 raise LegoException("In a file brick, files attribute "
                                     "must have at least the `destination`")
+            if not isinstance(each_file.get('delta', False), bool):
+                raise LegoException("Delta `{0}` for `{1}` must be true or "
+                                    "false".format(each_file['delta'], each_file['destination']))
+            source_file = self.__source_path(each_file)
+            if source_file is not None and not isfile(source_file):
+                raise LegoException("Source file `{0}` for `{1}` does not "
+                                    "exist".format(source_file, each_file['destination']))
+            if not isinstance(each_file.get('background', False), bool):
+                raise LegoException("Background `{0}` for `{1}` must be true or "
+                                    "false".format(each_file['background'],
+                                                   each_file['destination']))
+            if each_file.get('background') and self.provided_attributes['state'] != 'absent':
+                raise LegoException("Background for `{0}` only applies to files that are "
+                                    "`absent`".format(each_file['destination']))
+            if 'template' in each_file:
+                self.__validate_template(each_file)
+            elif 'variables' in each_file:
+                raise LegoException("Variables for `{0}` are only used with a "
+                                    "`template`".format(each_file['destination']))
+
+    def __validate_expanded_entry(self, each_file):
+        """
+        Check a glob, directory or manifest entry. The files it stands for are
+        only looked at when the brick runs.
+        Args:
+            each_file (dict): File entry with `glob`, `directory` or `manifest`.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        kinds = [kind for kind in EXPANDED_ENTRIES if kind in each_file]
+        if len(kinds) > 1:
+            raise LegoException("File entry `{0}` can only have one of `{1}`".format(
+                each_file, EXPANDED_ENTRIES))
+        kind = kinds[0]
+        for attribute in each_file:
+            if attribute != kind and attribute not in EXPANDED_ENTRY_ATTRIBUTES:
+                raise LegoException("Unknown attribute `{0}` for `{1}` `{2}`. Supported "
+                                    "attributes are `{3}`".format(attribute, kind,
+                                                                  each_file[kind],
+                                                                  EXPANDED_ENTRY_ATTRIBUTES))
+        if kind == 'manifest':
+            if 'destination' in each_file:
+                raise LegoException("Manifest `{0}` lists its own destinations, it can not "
+                                    "have a `destination`".format(each_file['manifest']))
+            if not isfile(self.__manifest_path(each_file)):
+                raise LegoException("Manifest `{0}` does not exist".format(
+                    self.__manifest_path(each_file)))
+        elif 'destination' not in each_file:
+            raise LegoException("{0} `{1}` must have a `destination` "
+                                "directory".format(kind.capitalize(), each_file[kind]))
+        if kind == 'directory' and not isdir(join(self.__files_dir(), each_file['directory'])):
+            raise LegoException("Directory `{0}` does not exist".format(
+                join(self.__files_dir(), each_file['directory'])))
+        if not isinstance(each_file.get('delta', False), bool):
+            raise LegoException("Delta `{0}` for `{1}` must be true or "
+                                "false".format(each_file['delta'], each_file[kind]))
+
+    def __validate_template(self, each_file):
+        """
+        Check that a templated file entry has an existing template, and
+        every variable the template uses.
+        Args:
+            each_file (dict): File entry with `template`.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        destination = each_file['destination']
+        if 'source' in each_file:
+            raise LegoException("File `{0}` can not have both a `source` and a "
+                                "`template`".format(destination))
+        if each_file.get('delta'):
+            raise LegoException("Delta is not supported for the template of "
+                                "`{0}`".format(destination))
+        if not isinstance(each_file.get('variables', {}), dict):
+            raise LegoException("Variables for `{0}` must be a mapping".format(destination))
+        template_file = self.__template_path(each_file)
+        if not isfile(template_file):
+            raise LegoException("Template `{0}` for `{1}` does not "
+                                "exist".format(template_file, destination))
+        try:
+            template = self.context.template_cache.get(template_file)
+        except (IOError, OSError, ValueError) as ex:
+            raise LegoException("Template `{0}` for `{1}` can not be read with "
+                                "error {2}".format(template_file, destination, ex))
+        undefined = template_variables(template).difference(self.__variables(each_file))
+        if undefined:
+            raise LegoException("Template `{0}` for `{1}` uses undefined variables "
+                                "`{2}`".format(template_file, destination, sorted(undefined)))
+
+    def __files_dir(self):
+        """
+        Get the directory the sources of this brick are in.
+        Args:
+            None
+        Returns:
+            str: Path of the `files` directory of the brick set.
+        Raises:
+            None
+        """
+        return join(self.context.brick_sets_dir, self.brick_set_name, 'files')
 
-            if self.provided_attributes['state'] not in ['present', 'absent']:
-                raise LegoException("Unsupported state `{0}` "
-                                    "for `{1}`".format(self.provided_attributes['state'],
-                                                       each_file['destination']))
+    def __manifest_path(self, each_file):
+        """
+        Get the path of the manifest of a file entry, next to the bricks file.
+        Args:
+            each_file (dict): File entry with `manifest`.
+        Returns:
+            str: Path of the manifest.
+        Raises:
+            None
+        """
+        return join(self.context.brick_sets_dir, self.brick_set_name, each_file['manifest'])
 
-            if self.provided_attributes['state'] == 'absent':
-                remove_path(path=each_file['destination'])
+    @staticmethod
+    def __expanded_file(each_file, source, destination):
+        """
+        Make the file entry of a single file of a glob, directory or manifest.
+        Args:
+            each_file (dict): Entry the file was expanded from.
+            source (str): Source, relative to the `files` directory.
+            destination (str): Destination of the file.
+        Returns:
+            dict: File entry. Missing parent directories of its destination are created.
+        Raises:
+            None
+        """
+        return {'source': source, 'destination': destination,
+                'delta': each_file.get('delta', False), 'parents': True}
+
+    def __expand_glob(self, each_file):
+        """
+        Expand a glob entry. Matches are placed under the destination by their
+        path below the part of the pattern without wildcards.
+        Args:
+            each_file (dict): File entry with `glob` and `destination`.
+        Returns:
+            generator: File entries.
+        Raises:
+            None
+        """
+        files_dir = self.__files_dir()
+        fixed = []
+        for part in each_file['glob'].split('/')[:-1]:
+            if glob.has_magic(part):
+                break
+            fixed.append(part)
+        base = join(files_dir, *fixed)
+        for match in iglob(join(files_dir, each_file['glob'])):
+            if isfile(match):
+                yield self.__expanded_file(each_file, relpath(match, files_dir),
+                                           join(each_file['destination'], relpath(match, base)))
+
+    def __expand_directory(self, each_file):
+        """
+        Expand a directory entry into every file below the directory.
+        Args:
+            each_file (dict): File entry with `directory` and `destination`.
+        Returns:
+            generator: File entries.
+        Raises:
+            None
+        """
+        files_dir = self.__files_dir()
+        directory = join(files_dir, each_file['directory'])
+        for current_dir, directories, names in walk(directory):
+            directories.sort()
+            for name in sorted(names):
+                path = join(current_dir, name)
+                if isfile(path):
+                    yield self.__expanded_file(each_file, relpath(path, files_dir),
+                                               join(each_file['destination'],
+                                                    relpath(path, directory)))
+
+    def __expand_manifest(self, each_file):
+        """
+        Expand a manifest entry. Each line of the manifest is a source and a
+        destination separated by whitespace. Empty lines and lines starting
+        with `#` are skipped.
+        Args:
+            each_file (dict): File entry with `manifest`.
+        Returns:
+            generator: File entries.
+        Raises:
+            LegoException: Raises LegoException if a line is invalid.
+        """
+        manifest = self.__manifest_path(each_file)
+        with io.open(manifest, 'r', encoding='utf-8') as stream:
+            for number, line in enumerate(stream, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                fields = line.split()
+                if len(fields) != 2:
+                    raise LegoException("Line {0} of manifest `{1}` must be a source and "
+                                        "a destination".format(number, manifest))
+                expanded = self.__expanded_file(each_file, fields[0], fields[1])
+                if (self.provided_attributes['state'] == 'present' and
+                        not isfile(self.__source_path(expanded))):
+                    raise LegoException("Source file `{0}` on line {1} of manifest `{2}` "
+                                        "does not exist".format(fields[0], number, manifest))
+                yield expanded
+
+    def __iter_files(self):
+        """
+        Iterate over the file entries of this brick, expanding glob, directory
+        and manifest entries one file at a time.
+        Args:
+            None
+        Returns:
+            generator: File entries with a single destination each.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        for each_file in self.provided_attributes['files']:
+            if 'glob' in each_file:
+                expanded = self.__expand_glob(each_file)
+            elif 'directory' in each_file:
+                expanded = self.__expand_directory(each_file)
+            elif 'manifest' in each_file:
+                expanded = self.__expand_manifest(each_file)
             else:
-                create_file(destination=each_file['destination'],
-                            source=source_file)
+                expanded = [each_file]
+            for each_expanded_file in expanded:
+                yield each_expanded_file
+
+    def __source_path(self, each_file):
+        """
+        Get the path of the source file of a file entry.
+        Args:
+            each_file (dict): File entry.
+        Returns:
+            str: Path of the source file, or None if the entry has no source.
+        Raises:
+            None
+        """
+        if 'source' not in each_file.keys():
+            return None
+        return join(self.__files_dir(), each_file['source'])
+
+    def __template_path(self, each_file):
+        """
+        Get the path of the template of a file entry.
+        Args:
+            each_file (dict): File entry.
+        Returns:
+            str: Path of the template, or None if the entry has no template.
+        Raises:
+            None
+        """
+        if 'template' not in each_file:
+            return None
+        return join(self.context.brick_sets_dir, self.brick_set_name, 'templates',
+                    each_file['template'])
+
+    def __variables(self, each_file):
+        """
+        Get the variables a file entry is rendered with, those of the builder
+        file overridden by those of the entry.
+        Args:
+            each_file (dict): File entry.
+        Returns:
+            dict: Variable name to value.
+        Raises:
+            None
+        """
+        variables = dict(self.context.variables)
+        variables.update(each_file.get('variables') or {})
+        return variables
+
+    def __render(self, each_file):
+        """
+        Render the template of a file entry.
+        Args:
+            each_file (dict): File entry with `template`.
+        Returns:
+            bytes: Rendered contents.
+        Raises:
+            LegoException: Raises LegoException.
+            IOError: Raises IOError if the template can not be read.
+        """
+        template = self.context.template_cache.get(self.__template_path(each_file))
+        return render_template(template, self.__variables(each_file))
+
+    def __destination(self, each_file):
+        """
+        Get the path of the destination of a file entry, under the build root.
+        Args:
+            each_file (dict): File entry.
+        Returns:
+            str: Path of the destination.
+        Raises:
+            None
+        """
+        return self.context.rebase(each_file['destination'])
+
+    def __target_state(self, each_file):
+        """
+        Describe the current state of a file entry's source and destination.
+        Args:
+            each_file (dict): File entry.
+        Returns:
+            list: Destination, source digest and destination mode, owner,
+                  group and digest, or None for paths that do not exist.
+        Raises:
+            OSError: Raises OSError if the source can not be read.
+        """
+        source_file = self.__source_path(each_file)
+        template_file = self.__template_path(each_file)
+        destination = self.__destination(each_file)
+        source_digest = None
+        if source_file is not None:
+            source_digest = self.context.digest_index.digest(source_file)
+        elif template_file is not None:
+            source_digest = make_fingerprint({
+                'template': self.context.digest_index.digest(template_file),
+                'variables': self.__variables(each_file)})
+        try:
+            destination_stat = lstat(destination)
+        except OSError:
+            return [destination, source_digest, None]
+        destination_digest = None
+        if source_digest is not None and not S_ISLNK(destination_stat.st_mode):
+            destination_digest = self.context.digest_index.digest(destination)
+        return [destination, source_digest, [S_IMODE(destination_stat.st_mode),
+                                             destination_stat.st_uid,
+                                             destination_stat.st_gid,
+                                             destination_digest]]
+
+    def fingerprint(self):
+        """
+        Fingerprint the brick attributes, source digests and destination state.
+        The state of each file is folded in as it is read, so expanded entries
+        are never all held in memory.
+        Args:
+            None
+        Returns:
+            str: Fingerprint, or None if a source or destination can not be read.
+        Raises:
+            None
+        """
+        fingerprint = hashlib.md5(make_fingerprint(self.provided_attributes).encode('utf-8'))
+        try:
+            for each_file in self.__iter_files():
+                fingerprint.update(make_fingerprint(self.__target_state(each_file))
+                                   .encode('utf-8'))
+        except (IOError, OSError, LegoException):
+            return None
+        return fingerprint.hexdigest()
+
+    def watch_paths(self):
+        """
+        List the source, template and destination files of this brick, and
+        the directories and manifests that files are expanded from.
+        Args:
+            None
+        Returns:
+            list: Paths to watch.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        paths = []
+        for each_file in self.provided_attributes['files']:
+            if 'directory' in each_file:
+                paths.append(join(self.__files_dir(), each_file['directory']))
+            elif 'manifest' in each_file:
+                paths.append(self.__manifest_path(each_file))
+        for each_file in self.__iter_files():
+            source_file = self.__source_path(each_file) or self.__template_path(each_file)
+            if source_file is not None:
+                paths.append(source_file)
+            paths.append(self.__destination(each_file))
+        return paths
+
+    def check(self):
+        """
+        Compare the files on the system with this brick. With `concurrency`
+        set above 1, files are checked on that many threads.
+        Args:
+            None
+        Returns:
+            list: Differences found, in the order the files are listed.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        concurrency = self.provided_attributes.get('concurrency') or 1
+        drift = {}
+
+        def check_file(indexed_file):
+            differences = self.__check_file(indexed_file[1])
+            if differences:
+                drift[indexed_file[0]] = differences
+
+        failures = run_keyed(items=enumerate(self.__iter_files()),
+                             key=lambda indexed_file: indexed_file[0],
+                             func=check_file, jobs=concurrency)
+        if failures:
+            raise LegoException("Failed to check {0} file(s): {1}".format(
+                len(failures), '; '.join("`{0}`: {1}".format(each_file.get('destination'), error)
+                                         for (_, each_file), error in failures)))
+        return [difference for index in sorted(drift) for difference in drift[index]]
+
+    def __check_file(self, each_file):
+        """
+        Compare a single file entry with the system.
+        Content is compared through the digest index, so unchanged files are
+        not read again.
+        Args:
+            each_file (dict): File entry with `destination` and optionally `source`.
+        Returns:
+            list: Differences found.
+        Raises:
+            LegoException: Raises LegoException.
+            OSError: Raises OSError if the source can not be read.
+        """
+        destination = self.__destination(each_file)
+        try:
+            destination_stat = lstat(destination)
+        except OSError:
+            destination_stat = None
+        if self.provided_attributes['state'] == 'absent':
+            if destination_stat is None:
+                return []
+            return [make_drift(destination, 'exists', False, True)]
+        if destination_stat is None:
+            return [make_drift(destination, 'exists', True, False)]
+
+        drift = []
+        source_file = self.__source_path(each_file)
+        template_file = self.__template_path(each_file)
+        if (source_file or template_file) is not None and not S_ISLNK(destination_stat.st_mode):
+            digest_index = self.context.digest_index
+            if source_file is not None:
+                source_digest = digest_index.digest(source_file)
+            else:
+                source_digest = get_data_checksum(self.__render(each_file),
+                                                  algorithm=digest_index.algorithm)
+            destination_digest = digest_index.digest(destination, destination_stat)
+            if source_digest != destination_digest:
+                drift.append(make_drift(destination, 'content', source_digest,
+                                        destination_digest))
+        mode = self.provided_attributes['mode']
+        if not S_ISLNK(destination_stat.st_mode) and S_IMODE(destination_stat.st_mode) != mode:
+            drift.append(make_drift(destination, 'mode', "{0:04o}".format(mode),
+                                    "{0:04o}".format(S_IMODE(destination_stat.st_mode))))
+        uid = self.context.id_resolver.uid(self.provided_attributes['owner'])
+        if destination_stat.st_uid != uid:
+            drift.append(make_drift(destination, 'uid', uid, destination_stat.st_uid))
+        gid = self.context.id_resolver.gid(self.provided_attributes['group'])
+        if destination_stat.st_gid != gid:
+            drift.append(make_drift(destination, 'gid', gid, destination_stat.st_gid))
+        return drift
+
+    def run_brick(self):
+        """
+        Manage a given set of files.
+        If `concurrency` is set above 1, files are managed on that many threads.
+        Entries with the same destination are still handled in the order they
+        are listed, and all failures are reported together.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        concurrency = self.provided_attributes.get('concurrency') or 1
+        counts = {'changed': 0, 'total': 0}
+        counts_lock = threading.Lock()
+
+        def manage_file(each_file):
+            changed = self.__manage_file(each_file)
+            with counts_lock:
+                counts['changed'] += int(changed)
+                counts['total'] += 1
+
+        if concurrency == 1:
+            for each_file in self.__iter_files():
+                manage_file(each_file)
+        else:
+            failures = run_keyed(items=self.__iter_files(),
+                                 key=lambda each_file: each_file.get('destination'),
+                                 func=manage_file,
+                                 jobs=concurrency)
+            if failures:
+                raise LegoException("Failed to manage {0} file(s): {1}".format(
+                    len(failures), '; '.join("`{0}`: {1}".format(each_file.get('destination'),
+                                                                 error)
+                                             for each_file, error in failures)))
+        self.logger.info("%s of %s file(s) changed", counts['changed'], counts['total'])
+
+    def __manage_file(self, each_file):
+        """
+        Manage a single file entry, timing it with the build profiler.
+        Args:
+            each_file (dict): File entry with `destination` and optionally `source`.
+        Returns:
+            bool: True if the file was changed, false otherwise.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        with self.context.profiler.span(self.__destination(each_file), 'file'):
+            return self.__manage_file_entry(each_file)
+
+    def __manage_file_entry(self, each_file):
+        """
+        Create or remove a single file entry and set its metadata.
+        Args:
+            each_file (dict): File entry with `destination` and optionally `source`.
+        Returns:
+            bool: True if the file was changed, false otherwise.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        source_file = self.__source_path(each_file)
 
-                run_chmod(path=each_file['destination'],
-                          mode=self.provided_attributes['mode'])
+        if self.provided_attributes['state'] == 'absent':
+            return remove_path(path=self.__destination(each_file),
+                               jobs=self.provided_attributes.get('concurrency') or 1,
+                               background=each_file.get('background', False))
 
-                run_chown(path=each_file['destination'],
-                          user=self.provided_attributes['owner'],
-                          group=self.provided_attributes['group'])
+        uid = self.context.id_resolver.uid(self.provided_attributes['owner'])
+        gid = self.context.id_resolver.gid(self.provided_attributes['group'])
+        destination = self.__destination(each_file)
+        if each_file.get('parents'):
+            make_parents(destination)
+        if 'template' in each_file:
+            content_changed = write_file(destination=destination,
+                                         data=self.__render(each_file),
+                                         digest_index=self.context.digest_index,
+                                         mode=self.provided_attributes['mode'],
+                                         uid=uid,
+                                         gid=gid)
+        else:
+            content_changed = create_file(destination=destination,
+                                          source=source_file,
+                                          digest_index=self.context.digest_index,
+                                          mode=self.provided_attributes['mode'],
+                                          uid=uid,
+                                          gid=gid,
+                                          delta=each_file.get('delta', False))
+        metadata_changed = reconcile_metadata(path=destination,
+                                              mode=self.provided_attributes['mode'],
+                                              uid=uid,
+                                              gid=gid)
+        return content_changed or metadata_changed
@@ -4,8 +4,138 @@ Module to manage packges on a system and it's supporting modules.
 
 
 import logging
-from lego.brick import Brick
+import mmap
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from lego.brick import Brick, make_drift
 from lego.common import LegoException
+from lego.digests import stat_key
+from lego.profiler import CLOCK, NullProfiler
+
+
+# Database of installed packages, rewritten by every dpkg run.
+DPKG_STATUS_FILE = '/var/lib/dpkg/status'
+
+# dpkg of this system, which changes other roots with `--root`.
+DPKG_BINARY = '/usr/bin/dpkg'
+
+# Fields of a dpkg status paragraph needed to tell whether a package is installed.
+DPKG_FIELD = re.compile(br'^(Package|Architecture|Status): *([^\n]*?) *$', re.MULTILINE)
+
+# Last word of the dpkg `Status` field to whether the package is installed.
+# Packages in other states, E.G half configured ones, are left to apt.
+DPKG_INSTALLED_STATES = {
+    b'installed': True,
+    b'triggers-awaited': True,
+    b'triggers-pending': True,
+    b'config-files': False,
+    b'not-installed': False
+}
+
+
+def read_dpkg_status(path):
+    """
+    Read which packages are installed from a dpkg status file.
+    The file is memory mapped and only the fields needed are looked at.
+    Args:
+        path (str): dpkg status file, E.G /var/lib/dpkg/status.
+    Returns:
+        dict: Package name, and `name:architecture`, to True if installed,
+              False if not, or None if dpkg is part way through changing it.
+    Raises:
+        IOError: Raises IOError if the file can not be read.
+    """
+    packages = {}
+
+    def add(package, architecture, status):
+        if package is None:
+            return
+        installed = DPKG_INSTALLED_STATES.get(status.split()[-1] if status else b'not-installed')
+        names = [package]
+        if architecture:
+            names.append(package + b':' + architecture)
+        for name in names:
+            name = name.decode('utf-8', 'replace')
+            known = packages.get(name, installed)
+            # With several architectures of a package, any doubt goes to apt.
+            if known != installed:
+                known = None if None in (known, installed) else True
+            packages[name] = known
+
+    with open(path, 'rb') as stream:
+        if os.fstat(stream.fileno()).st_size == 0:
+            return packages
+        status_map = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            package = architecture = status = None
+            for match in DPKG_FIELD.finditer(status_map):
+                field, value = match.group(1), match.group(2)
+                if field == b'Package':
+                    add(package, architecture, status)
+                    package, architecture, status = value, None, None
+                elif field == b'Architecture':
+                    architecture = value
+                else:
+                    status = value
+            add(package, architecture, status)
+        finally:
+            status_map.close()
+    return packages
+
+
+class DpkgStatus(object):
+    """
+    Answers whether packages are installed from the dpkg status file, without
+    opening an apt cache. The file is read again whenever dpkg rewrites it.
+    """
+
+    def __init__(self, path=DPKG_STATUS_FILE):
+        self.logger = logging.getLogger('lego.brick_modules.packages.DpkgStatus')
+        self.path = path
+        self.__packages = None
+        self.__stat_key = None
+        self.__lock = threading.Lock()
+
+    def __current(self):
+        """
+        Get the installed packages, reading the status file if it changed.
+        Args:
+            None
+        Returns:
+            dict: Result of read_dpkg_status, or None if the file can not be read.
+        Raises:
+            None
+        """
+        with self.__lock:
+            try:
+                current_key = stat_key(os.stat(self.path))
+                if current_key != self.__stat_key:
+                    self.__packages = read_dpkg_status(self.path)
+                    self.__stat_key = current_key
+            except (IOError, OSError, ValueError) as ex:
+                self.logger.debug("Can not read `%s` with error %s", self.path, ex)
+                self.__packages = None
+                self.__stat_key = None
+            return self.__packages
+
+    def is_installed(self, package):
+        """
+        Check whether a package is installed.
+        Args:
+            package (str): Package name, optionally with `:architecture`.
+        Returns:
+            bool: True if installed, false if not, None if dpkg can not tell
+                  for sure and apt must be asked.
+        Raises:
+            None
+        """
+        packages = self.__current()
+        if packages is None:
+            return None
+        return packages.get(package, False)
 
 
 class PackageManager(object):  # pylint: disable=too-few-public-methods
@@ -19,9 +149,9 @@ class PackageManager(object):  # pylint: disable=too-few-public-methods
     def __setup(self):
         pass
 
-    def install(self, package):
+    def mark_install(self, package):
         """
-        Install a package.
+        Mark a package for install in the pending transaction.
         Must be implemented in the subclass.
         Args:
             package: Name of the package to install.
@@ -32,9 +162,9 @@ class PackageManager(object):  # pylint: disable=too-few-public-methods
         """
         pass
 
-    def uninstall(self, package):
+    def mark_uninstall(self, package):
         """
-        Uninstall already installed package.
+        Mark a package for uninstall in the pending transaction.
         Must be implemented in the subclass.
         Args:
             package: Name of the package to uninstall.
@@ -45,20 +175,44 @@ class PackageManager(object):  # pylint: disable=too-few-public-methods
         """
         pass
 
+    def is_installed(self, package):
+        """
+        Check whether a package is installed.
+        Must be implemented in the subclass.
+        Args:
+            package: Name of the package.
+        Returns:
+            bool: True if the package is installed, false otherwise.
+        Raises:
+            None
+        """
+        pass
 
-class AptPackageManager(PackageManager):
-    """
-    Apt package manager object.
-    """
-    def __init__(self):
-        super(AptPackageManager, self).__init__(name='Apt')
-        self.__setup()
+    def commit(self):
+        """
+        Apply all marked changes as a single transaction.
+        Must be implemented in the subclass.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        pass
 
-    def __setup(self):
-        import apt  # pylint: disable=import-error
-        self.__cache = apt.cache.Cache()
-        self.__cache.update()
-        self.__cache.open()
+    def discard_marks(self):
+        """
+        Drop all marked changes without applying them.
+        Must be implemented in the subclass.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        pass
 
     def install(self, package):
         """
@@ -70,26 +224,339 @@ class AptPackageManager(PackageManager):
         Raises:
             LegoException: Raises LegoException.
         """
+        self.mark_install(package=package)
+        self.commit()
+
+    def uninstall(self, package):
+        """
+        Uninstall already installed package.
+        Args:
+            package: Name of the package to uninstall.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        self.mark_uninstall(package=package)
+        self.commit()
+
+
+class AptCacheManager(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Owns a single apt cache that is shared by all package bricks of a build.
+    Package archives can be downloaded ahead with a second cache, so the
+    shared one is never marked by two threads.
+    """
+
+    def __init__(self, ttl=None,  # pylint: disable=too-many-arguments
+                 lists_dir='/var/lib/apt/lists', apt_module=None, profiler=None,
+                 root='/', update=True):
+        self.logger = logging.getLogger('lego.brick_modules.packages.AptCacheManager')
+        self.profiler = profiler if profiler is not None else NullProfiler()
+        self.ttl = ttl
+        self.lists_dir = lists_dir
+        self.root = root
+        self.update = update
+        self.__apt_module = apt_module
+        self.__cache = None
+        self.__lock = threading.Lock()
+        self.__prefetch_pending = []
+        self.__prefetcher = None
+        self.__prefetch_lock = threading.Lock()
+
+    @property
+    def cache(self):
+        """
+        Return the shared apt cache, setting it up on first use.
+        Args:
+            None
+        Returns:
+            apt.cache.Cache: Opened apt cache.
+        Raises:
+            None
+        """
+        with self.__lock:
+            if self.__cache is None:
+                with self.profiler.span('apt cache setup', 'apt'):
+                    self.__setup()
+        return self.__cache
+
+    def reopen(self):
+        """
+        Read the installed packages again, if the cache is set up. Needed when
+        the cache is kept across builds and dpkg was run in between.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.__lock:
+            if self.__cache is not None:
+                self.__cache.open()
+
+    def use_root(self, root):
+        """
+        Manage the packages of another root. Must be called before the cache is used.
+        Args:
+            root (str): Directory to manage packages in, `/` for this system.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException if the cache is already set up.
+        """
+        with self.__lock:
+            if self.__cache is not None:
+                raise LegoException("Can not change the root of an apt cache in use")
+            self.root = root
+
+    def __open_cache(self):
+        """
+        Open a new apt cache for the root.
+        Args:
+            None
+        Returns:
+            apt.cache.Cache: Opened apt cache.
+        Raises:
+            LegoException: Raises LegoException if dpkg can not be pointed at the root.
+        """
+        if self.__apt_module is None:
+            import apt  # pylint: disable=import-error
+            self.__apt_module = apt
+        if self.root and self.root != '/':
+            cache = self.__apt_module.cache.Cache(rootdir=self.root)
+            self.__point_dpkg_at_root()
+            return cache
+        return self.__apt_module.cache.Cache()
+
+    def __point_dpkg_at_root(self):
+        """
+        Make commits change the root instead of this system. python-apt only
+        points apt at the root, and would run the dpkg of the root on this
+        system. The dpkg of this system is run with `--root` instead, which
+        uses the database and files of the root and runs maintainer scripts
+        chrooted into it.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException if dpkg can not be configured.
+        """
+        apt_pkg = getattr(self.__apt_module, 'apt_pkg', None)
+        if apt_pkg is None:
+            raise LegoException("Can not manage packages in root `{0}`, dpkg can not be "
+                                "configured to change it".format(self.root))
+        option = "--root={0}".format(os.path.abspath(self.root))
+        apt_pkg.config.set('Dir::Bin::dpkg', DPKG_BINARY)
+        if option not in apt_pkg.config.value_list('DPkg::Options'):
+            apt_pkg.config.set('DPkg::Options::', option)
+
+    def __setup(self):
+        self.__cache = self.__open_cache()
+        if not self.update:
+            self.logger.info('Using package lists as they are')
+        elif self.__lists_are_fresh():
+            self.logger.info("Package lists in `%s` are newer than %s seconds. "
+                             "Skipping update", self.lists_dir, self.ttl)
+        else:
+            self.logger.info('Updating package lists')
+            with self.profiler.span('apt update', 'apt'):
+                self.__cache.update()
+        self.__cache.open()
+
+    def prefetch(self, packages):
+        """
+        Download the archives of packages and their dependencies into the apt
+        archive cache on a background thread, so committing them later only
+        has to install them. Packages asked for while a download runs are
+        downloaded together once it is done.
+        Args:
+            packages (list): Names of the packages that will be installed.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.__prefetch_lock:
+            self.__prefetch_pending.extend(packages)
+            if self.__prefetcher is None and self.__prefetch_pending:
+                self.__prefetcher = threading.Thread(target=self.__run_prefetch,
+                                                     name='lego-apt-prefetch')
+                # A download left hanging must not keep Lego from exiting.
+                self.__prefetcher.daemon = True
+                self.__prefetcher.start()
+
+    def wait_for_prefetch(self):
+        """
+        Wait for the archives being downloaded in the background.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.__prefetch_lock:
+            prefetcher = self.__prefetcher
+        if prefetcher is not None:
+            self.logger.info('Waiting for package downloads to finish')
+            prefetcher.join()
+
+    def __run_prefetch(self):
+        """
+        Download the archives of the pending packages until none are left.
+        The shared cache is set up first, so package lists are only updated once.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        fetch_cache = None
         try:
-            apt_package = self.__cache[package]
+            self.cache  # pylint: disable=pointless-statement
+            fetch_cache = self.__open_cache()
+        except Exception as ex:  # pylint: disable=broad-except
+            self.logger.warning("Can not prefetch packages with error %s", ex)
+        while True:
+            with self.__prefetch_lock:
+                packages, self.__prefetch_pending = self.__prefetch_pending, []
+                if not packages or fetch_cache is None:
+                    self.__prefetcher = None
+                    return
+            self.__fetch_archives(fetch_cache, packages)
+
+    def __fetch_archives(self, fetch_cache, packages):
+        """
+        Mark packages for install in a cache of their own and download their archives.
+        Args:
+            fetch_cache (apt.cache.Cache): Cache only used for downloading.
+            packages (list): Names of the packages to download.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        start = CLOCK()
+        with self.profiler.span('apt prefetch', 'apt', packages=list(packages)):
+            for package in packages:
+                try:
+                    fetch_cache[package].mark_install()
+                except KeyError:
+                    # Reported by the package brick when it installs it.
+                    self.logger.debug("Not prefetching unknown package `%s`", package)
+            try:
+                fetch_cache.fetch_archives()
+            except Exception as ex:  # pylint: disable=broad-except
+                self.logger.warning("Prefetching packages `%s` failed with error %s. They are "
+                                    "downloaded when they are installed", packages, ex)
+                return
+        self.logger.info("Prefetched packages `%s` in %.2f seconds", packages, CLOCK() - start)
+
+    def __lists_are_fresh(self):
+        """
+        Check whether the package lists on disk were updated within the TTL.
+        Args:
+            None
+        Returns:
+            bool: True if an update can be skipped, false otherwise.
+        Raises:
+            None
+        """
+        if not self.ttl:
+            return False
+        lists_dir = self.lists_dir
+        if self.root and self.root != '/':
+            lists_dir = os.path.join(self.root, lists_dir.lstrip('/'))
+        try:
+            newest = max(os.stat(os.path.join(lists_dir, name)).st_mtime
+                         for name in os.listdir(lists_dir))
+        except (OSError, ValueError):
+            return False
+        return time.time() - newest < self.ttl
+
+
+class AptPackageManager(PackageManager):
+    """
+    Apt package manager object.
+    """
+    def __init__(self, cache_manager=None):
+        super(AptPackageManager, self).__init__(name='Apt')
+        self.__setup(cache_manager)
+
+    def __setup(self, cache_manager):
+        if cache_manager is None:
+            cache_manager = AptCacheManager()
+        self.__cache_manager = cache_manager
+        self.__marked = OrderedDict()
+
+    @property
+    def __cache(self):
+        # The cache is only set up once a package is actually looked at.
+        return self.__cache_manager.cache
+
+    def __get_package(self, package):
+        try:
+            return self.__cache[package]
         except KeyError:
+            # Packages already marked would otherwise stay marked in the
+            # shared cache and be committed by the next package brick.
+            self.discard_marks()
             raise LegoException("No package named `{0}` available".format(package))
 
+    def discard_marks(self):
+        """
+        Drop every change marked in the shared cache and in this manager.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.__marked = OrderedDict()
+        self.__cache.clear()
+
+    def mark_install(self, package):
+        """
+        Mark a package for install in the pending transaction.
+        Args:
+            package: Name of the package to install.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        apt_package = self.__get_package(package)
+
         if apt_package.is_installed:
             self.logger.info("`%s` is already installed", package)
         else:
-            self.logger.info("`%s` is not installed. Making for install.", package)
+            self.logger.info("`%s` is not installed. Marking for install.", package)
             apt_package.mark_install()
+            self.__marked[package] = True
 
+    def is_installed(self, package):
+        """
+        Check whether a package is installed. Unknown packages are not installed.
+        Args:
+            package: Name of the package.
+        Returns:
+            bool: True if the package is installed, false otherwise.
+        Raises:
+            None
+        """
         try:
-            self.logger.info('Installing marked packages')
-            self.__cache.commit()
-        except Exception as ex:
-            raise LegoException("Package `{0}` failed to install. Error: {1}".format(package, ex))
+            return bool(self.__cache[package].is_installed)
+        except KeyError:
+            return False
 
-    def uninstall(self, package):
+    def mark_uninstall(self, package):
         """
-        Uninstall already installed package.
+        Mark a package for uninstall in the pending transaction.
         Args:
             package: Name of the package to uninstall.
         Returns:
@@ -97,23 +564,65 @@ class AptPackageManager(PackageManager):
         Raises:
             LegoException: Raises LegoException.
         """
-        try:
-            apt_package = self.__cache[package]
-        except KeyError:
-            raise LegoException("No package named `{0}` available".format(package))
+        apt_package = self.__get_package(package)
 
         if apt_package.is_installed:
-            self.logger.info("Marking package `%s` for unintsall", package)
+            self.logger.info("Marking package `%s` for uninstall", package)
             apt_package.mark_delete(True, purge=True)
+            self.__marked[package] = False
         else:
             self.logger.info("`%s` is not installed", package)
 
+    def commit(self):
+        """
+        Apply all marked installs and uninstalls as a single apt transaction.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException naming the packages that did
+                           not reach their requested state.
+        """
+        if not self.__marked:
+            self.logger.info('No marked packages. Skipping - Nothing to do')
+            return
+
+        marked, self.__marked = self.__marked, OrderedDict()
+        # Archives being prefetched are not downloaded a second time.
+        self.__cache_manager.wait_for_prefetch()
         try:
-            self.logger.info('Uninstall marked packages')
+            self.logger.info("Committing marked packages `%s`", list(marked.keys()))
             self.__cache.commit()
-        except Exception as ex:
-            raise LegoException("Package `{0}` failed to uninstall. "
-                                "Error: {1}".format(package, ex))
+            # The cache still holds the state and marks from before the commit,
+            # later bricks sharing it must see what the commit changed.
+            self.__cache.open()
+        except Exception as ex:  # pylint: disable=broad-except
+            raise LegoException("Packages `{0}` failed to apply. "
+                                "Error: {1}".format(self.__failed_packages(marked), ex))
+
+    def __failed_packages(self, marked):
+        """
+        Work out which of the marked packages did not reach their requested state.
+        Args:
+            marked (OrderedDict): Package name to True for install, False for uninstall.
+        Returns:
+            list: Names of packages that are not in the requested state.
+        Raises:
+            None
+        """
+        try:
+            self.__cache.open()
+        except Exception:  # pylint: disable=broad-except
+            return list(marked.keys())
+        failed = []
+        for package, install in marked.items():
+            try:
+                if self.__cache[package].is_installed != install:
+                    failed.append(package)
+            except KeyError:
+                failed.append(package)
+        return failed
 
 
 class PackageBrick(Brick):  # pylint: disable=too-few-public-methods
@@ -128,14 +637,31 @@ class PackageBrick(Brick):  # pylint: disable=too-few-public-methods
         'packages'
     ]
 
-    def __init__(self, provided_attributes):
+    def __init__(self, provided_attributes, context=None, brick_set_name=None):
+        self.brick_set_name = brick_set_name
         self.provided_attributes = provided_attributes
         super(PackageBrick, self).__init__(name='package_brick',
                                            provided_attributes=self.provided_attributes,
                                            supported_attributes=PackageBrick.supported_attributes,
-                                           compulsory_attributes=PackageBrick.compulsory_attributes)
+                                           compulsory_attributes=PackageBrick.compulsory_attributes,
+                                           context=context)
         self.__run_setup()
 
+    def validate(self):
+        """
+        Check the requested package state.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        if self.provided_attributes['state'] not in ['present', 'absent']:
+            raise LegoException("Unsupported state `{0}` for packages "
+                                "`{1}`".format(self.provided_attributes['state'],
+                                               self.provided_attributes['packages']))
+
     def __run_setup(self):
         """
         Get the package manager object.
@@ -147,28 +673,142 @@ class PackageBrick(Brick):  # pylint: disable=too-few-public-methods
             LegoException: Raises LegoException.
         """
         if self.provided_attributes['provider'] == 'apt':
-            self.package_manager = AptPackageManager()
+            self.package_manager = AptPackageManager(
+                cache_manager=self.context.apt_cache_manager)
         else:
             raise LegoException("Package provider `{0}` is not supported. "
                                 "Supported package providers "
                                 "are `{1}`".format(self.provided_attributes['provider'], ['apt']))
 
+    def watch_paths(self):
+        """
+        List the dpkg status file, which changes whenever packages are
+        installed or removed.
+        Args:
+            None
+        Returns:
+            list: Paths to watch.
+        Raises:
+            None
+        """
+        return [self.context.rebase(DPKG_STATUS_FILE)]
+
+    def prefetch(self):
+        """
+        Start downloading the packages this brick installs that dpkg does not
+        list as installed.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if (self.provided_attributes['provider'] != 'apt' or
+                self.provided_attributes['state'] != 'present'):
+            return
+        dpkg_status = self.context.dpkg_status
+        missing = [each_package for each_package in self.provided_attributes['packages']
+                   if dpkg_status.is_installed(each_package) is not True]
+        if missing:
+            self.context.apt_cache_manager.prefetch(missing)
+
+    def __is_installed(self, package):
+        """
+        Check whether a package is installed, asking dpkg first and the
+        package manager only if dpkg can not tell.
+        Args:
+            package (str): Package name.
+        Returns:
+            bool: True if the package is installed, false otherwise.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        installed = self.context.dpkg_status.is_installed(package)
+        if installed is None:
+            installed = self.package_manager.is_installed(package=package)
+        return installed
+
+    def __in_requested_state(self):
+        """
+        Check with dpkg alone whether every package is already in the requested state.
+        Args:
+            None
+        Returns:
+            bool: True if nothing needs changing, false if apt is needed.
+        Raises:
+            None
+        """
+        expected = self.provided_attributes['state'] == 'present'
+        dpkg_status = self.context.dpkg_status
+        return all(dpkg_status.is_installed(each_package) is expected
+                   for each_package in self.provided_attributes['packages'])
+
+    def check(self):
+        """
+        Compare the installed packages with this brick.
+        Args:
+            None
+        Returns:
+            list: Differences found.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        expected = self.provided_attributes['state'] == 'present'
+        with self.context.package_lock:
+            return [make_drift(each_package, 'installed', expected, not expected)
+                    for each_package in self.provided_attributes['packages']
+                    if self.__is_installed(each_package) != expected]
+
     def run_brick(self):
         """
         Manage packages on the system with given details.
+        If dpkg says every package is already in the requested state, apt is
+        not used at all.
         Args:
             None
         Returns:
             None
         Raises:
+            LegoException: Raises LegoException.
+        """
+        with self.context.package_lock:
+            if self.__in_requested_state():
+                self.logger.info("Packages `%s` are already %s. Skipping - Nothing to do",
+                                 self.provided_attributes['packages'],
+                                 'installed' if self.provided_attributes['state'] == 'present'
+                                 else 'absent')
+                return
+            self.__manage_packages()
+
+    def __manage_packages(self):
+        """
+        Mark all packages of this brick and commit them in one transaction.
+        Args:
+            None
+        Returns:
             None
+        Raises:
+            LegoException: Raises LegoException.
         """
-        for each_package in self.provided_attributes['packages']:
-            self.logger.info("Managing package `%s` with package manager `%s`",
-                             each_package, self.provided_attributes['provider'])
+        profiler = self.context.profiler
+        try:
+            for each_package in self.provided_attributes['packages']:
+                self.logger.info("Managing package `%s` with package manager `%s`",
+                                 each_package, self.provided_attributes['provider'])
+
+                with profiler.span(each_package, 'package'):
+                    if self.provided_attributes['state'] == 'present':
+                        self.package_manager.mark_install(package=each_package)
 
-            if self.provided_attributes['state'] == 'present':
-                self.package_manager.install(package=each_package)
+                    if self.provided_attributes['state'] == 'absent':
+                        self.package_manager.mark_uninstall(package=each_package)
+        except Exception:
+            # E.G a broken dependency. What this brick marked so far must not
+            # be committed by the next brick sharing the cache.
+            self.package_manager.discard_marks()
+            raise
 
-            if self.provided_attributes['state'] == 'absent':
-                self.package_manager.uninstall(package=each_package)
+        with profiler.span('apt commit', 'apt',
+                           packages=list(self.provided_attributes['packages'])):
+            self.package_manager.commit()
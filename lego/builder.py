@@ -3,11 +3,70 @@ Lego Builder.
 """
 
 import logging
-import oyaml as yaml
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from lego.brick import Brick
 from lego.common import LegoException
-from lego.brick_modules.packages import PackageBrick
-from lego.brick_modules.files import FileBrick
-from lego.brick_modules.command import CommandBrick
+from lego.context import BuildContext
+from lego.loader import load_yaml
+from lego.profiler import CLOCK
+from lego.registry import REGISTRY
+from lego.scheduler import Scheduler, run_keyed
+
+
+# A validated brick and the scheduler tasks it has to wait for.
+PlannedBrick = namedtuple('PlannedBrick', ['brick_id', 'brick_set_name', 'brick_name',
+                                           'brick', 'requires'])
+
+# Bricks in the order they are listed, and the brick ids of every brick set.
+ExecutionPlan = namedtuple('ExecutionPlan', ['bricks', 'brick_sets'])
+
+# Outcome of applying a build to one root.
+RootResult = namedtuple('RootResult', ['root', 'succeeded', 'error', 'seconds'])
+
+# Results of resolving a reference to a brick set that already ran, or that
+# is listed later and not loaded yet, when brick sets are streamed.
+ALREADY_RAN = object()
+NOT_LOADED = object()
+
+# Builder and build arguments inherited by forked root workers.
+_FORKED_BUILD = {}
+
+
+def select_bricks(plan, brick_ids):
+    """
+    Make a plan that only runs some of the bricks of another plan, in the same order.
+    Args:
+        plan (ExecutionPlan): Plan to select bricks from.
+        brick_ids (set): Ids of the bricks to keep.
+    Returns:
+        ExecutionPlan: Plan with only the selected bricks.
+    Raises:
+        None
+    """
+    brick_set_task_ids = set("{0}/".format(brick_set_name) for brick_set_name, _ in plan.brick_sets)
+    kept_task_ids = brick_set_task_ids | set(brick_ids)
+    return ExecutionPlan(
+        bricks=tuple(planned_brick._replace(requires=planned_brick.requires & kept_task_ids)
+                     for planned_brick in plan.bricks if planned_brick.brick_id in brick_ids),
+        brick_sets=tuple((brick_set_name, tuple(brick_id for brick_id in set_brick_ids
+                                                if brick_id in brick_ids))
+                         for brick_set_name, set_brick_ids in plan.brick_sets))
+
+
+def _build_forked_root(root):
+    """
+    Apply the build inherited from the parent process to a root.
+    Args:
+        root (str): Directory to apply the build to.
+    Returns:
+        RootResult: Outcome of the build.
+    Raises:
+        None
+    """
+    return _FORKED_BUILD['builder'].build_root(root, **_FORKED_BUILD['arguments'])
 
 
 class Builder(object):
@@ -15,34 +74,59 @@ class Builder(object):
     Builder for Lego tool.
     """
 
-    supported_modules = [
-        'package',
-        'file',
-        'command'
-    ]
-
-    def __init__(self, builder_file):
+    def __init__(self, builder_file, context=None,  # pylint: disable=too-many-arguments
+                 use_cache=True, registry=None, lazy=False):
         self.__logger = logging.getLogger('lego.builder.Builder')
+        self.__registry = registry if registry is not None else REGISTRY
         self.__builder_file = builder_file
-        self.__brick_sets = {}
-        self.__load_bricks()
+        self.__use_cache = use_cache
+        self.__context = context if context is not None else BuildContext()
+        # Brick sets are looked up next to the builder file.
+        self.__context.brick_sets_dir = os.path.join(
+            os.path.dirname(os.path.abspath(builder_file)), 'brick_sets')
+        self.__brick_set_names = []
+        self.__brick_sets = None
+        self.__brick_set_ordering = {}
+        self.__brick_set_times = OrderedDict()
+        self.__brick_set_times_lock = threading.Lock()
+        self.__load_builder_file()
+        if not lazy:
+            self.__load_bricks()
 
     @property
     def brick_sets(self):
         """
         Return builder instructions property.
+        Brick sets are loaded on first use if the builder is lazy.
         Args:
             None
         Returns:
             dictionary: Builder instructions dictionary.
         Raises:
-            None
+            LegoException: Raises LegoException.
         """
+        if self.__brick_sets is None:
+            self.__load_bricks()
         return self.__brick_sets
 
-    def __load_bricks(self):
+    @property
+    def files(self):
+        """
+        Return the builder file and the bricks files of the brick sets it lists.
+        Args:
+            None
+        Returns:
+            list: Paths of the files.
+        Raises:
+            None
         """
-        This function loads and validates the given builder file.
+        return [self.__builder_file] + [self.__brick_set_path(each_brick_set)
+                                        for each_brick_set in self.__brick_set_names]
+
+    def __load_builder_file(self):
+        """
+        This function loads the given builder file, the ordering of its brick
+        sets and its variables.
         Args:
             None
         Returns:
@@ -52,53 +136,603 @@ class Builder(object):
         """
         self.__logger.debug("Loading builder file %s", self.__builder_file)
 
-        with open(self.__builder_file, 'r') as stream:
+        try:
+            builder = self.__load_yaml(self.__builder_file)
+            brick_sets = builder['brick_sets']
+        except (LegoException, IOError, OSError) as lego_ex:
+            raise LegoException("Something went wrong while loading "
+                                "the builder file with error {0}".format(lego_ex))
+        except (KeyError, TypeError):
+            raise LegoException("Builder file is missing `brick_sets`")
+
+        variables = builder.get('variables') or {}
+        if not isinstance(variables, dict):
+            raise LegoException("Builder file `variables` must be a mapping")
+        self.__context.variables = variables
+
+        for each_brick_set in brick_sets:
+            self.__brick_set_names.append(self.__load_brick_set_ordering(each_brick_set))
+
+    def __brick_set_path(self, brick_set_name):
+        """
+        Get the path of the bricks file of a brick set.
+        Args:
+            brick_set_name (str): Name of the brick set.
+        Returns:
+            str: Path of the bricks file.
+        Raises:
+            None
+        """
+        return os.path.join(self.__context.brick_sets_dir, brick_set_name, 'bricks.yaml')
+
+    def __load_bricks(self):
+        """
+        This function loads every brick set listed in the builder file.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        brick_sets = OrderedDict()
+        for each_brick_set in self.__brick_set_names:
+            self.__logger.debug("Loading brick set %s", each_brick_set)
+
             try:
-                brick_sets = yaml.load(stream)['brick_sets']
-            except yaml.YAMLError as yaml_ex:
+                brick_sets[each_brick_set] = self.__load_yaml(
+                    self.__brick_set_path(each_brick_set))
+            except (LegoException, IOError, OSError) as lego_ex:
                 raise LegoException("Something went wrong while loading "
-                                    "the builder file with error {0}".format(yaml_ex))
-            except KeyError:
-                raise LegoException("Builder file is missing `brick_sets`")
+                                    "brick set `{0}` the builder file with "
+                                    "error {1}".format(each_brick_set, lego_ex))
+        self.__brick_sets = brick_sets
 
-        for each_brick_set in brick_sets:
+    def iter_brick_sets(self):
+        """
+        Load the brick sets one at a time, in the order they are listed.
+        Each brick set file is loaded whole when its turn comes, and only the
+        brick set being handed out is kept in memory.
+        Args:
+            None
+        Returns:
+            generator: Tuples of (brick set name, OrderedDict of bricks).
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        for each_brick_set in self.__brick_set_names:
             self.__logger.debug("Loading brick set %s", each_brick_set)
+            try:
+                bricks = self.__load_yaml(self.__brick_set_path(each_brick_set))
+            except (LegoException, IOError, OSError) as lego_ex:
+                raise LegoException("Something went wrong while loading "
+                                    "brick set `{0}` the builder file with "
+                                    "error {1}".format(each_brick_set, lego_ex))
+            yield each_brick_set, bricks
 
-            with open("brick_sets/{0}/bricks.yaml".format(each_brick_set), 'r') as stream:
-                try:
-                    self.__brick_sets[each_brick_set] = yaml.load(stream)
-                except yaml.YAMLError as yaml_ex:
-                    raise LegoException("Something went wrong while loading "
-                                        "brick set `{0}` the builder file with "
-                                        "error {1}".format(each_brick_set, yaml_ex))
+    def __load_yaml(self, path):
+        """
+        Load a YAML file, timing it with the build profiler.
+        Args:
+            path (str): YAML file to load.
+        Returns:
+            object: Parsed document.
+        Raises:
+            LegoException: Raises LegoException.
+            IOError: Raises IOError if the file can not be read.
+        """
+        with self.__context.profiler.span(path, 'yaml'):
+            return load_yaml(path, use_cache=self.__use_cache)
 
-    def build(self):
+    def __load_brick_set_ordering(self, brick_set_entry):
         """
-        Run module to handle each brick.
+        Record `requires` and `before` of a brick set listed in the builder file.
+        A brick set is either listed by name or as a mapping with a `name`.
+        Args:
+            brick_set_entry (str or dict): Brick set entry from the builder file.
+        Returns:
+            str: Name of the brick set.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        if not isinstance(brick_set_entry, dict):
+            self.__brick_set_ordering[brick_set_entry] = {}
+            return brick_set_entry
+        if 'name' not in brick_set_entry:
+            raise LegoException("Brick set `{0}` in the builder file is "
+                                "missing `name`".format(brick_set_entry))
+        for attribute in brick_set_entry:
+            if attribute not in ['name'] + Brick.scheduling_attributes:
+                raise LegoException("Unknown attribute `{0}` for brick set `{1}`".format(
+                    attribute, brick_set_entry['name']))
+        self.__brick_set_ordering[brick_set_entry['name']] = brick_set_entry
+        return brick_set_entry['name']
+
+    def __resolve_reference(self, brick_sets, ran, brick_set_name, reference):
+        """
+        Resolve a `requires`/`before` reference to a scheduler task.
+        References are `brick set/brick`, a brick in the same brick set or a brick set.
+        Args:
+            brick_sets (OrderedDict): Brick sets being compiled.
+            ran (dict): Brick set name to brick names of brick sets that already ran.
+            brick_set_name (str): Brick set the reference was made from.
+            reference (str): Reference to resolve.
+        Returns:
+            str: Scheduler task id, ALREADY_RAN if the reference is to a brick
+                 set that already ran or NOT_LOADED if it is to a brick set
+                 that is listed later and not loaded yet.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        referenced_set, referenced_brick = reference, None
+        if '/' in reference:
+            referenced_set, referenced_brick = reference.split('/', 1)
+            if referenced_brick in brick_sets.get(referenced_set, {}):
+                return reference
+        elif brick_set_name is not None and reference in brick_sets[brick_set_name]:
+            return "{0}/{1}".format(brick_set_name, reference)
+        elif reference in brick_sets:
+            return "{0}/".format(reference)
+
+        if referenced_set in ran and (referenced_brick is None or
+                                      referenced_brick in ran[referenced_set]):
+            return ALREADY_RAN
+        if referenced_set in self.__brick_set_names and referenced_set not in brick_sets \
+                and referenced_set not in ran:
+            return NOT_LOADED
+        raise LegoException("Unknown brick or brick set `{0}` referenced from `{1}`".format(
+            reference, brick_set_name))
+
+    def __add_ordering(self, brick_sets, ran,  # pylint: disable=too-many-arguments
+                       requires, task_id, brick_set_name, attributes):
+        """
+        Add dependencies declared with `requires` and `before`.
         Args:
+            brick_sets (OrderedDict): Brick sets being compiled.
+            ran (dict): Brick set name to brick names of brick sets that already ran.
+            requires (dict): Task id to the set of task ids it requires.
+            task_id (str): Task the attributes belong to.
+            brick_set_name (str): Brick set references are resolved against.
+            attributes (dict): Brick or brick set attributes.
+        Returns:
             None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        for reference in attributes.get('requires') or []:
+            required_task_id = self.__resolve_reference(brick_sets, ran, brick_set_name,
+                                                        reference)
+            if required_task_id is ALREADY_RAN:
+                continue
+            if required_task_id is NOT_LOADED:
+                raise LegoException("`{0}` is listed later, so it can not be required when "
+                                    "brick sets are streamed".format(reference))
+            for each_task_id in self.__expand_task(brick_sets, task_id):
+                requires[each_task_id].add(required_task_id)
+        for reference in attributes.get('before') or []:
+            before_task_id = self.__resolve_reference(brick_sets, ran, brick_set_name, reference)
+            if before_task_id is NOT_LOADED:
+                continue
+            if before_task_id is ALREADY_RAN:
+                raise LegoException("`{0}` already ran, so it can not come after this when "
+                                    "brick sets are streamed".format(reference))
+            for each_task_id in self.__expand_task(brick_sets, before_task_id):
+                requires[each_task_id].add(task_id)
+
+    @staticmethod
+    def __expand_task(brick_sets, task_id):
+        """
+        Expand a brick set task to the tasks of its bricks.
+        Args:
+            brick_sets (OrderedDict): Brick sets being compiled.
+            task_id (str): Brick task `set/brick` or brick set task `set/`.
         Returns:
+            list: Brick task ids.
+        Raises:
             None
+        """
+        brick_set_name, brick_name = task_id.split('/', 1)
+        if brick_name:
+            return [task_id]
+        return ["{0}/{1}".format(brick_set_name, each_brick)
+                for each_brick in brick_sets[brick_set_name]]
+
+    def __make_brick(self, brick_set_name, brick_details):
+        """
+        Create the brick object for the given brick details.
+        Args:
+            brick_set_name (str): Name of the brick set the brick belongs to.
+            brick_details (dict): Attributes of the brick.
+        Returns:
+            Brick: Brick object.
         Raises:
             LegoException: Raises LegoException.
         """
-        for brick_set_name, brick_set in self.__brick_sets.items():
-            self.__logger.info("Running brick set `%s`", brick_set_name)
+        if not isinstance(brick_details, dict) or 'type' not in brick_details:
+            raise LegoException("Brick is missing `type`")
+        brick_class = self.__registry.get(brick_details['type'])
+        return brick_class(brick_set_name=brick_set_name,
+                           provided_attributes=brick_details,
+                           context=self.__context)
+
+    def compile(self):
+        """
+        Validate every brick and resolve the ordering between them, without
+        running anything. All invalid bricks are reported together.
+        Args:
+            None
+        Returns:
+            ExecutionPlan: Immutable plan for `build` to run.
+        Raises:
+            LegoException: Raises LegoException if any brick is invalid.
+        """
+        return self.__compile(self.brick_sets, ran={})
 
+    def __compile(self, brick_sets, ran):
+        """
+        Validate the bricks of some brick sets and resolve the ordering between them.
+        Args:
+            brick_sets (OrderedDict): Brick sets to compile.
+            ran (dict): Brick set name to brick names of brick sets that already
+                        ran, whose references are taken as satisfied.
+        Returns:
+            ExecutionPlan: Immutable plan for `build` to run.
+        Raises:
+            LegoException: Raises LegoException if any brick is invalid.
+        """
+        planned = OrderedDict()
+        requires = {}
+        errors = []
+        for brick_set_name, brick_set in brick_sets.items():
+            requires["{0}/".format(brick_set_name)] = set()
             for brick_name, brick_details in brick_set.items():
+                brick_id = "{0}/{1}".format(brick_set_name, brick_name)
+                requires[brick_id] = set()
+                try:
+                    planned[brick_id] = (brick_set_name, brick_name,
+                                         self.__make_brick(brick_set_name, brick_details))
+                except LegoException as lego_ex:
+                    errors.append("`{0}`: {1}".format(brick_id, lego_ex))
+
+        for brick_set_name, brick_set in brick_sets.items():
+            ordering = [("{0}/{1}".format(brick_set_name, brick_name), brick_set_name,
+                         brick_details) for brick_name, brick_details in brick_set.items()]
+            ordering.append(("{0}/".format(brick_set_name), None,
+                             self.__brick_set_ordering.get(brick_set_name, {})))
+            for task_id, reference_set_name, attributes in ordering:
+                try:
+                    self.__add_ordering(brick_sets, ran, requires, task_id,
+                                        reference_set_name, attributes)
+                except LegoException as lego_ex:
+                    errors.append("`{0}`: {1}".format(task_id, lego_ex))
+
+        if errors:
+            raise LegoException("Builder file `{0}` is invalid: {1}".format(
+                self.__builder_file, '; '.join(errors)))
+
+        plan = ExecutionPlan(
+            bricks=tuple(PlannedBrick(brick_id=brick_id,
+                                      brick_set_name=brick_set_name,
+                                      brick_name=brick_name,
+                                      brick=brick,
+                                      requires=frozenset(requires[brick_id]))
+                         for brick_id, (brick_set_name, brick_name, brick) in planned.items()),
+            brick_sets=tuple((brick_set_name, tuple("{0}/{1}".format(brick_set_name, brick_name)
+                                                    for brick_name in brick_set))
+                             for brick_set_name, brick_set in brick_sets.items()))
+        self.__scheduler(plan, lambda planned_brick: None, jobs=1).check()
+        return plan
+
+    @staticmethod
+    def __scheduler(plan, run, jobs):
+        """
+        Create the scheduler for an execution plan.
+        Each brick set gets an extra task that finishes once all its bricks have run.
+        Args:
+            plan (ExecutionPlan): Plan to schedule.
+            run (callable): Function called with each PlannedBrick to run it.
+            jobs (int): Maximum number of bricks to run at the same time.
+        Returns:
+            Scheduler: Scheduler with every brick and its dependencies added.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        scheduler = Scheduler(jobs=jobs)
+        for planned_brick in plan.bricks:
+            scheduler.add_task(planned_brick.brick_id, lambda p=planned_brick: run(p))
+        for brick_set_name, brick_ids in plan.brick_sets:
+            set_task_id = "{0}/".format(brick_set_name)
+            scheduler.add_task(set_task_id, lambda: None)
+            for brick_id in brick_ids:
+                scheduler.add_dependency(set_task_id, brick_id)
+        for planned_brick in plan.bricks:
+            for required_task_id in planned_brick.requires:
+                scheduler.add_dependency(planned_brick.brick_id, required_task_id)
+        return scheduler
+
+    def __run_brick(self, planned_brick, force, resume):
+        """
+        Run a single brick, keeping track of how long its brick set took.
+        Args:
+            planned_brick (PlannedBrick): Brick to run.
+            force (bool): Run the brick even if its fingerprint is unchanged.
+            resume (bool): Skip the brick if it completed in the last, failed, build.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        start = CLOCK()
+        try:
+            self.__run_brick_once(planned_brick, force, resume)
+        finally:
+            self.__record_brick_set_time(planned_brick.brick_set_name, start, CLOCK())
 
-                self.__logger.info("Running brick `%s`", brick_name)
+    def __record_brick_set_time(self, brick_set_name, start, end):
+        """
+        Widen the time span of a brick set to include a brick that ran in it.
+        Args:
+            brick_set_name (str): Brick set the brick belongs to.
+            start (float): Time the brick started, from the profiler clock.
+            end (float): Time the brick finished, from the profiler clock.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.__brick_set_times_lock:
+            if brick_set_name in self.__brick_set_times:
+                start = min(start, self.__brick_set_times[brick_set_name][0])
+                end = max(end, self.__brick_set_times[brick_set_name][1])
+            self.__brick_set_times[brick_set_name] = (start, end)
 
-                if brick_details['type'] == 'package':
-                    brick = PackageBrick(provided_attributes=brick_details)
-                elif brick_details['type'] == 'file':
-                    brick = FileBrick(brick_set_name=brick_set_name,
-                                      provided_attributes=brick_details)
-                elif brick_details['type'] == 'command':
-                    brick = CommandBrick(provided_attributes=brick_details)
-                else:
-                    raise LegoException("Unknown brick type `{0}`. Only brick types {1} "
-                                        "are supported".format(brick_details['type'],
-                                                               self.supported_modules))
+    def __run_brick_once(self, planned_brick, force, resume):
+        """
+        Run a single brick, unless the journal says it has nothing to do.
+        Args:
+            planned_brick (PlannedBrick): Brick to run.
+            force (bool): Run the brick even if its fingerprint is unchanged.
+            resume (bool): Skip the brick if it completed in the last, failed, build.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        brick_id = planned_brick.brick_id
+        brick = planned_brick.brick
+        journal = self.__context.journal
+        if resume and journal.completed_in_failed_build(brick_id):
+            self.__logger.info("Skipping brick `%s`, it completed in the failed build "
+                               "being resumed", brick_id)
+            journal.skip(brick_id)
+            return
 
+        if not force and journal.is_unchanged(brick_id, brick.fingerprint()):
+            self.__logger.info("Skipping brick `%s`, nothing changed since its last run",
+                               brick_id)
+            journal.skip(brick_id)
+            return
+
+        self.__logger.info("Running brick `%s` from brick set `%s`",
+                           planned_brick.brick_name, planned_brick.brick_set_name)
+        start = CLOCK()
+        try:
+            with self.__context.profiler.span(brick_id, 'brick',
+                                              brick_set=planned_brick.brick_set_name):
                 brick.run_brick()
+        except Exception:
+            journal.forget(brick_id)
+            self.__logger.info("Brick `%s` failed after %.2f seconds", brick_id, CLOCK() - start)
+            raise
+        journal.record(brick_id, brick.fingerprint())
+        self.__logger.info("Finished brick `%s` in %.2f seconds", brick_id, CLOCK() - start)
+
+    def __prefetch(self, plan):
+        """
+        Let every brick of a plan start fetching what it needs, E.G package
+        archives, while the bricks before it run.
+        Args:
+            plan (ExecutionPlan): Plan about to run.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if not self.__context.prefetch:
+            return
+        for planned_brick in plan.bricks:
+            planned_brick.brick.prefetch()
+
+    def build(self, jobs=1, force=False, resume=False, plan=None):
+        """
+        Run module to handle each brick.
+        The whole build is compiled first, so nothing runs if any brick is
+        invalid. Bricks run in the order they are listed, unless `requires` or
+        `before` say otherwise. With more than one job, bricks that do not
+        depend on each other run at the same time. Bricks whose fingerprint has
+        not changed since their last successful run are skipped. Package
+        archives are downloaded in the background from the start.
+        Args:
+            jobs (int): Maximum number of bricks to run at the same time.
+            force (bool): Run every brick, ignoring the journal.
+            resume (bool): Skip bricks that completed in the last build, if it failed.
+            plan (ExecutionPlan): Plan from `compile`, compiled now if not given.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        if plan is None:
+            plan = self.compile()
+        scheduler = self.__scheduler(
+            plan, lambda planned_brick: self.__run_brick(planned_brick, force, resume), jobs)
+
+        self.__brick_set_times.clear()
+        succeeded = False
+        try:
+            self.__prefetch(plan)
+            scheduler.run()
+            succeeded = True
+        finally:
+            self.__finish_build(succeeded)
+
+    def check(self, jobs=1, plan=None):
+        """
+        Compare the system with every brick, without changing anything. As
+        nothing changes, bricks are checked in any order, up to `jobs` at the
+        same time. The journal is not used, every brick is checked, and no
+        state is saved.
+        Args:
+            jobs (int): Maximum number of bricks to check at the same time.
+            plan (ExecutionPlan): Plan from `compile`, compiled now if not given.
+        Returns:
+            dict: Report with `in_sync`, the `drift` of every brick that
+                  differs, the bricks that could not be checked, and the
+                  `errors` of bricks whose check failed.
+        Raises:
+            LegoException: Raises LegoException if the build is invalid.
+        """
+        if plan is None:
+            plan = self.compile()
+        results = {}
+
+        def check_brick(planned_brick):
+            with self.__context.profiler.span(planned_brick.brick_id, 'brick',
+                                              brick_set=planned_brick.brick_set_name):
+                results[planned_brick.brick_id] = planned_brick.brick.check()
+
+        failures = dict((planned_brick.brick_id, error) for planned_brick, error in
+                        run_keyed(items=plan.bricks,
+                                  key=lambda planned_brick: planned_brick.brick_id,
+                                  func=check_brick, jobs=jobs))
+
+        report = OrderedDict([('builder_file', self.__builder_file),
+                              ('root', self.__context.root),
+                              ('in_sync', True),
+                              ('drift', OrderedDict()),
+                              ('unchecked', []),
+                              ('errors', OrderedDict())])
+        for planned_brick in plan.bricks:
+            brick_id = planned_brick.brick_id
+            if brick_id in failures:
+                report['errors'][brick_id] = str(failures[brick_id])
+            elif results[brick_id] is None:
+                report['unchecked'].append(brick_id)
+            elif results[brick_id]:
+                report['drift'][brick_id] = results[brick_id]
+        report['in_sync'] = not report['drift'] and not report['errors']
+        return report
+
+    def stream(self, jobs=1, force=False, resume=False):
+        """
+        Load, compile and run the brick sets one at a time, in the order they
+        are listed. The first brick set runs before later ones are read, and
+        only one brick set is kept in memory. A brick set can only be
+        validated once the ones before it ran, and references from a brick
+        set must not require a later one or come before an earlier one.
+        Args:
+            jobs (int): Maximum number of bricks to run at the same time.
+            force (bool): Run every brick, ignoring the journal.
+            resume (bool): Skip bricks that completed in the last build, if it failed.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        ran = {}
+        self.__brick_set_times.clear()
+        succeeded = False
+        try:
+            for brick_set_name, bricks in self.iter_brick_sets():
+                plan = self.__compile(OrderedDict([(brick_set_name, bricks)]), ran=ran)
+                self.__prefetch(plan)
+                self.__scheduler(
+                    plan, lambda planned_brick: self.__run_brick(planned_brick, force, resume),
+                    jobs).run()
+                ran[brick_set_name] = frozenset(bricks)
+            succeeded = True
+        finally:
+            self.__finish_build(succeeded)
+
+    def __finish_build(self, succeeded):
+        """
+        Record the outcome of a build and save the state gathered during it.
+        Args:
+            succeeded (bool): Whether the build succeeded.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        for brick_set_name, (start, end) in self.__brick_set_times.items():
+            self.__context.profiler.add_span(brick_set_name, 'brick_set', start, end)
+        self.__context.journal.finish_build(succeeded)
+        self.__context.save()
+
+    def build_root(self, root, jobs=1, force=False, resume=False, plan=None):
+        """
+        Apply the build to a root, E.G a chroot or container image.
+        File destinations, packages, the state directory and `creates` guards
+        are taken relative to the root.
+        Args:
+            root (str): Directory to apply the build to, `/` for this system.
+            jobs (int): Maximum number of bricks to run at the same time.
+            force (bool): Run every brick, ignoring the journal.
+            resume (bool): Skip bricks that completed in the last build, if it failed.
+            plan (ExecutionPlan): Plan from `compile`, compiled now if not given.
+        Returns:
+            RootResult: Outcome of the build.
+        Raises:
+            None
+        """
+        start = CLOCK()
+        try:
+            if not os.path.isdir(root):
+                raise LegoException("Root `{0}` is not a directory".format(root))
+            self.__context.use_root(root)
+            self.build(jobs=jobs, force=force, resume=resume, plan=plan)
+        except Exception as ex:  # pylint: disable=broad-except
+            self.__logger.error("Building root `%s` failed with error %s", root, ex)
+            return RootResult(root=root, succeeded=False, error=str(ex),
+                              seconds=CLOCK() - start)
+        return RootResult(root=root, succeeded=True, error=None, seconds=CLOCK() - start)
+
+    def build_roots(self, roots, jobs=1, force=False,  # pylint: disable=too-many-arguments
+                    resume=False, processes=None):
+        """
+        Apply the build to several roots. The builder file is loaded and
+        compiled once, then each root is built in its own forked process.
+        A failed root does not stop the other roots.
+        Args:
+            roots (list): Directories to apply the build to.
+            jobs (int): Maximum number of bricks to run at the same time in each root.
+            force (bool): Run every brick, ignoring the journal.
+            resume (bool): Skip bricks that completed in the last build, if it failed.
+            processes (int): Maximum number of roots to build at the same time,
+                             by default one per CPU.
+        Returns:
+            list: RootResult of every root, in the order given.
+        Raises:
+            LegoException: Raises LegoException if the build is invalid.
+        """
+        plan = self.compile()
+        if len(roots) == 1:
+            return [self.build_root(roots[0], jobs=jobs, force=force, resume=resume, plan=plan)]
+
+        processes = min(len(roots), processes or multiprocessing.cpu_count())
+        # Workers must inherit the compiled plan, which holds unpicklable bricks.
+        get_context = getattr(multiprocessing, 'get_context', None)
+        fork = get_context('fork') if get_context is not None else multiprocessing
+        _FORKED_BUILD.update(builder=self,
+                             arguments={'jobs': jobs, 'force': force,
+                                        'resume': resume, 'plan': plan})
+        try:
+            # A fresh worker per root, so no state leaks from one root to the next.
+            pool = fork.Pool(processes=processes, maxtasksperchild=1)
+            try:
+                return pool.map(_build_forked_root, roots, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            _FORKED_BUILD.clear()
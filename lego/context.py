@@ -0,0 +1,215 @@
+"""
+Shared state for a single run of the Lego configuration management tool.
+"""
+
+
+import os
+import threading
+from lego.profiler import NullProfiler
+
+
+class BuildContext(object):  # pylint: disable=too-few-public-methods
+    """
+    Holds resources that are shared between all bricks of a build.
+    """
+
+    def __init__(self, apt_cache_ttl=None,  # pylint: disable=too-many-arguments
+                 state_dir='/var/lib/lego', checksum='md5', profiler=None, root='/',
+                 read_only=False, prefetch=True):
+        self.apt_cache_ttl = apt_cache_ttl
+        # Set when the system is only inspected, E.G by `lego check`.
+        self.read_only = read_only
+        # Whether bricks may fetch what they need, E.G package archives,
+        # in the background as soon as a build starts.
+        self.prefetch = prefetch
+        self.root = root
+        # Directory brick sets are read from, set by the builder to the one
+        # next to the builder file.
+        self.brick_sets_dir = 'brick_sets'
+        # Variables of the builder file, used to render templates.
+        self.variables = {}
+        self.profiler = profiler if profiler is not None else NullProfiler()
+        self.state_dir = state_dir
+        self.checksum = checksum
+        self.__digest_index = None
+        self.__dpkg_status = None
+        self.__id_resolver = None
+        self.__journal = None
+        self.__template_cache = None
+        self.__lock = threading.Lock()
+        # Held while a brick changes packages, dpkg only allows one writer.
+        self.package_lock = threading.Lock()
+        self.__apt_cache_manager = None
+
+    @property
+    def apt_cache_manager(self):
+        """
+        Return the apt cache manager shared by all package bricks.
+        It is only created when the first package brick asks for it.
+        Args:
+            None
+        Returns:
+            AptCacheManager: Shared apt cache manager.
+        Raises:
+            None
+        """
+        with self.__lock:
+            if self.__apt_cache_manager is None:
+                from lego.brick_modules.packages import AptCacheManager
+                self.__apt_cache_manager = AptCacheManager(ttl=self.apt_cache_ttl,
+                                                           profiler=self.profiler,
+                                                           root=self.root,
+                                                           update=not self.read_only)
+        return self.__apt_cache_manager
+
+    def rebase(self, path):
+        """
+        Get the path of a file under the root the build applies to.
+        Args:
+            path (str): Path as written in a brick, E.G /etc/hosts.
+        Returns:
+            str: Path under the root, E.G /srv/chroot/etc/hosts.
+        Raises:
+            None
+        """
+        if not self.root or self.root == '/':
+            return path
+        return os.path.join(self.root, path.lstrip('/'))
+
+    def use_root(self, root):
+        """
+        Apply the build to another root. State that belongs to the previous
+        root, like the journal, is dropped.
+        Args:
+            root (str): Directory to apply the build to, `/` for this system.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.__lock:
+            self.root = root
+            self.__digest_index = None
+            self.__dpkg_status = None
+            self.__id_resolver = None
+            self.__journal = None
+            self.__template_cache = None
+            if self.__apt_cache_manager is not None:
+                self.__apt_cache_manager.use_root(root)
+
+    @property
+    def digest_index(self):
+        """
+        Return the file digest index shared by all bricks.
+        It is kept in the state directory of the root between runs, if one is set.
+        Args:
+            None
+        Returns:
+            DigestIndex: Shared digest index.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        with self.__lock:
+            if self.__digest_index is None:
+                from lego.digests import DigestIndex
+                index_file = None
+                if self.state_dir:
+                    index_file = os.path.join(self.rebase(self.state_dir), 'digests.json')
+                self.__digest_index = DigestIndex(index_file=index_file,
+                                                  algorithm=self.checksum)
+        return self.__digest_index
+
+    @property
+    def dpkg_status(self):
+        """
+        Return the dpkg status reader of the root, shared by all package bricks.
+        Args:
+            None
+        Returns:
+            DpkgStatus: Shared dpkg status reader.
+        Raises:
+            None
+        """
+        with self.__lock:
+            if self.__dpkg_status is None:
+                from lego.brick_modules.packages import DpkgStatus, DPKG_STATUS_FILE
+                self.__dpkg_status = DpkgStatus(path=self.rebase(DPKG_STATUS_FILE))
+        return self.__dpkg_status
+
+    @property
+    def id_resolver(self):
+        """
+        Return the user and group name resolver shared by all bricks.
+        Args:
+            None
+        Returns:
+            IdResolver: Shared id resolver.
+        Raises:
+            None
+        """
+        with self.__lock:
+            if self.__id_resolver is None:
+                from lego.brick_modules.files import IdResolver
+                self.__id_resolver = IdResolver(root=self.root)
+        return self.__id_resolver
+
+    @property
+    def journal(self):
+        """
+        Return the brick fingerprint journal.
+        It is kept in the state directory of the root between runs, if one is set.
+        Args:
+            None
+        Returns:
+            Journal: Brick fingerprint journal.
+        Raises:
+            None
+        """
+        with self.__lock:
+            if self.__journal is None:
+                from lego.journal import Journal
+                journal_file = None
+                if self.state_dir:
+                    journal_file = os.path.join(self.rebase(self.state_dir), 'journal.json')
+                self.__journal = Journal(journal_file=journal_file)
+        return self.__journal
+
+    @property
+    def template_cache(self):
+        """
+        Return the compiled template cache shared by all file bricks.
+        It is kept in the state directory of the root between runs, if one is
+        set, and only read if the context is read only.
+        Args:
+            None
+        Returns:
+            TemplateCache: Shared template cache.
+        Raises:
+            None
+        """
+        digest_index = self.digest_index
+        with self.__lock:
+            if self.__template_cache is None:
+                from lego.templates import TemplateCache
+                cache_dir = None
+                if self.state_dir:
+                    cache_dir = os.path.join(self.rebase(self.state_dir), 'templates')
+                self.__template_cache = TemplateCache(cache_dir=cache_dir,
+                                                      digest_index=digest_index,
+                                                      read_only=self.read_only)
+        return self.__template_cache
+
+    def save(self):
+        """
+        Persist any state gathered during the build.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if self.__digest_index is not None:
+            self.__digest_index.save()
+        if self.__journal is not None:
+            self.__journal.save()
@@ -0,0 +1,413 @@
+"""
+Copy engine for materializing files atomically.
+"""
+
+
+import errno
+import logging
+import mmap
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Not available on every platform.
+    fcntl = None
+
+
+# ioctl request to share the extents of another file, see ioctl_ficlone(2).
+FICLONE = 0x40049409
+
+# Bytes moved per read and write when the kernel can not do the copy.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Size of the blocks compared when updating a file in place.
+DELTA_BLOCK_SIZE = 128 * 1024
+
+# Largest count sendfile and copy_file_range accept in one call.
+MAX_KERNEL_COPY = 0x7ffff000
+
+# Errors meaning a copy method is not supported for these two files.
+UNSUPPORTED_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                      errno.ENOTTY, errno.EBADF, errno.EPERM)
+
+LOGGER = logging.getLogger('lego.copier')
+
+
+def clone_file(source_fd, destination_fd):
+    """
+    Make the destination share the data of the source (reflink), if the
+    filesystem supports it.
+    Args:
+        source_fd (int): File descriptor of the source file.
+        destination_fd (int): File descriptor of the empty destination file.
+    Returns:
+        bool: True if the file was cloned, false otherwise.
+    Raises:
+        OSError: Raises OSError on unexpected errors.
+    """
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(destination_fd, FICLONE, source_fd)
+    except (IOError, OSError) as ex:
+        if ex.errno in UNSUPPORTED_ERRORS:
+            return False
+        raise
+    return True
+
+
+def _kernel_copy(copy_function, source_fd, destination_fd, size):
+    """
+    Copy data with a kernel copy function, either copy_file_range or sendfile.
+    Args:
+        copy_function (callable): Function taking (source_fd, destination_fd, count).
+        source_fd (int): File descriptor of the source file.
+        destination_fd (int): File descriptor of the destination file.
+        size (int): Size of the source file.
+    Returns:
+        bool: True if all data was copied, false if the method is unsupported.
+    Raises:
+        OSError: Raises OSError on unexpected errors.
+    """
+    copied = 0
+    while True:
+        try:
+            sent = copy_function(source_fd, destination_fd,
+                                 min(max(CHUNK_SIZE, size - copied), MAX_KERNEL_COPY))
+        except OSError as ex:
+            if copied == 0 and ex.errno in UNSUPPORTED_ERRORS:
+                return False
+            raise
+        if sent == 0:
+            return True
+        copied += sent
+
+
+def copy_data(source_fd, destination_fd, size):
+    """
+    Copy all data from the source to the destination without going through
+    userspace buffers where possible. Tries a reflink first, then
+    copy_file_range, then sendfile and falls back to read and write.
+    Args:
+        source_fd (int): File descriptor of the source file, at offset 0.
+        destination_fd (int): File descriptor of the empty destination file.
+        size (int): Size of the source file.
+    Returns:
+        str: Name of the method that did the copy.
+    Raises:
+        OSError: Raises OSError.
+    """
+    if clone_file(source_fd, destination_fd):
+        return 'reflink'
+
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is not None and _kernel_copy(copy_file_range, source_fd,
+                                                    destination_fd, size):
+        return 'copy_file_range'
+
+    sendfile = getattr(os, 'sendfile', None)
+    if sendfile is not None and _kernel_copy(
+            lambda in_fd, out_fd, count: sendfile(out_fd, in_fd, None, count),
+            source_fd, destination_fd, size):
+        return 'sendfile'
+
+    os.lseek(source_fd, 0, os.SEEK_SET)
+    os.lseek(destination_fd, 0, os.SEEK_SET)
+    while True:
+        chunk = os.read(source_fd, CHUNK_SIZE)
+        if not chunk:
+            return 'read'
+        while chunk:
+            written = os.write(destination_fd, chunk)
+            chunk = chunk[written:]
+
+
+def _target_metadata(existing, mode, uid, gid):
+    """
+    Work out the mode and owner of a new file, defaulting to those of the file
+    it replaces, or to the umask.
+    Args:
+        existing (os.stat_result): Stat of the file being replaced, None if there is none.
+        mode (int): Requested mode, None for the default.
+        uid (int): Requested user id, None for the default.
+        gid (int): Requested group id, None for the default.
+    Returns:
+        tuple: Mode, user id and group id. Ids may be None to leave them as they are.
+    Raises:
+        None
+    """
+    if mode is None:
+        if existing is not None:
+            mode = existing.st_mode & 0o7777
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+    if existing is not None:
+        uid = existing.st_uid if uid is None else uid
+        gid = existing.st_gid if gid is None else gid
+    return mode, uid, gid
+
+
+def _temp_file_for(destination):
+    """
+    Create a temporary file next to a destination.
+    Args:
+        destination (str): Real path of the file the temporary file will replace.
+    Returns:
+        tuple: File descriptor and path of the temporary file.
+    Raises:
+        OSError: Raises OSError.
+    """
+    destination_dir, destination_name = os.path.split(destination)
+    return tempfile.mkstemp(dir=destination_dir, prefix=".{0}.lego-".format(destination_name))
+
+
+def _install_temp_file(temp_fd, temp_file, destination,  # pylint: disable=too-many-arguments
+                       mode, uid, gid):
+    """
+    Set the mode and owner of a temporary file, flush it to disk, close it and
+    rename it over the destination.
+    Args:
+        temp_fd (int): File descriptor of the temporary file, closed by this function.
+        temp_file (str): Path of the temporary file.
+        destination (str): Real path of the file to create or replace.
+        mode (int): Mode to set on the new file.
+        uid (int): User id to set on the new file, None to leave it.
+        gid (int): Group id to set on the new file, None to leave it.
+    Returns:
+        None
+    Raises:
+        OSError: Raises OSError.
+    """
+    try:
+        if uid is not None or gid is not None:
+            os.fchown(temp_fd, -1 if uid is None else uid, -1 if gid is None else gid)
+        os.fchmod(temp_fd, mode)
+        # Without it, a crash after the rename can leave an empty destination.
+        os.fsync(temp_fd)
+    finally:
+        os.close(temp_fd)
+    os.rename(temp_file, destination)
+
+
+def atomic_copy(source, destination, mode=None, uid=None, gid=None):
+    """
+    Copy a file into a temporary file next to the destination, set its mode and
+    owner and rename it over the destination, so readers never see a partial file.
+    Mode and owner default to those of the existing destination, if there is one.
+    Args:
+        source (str): File to copy.
+        destination (str): File to create or replace. Symlinks are followed.
+        mode (int): Mode to set on the new file.
+        uid (int): User id to set on the new file.
+        gid (int): Group id to set on the new file.
+    Returns:
+        None
+    Raises:
+        OSError: Raises OSError.
+    """
+    destination = os.path.realpath(destination)
+    try:
+        existing = os.stat(destination)
+    except OSError:
+        existing = None
+    mode, uid, gid = _target_metadata(existing, mode, uid, gid)
+
+    temp_fd, temp_file = _temp_file_for(destination)
+    try:
+        source_fd = os.open(source, os.O_RDONLY)
+        try:
+            method = copy_data(source_fd, temp_fd, os.fstat(source_fd).st_size)
+        finally:
+            os.close(source_fd)
+    except BaseException:
+        os.close(temp_fd)
+        os.unlink(temp_file)
+        raise
+    try:
+        _install_temp_file(temp_fd, temp_file, destination, mode, uid, gid)
+    except BaseException:
+        os.unlink(temp_file)
+        raise
+    LOGGER.debug("Copied `%s` to `%s` using %s", source, destination, method)
+
+
+def atomic_write(data, destination, mode=None, uid=None, gid=None):
+    """
+    Write data into a temporary file next to the destination, set its mode and
+    owner and rename it over the destination, so readers never see a partial file.
+    Mode and owner default to those of the existing destination, if there is one.
+    Args:
+        data (bytes): Contents of the file.
+        destination (str): File to create or replace. Symlinks are followed.
+        mode (int): Mode to set on the new file.
+        uid (int): User id to set on the new file.
+        gid (int): Group id to set on the new file.
+    Returns:
+        None
+    Raises:
+        OSError: Raises OSError.
+    """
+    destination = os.path.realpath(destination)
+    try:
+        existing = os.stat(destination)
+    except OSError:
+        existing = None
+    mode, uid, gid = _target_metadata(existing, mode, uid, gid)
+
+    temp_fd, temp_file = _temp_file_for(destination)
+    try:
+        write_at(temp_fd, data, 0)
+    except BaseException:
+        os.close(temp_fd)
+        os.unlink(temp_file)
+        raise
+    try:
+        _install_temp_file(temp_fd, temp_file, destination, mode, uid, gid)
+    except BaseException:
+        os.unlink(temp_file)
+        raise
+    LOGGER.debug("Wrote %s bytes to `%s`", len(data), destination)
+
+
+def write_at(file_fd, data, offset):
+    """
+    Write all of the data at an offset of a file.
+    Args:
+        file_fd (int): File descriptor to write to.
+        data (bytes): Data to write.
+        offset (int): Offset to write at.
+    Returns:
+        int: Number of bytes written.
+    Raises:
+        OSError: Raises OSError.
+    """
+    pwrite = getattr(os, 'pwrite', None)
+    view = memoryview(data)
+    written = 0
+    if pwrite is None:
+        os.lseek(file_fd, offset, os.SEEK_SET)
+    while written < len(view):
+        if pwrite is not None:
+            written += pwrite(file_fd, view[written:], offset + written)
+        else:
+            written += os.write(file_fd, view[written:])
+    return written
+
+
+def _map_file(file_fd, size):
+    """
+    Map a whole file read only.
+    Args:
+        file_fd (int): File descriptor of the file.
+        size (int): Size of the file.
+    Returns:
+        mmap.mmap: Mapping of the file, None if it is empty.
+    Raises:
+        OSError: Raises OSError.
+    """
+    if size == 0:
+        return None
+    return mmap.mmap(file_fd, size, access=mmap.ACCESS_READ)
+
+
+def patch_blocks(source_fd, destination_fd, block_size=DELTA_BLOCK_SIZE):
+    """
+    Make the destination the same as the source by rewriting only the blocks
+    that differ, then truncating or extending it to the size of the source.
+    Both files are memory mapped and compared block by block.
+    Args:
+        source_fd (int): File descriptor of the source file.
+        destination_fd (int): File descriptor of the destination file, open for writing.
+        block_size (int): Size of the blocks to compare.
+    Returns:
+        int: Number of bytes written.
+    Raises:
+        OSError: Raises OSError.
+    """
+    source_size = os.fstat(source_fd).st_size
+    destination_size = os.fstat(destination_fd).st_size
+    source_map = _map_file(source_fd, source_size)
+    destination_map = _map_file(destination_fd, destination_size)
+    written = 0
+    try:
+        # Start of the run of changed blocks not written yet.
+        start = None
+        for offset in range(0, source_size, block_size):
+            end = min(offset + block_size, source_size)
+            changed = (end > destination_size or
+                       source_map[offset:end] != destination_map[offset:end])
+            if changed and start is None:
+                start = offset
+            elif start is not None and (not changed or offset - start >= CHUNK_SIZE):
+                written += write_at(destination_fd, source_map[start:offset], start)
+                start = offset if changed else None
+        if start is not None:
+            written += write_at(destination_fd, source_map[start:source_size], start)
+    finally:
+        for each_map in (source_map, destination_map):
+            if each_map is not None:
+                each_map.close()
+    if destination_size != source_size:
+        os.ftruncate(destination_fd, source_size)
+    return written
+
+
+def delta_copy(source, destination, mode=None, uid=None, gid=None):
+    """
+    Update an existing file to match a source, writing only the blocks that differ.
+    The destination is reflinked into a temporary file which is patched and
+    renamed over the destination, so readers never see a partial file. Where
+    reflinks are not supported, the destination is patched in place.
+    Args:
+        source (str): File to copy.
+        destination (str): Existing file to update. Symlinks are followed.
+        mode (int): Mode to set on the file.
+        uid (int): User id to set on the file.
+        gid (int): Group id to set on the file.
+    Returns:
+        int: Number of bytes written.
+    Raises:
+        OSError: Raises OSError.
+    """
+    destination = os.path.realpath(destination)
+    mode, uid, gid = _target_metadata(os.stat(destination), mode, uid, gid)
+    source_fd = os.open(source, os.O_RDONLY)
+    try:
+        temp_fd, temp_file = _temp_file_for(destination)
+        try:
+            destination_fd = os.open(destination, os.O_RDONLY)
+            try:
+                cloned = clone_file(destination_fd, temp_fd)
+            finally:
+                os.close(destination_fd)
+            written = patch_blocks(source_fd, temp_fd) if cloned else None
+        except BaseException:
+            os.close(temp_fd)
+            os.unlink(temp_file)
+            raise
+        if cloned:
+            try:
+                _install_temp_file(temp_fd, temp_file, destination, mode, uid, gid)
+            except BaseException:
+                os.unlink(temp_file)
+                raise
+            LOGGER.debug("Patched a reflink of `%s` from `%s`", destination, source)
+            return written
+
+        os.close(temp_fd)
+        os.unlink(temp_file)
+        destination_fd = os.open(destination, os.O_RDWR)
+        try:
+            written = patch_blocks(source_fd, destination_fd)
+            if uid is not None or gid is not None:
+                os.fchown(destination_fd, -1 if uid is None else uid, -1 if gid is None else gid)
+            os.fchmod(destination_fd, mode)
+        finally:
+            os.close(destination_fd)
+        LOGGER.debug("Patched `%s` in place from `%s`", destination, source)
+        return written
+    finally:
+        os.close(source_fd)
@@ -0,0 +1,174 @@
+"""
+Content digests of files, cached across runs.
+"""
+
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from lego.common import LegoException
+
+
+# Read files in 1 MiB chunks, hashing is much cheaper per call with large reads.
+READ_BUFFER_SIZE = 1024 * 1024
+
+# Digests of files modified this recently are not cached, as another change
+# within the same timestamp tick would go unnoticed.
+RACY_WINDOW = 2
+
+
+def get_checksum(file_to_hash, algorithm='md5'):
+    """
+    Get the checksum of a given file.
+    Args:
+        file_to_hash (str): File to get its checksum.
+        algorithm (str): Name of a hashlib algorithm, E.G md5 or blake2b.
+    Returns:
+        str: Hex digest of the given file.
+    Raises:
+        LegoException: Raises LegoException if the algorithm is not available.
+    """
+    try:
+        file_hash = hashlib.new(algorithm)
+    except ValueError:
+        raise LegoException("Checksum algorithm `{0}` is not available".format(algorithm))
+    with open(file_to_hash, 'rb') as open_file:
+        for chunk in iter(lambda: open_file.read(READ_BUFFER_SIZE), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_data_checksum(data, algorithm='md5'):
+    """
+    Get the checksum of data in memory, E.G a rendered template.
+    Args:
+        data (bytes): Data to get its checksum.
+        algorithm (str): Name of a hashlib algorithm, E.G md5 or blake2b.
+    Returns:
+        str: Hex digest of the data.
+    Raises:
+        LegoException: Raises LegoException if the algorithm is not available.
+    """
+    try:
+        data_hash = hashlib.new(algorithm)
+    except ValueError:
+        raise LegoException("Checksum algorithm `{0}` is not available".format(algorithm))
+    data_hash.update(data)
+    return data_hash.hexdigest()
+
+
+def stat_key(stat_result):
+    """
+    Get the identity of a file version from its stat result.
+    Args:
+        stat_result (os.stat_result): Result of os.stat on the file.
+    Returns:
+        list: st_dev, st_ino, st_size and the modification time in nanoseconds.
+    Raises:
+        None
+    """
+    mtime_ns = getattr(stat_result, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(stat_result.st_mtime * 1000000000)
+    return [stat_result.st_dev, stat_result.st_ino, stat_result.st_size, mtime_ns]
+
+
+class DigestIndex(object):
+    """
+    Index of file digests keyed by path, reused while the file is unchanged.
+    A file counts as unchanged while its device, inode, size and modification
+    time stay the same.
+    """
+
+    def __init__(self, index_file=None, algorithm='md5'):
+        self.logger = logging.getLogger('lego.digests.DigestIndex')
+        self.index_file = index_file
+        self.algorithm = algorithm
+        self.__entries = {}
+        self.__dirty = False
+        self.__lock = threading.Lock()
+        try:
+            hashlib.new(algorithm)
+        except ValueError:
+            raise LegoException("Checksum algorithm `{0}` is not available".format(algorithm))
+        self.__load()
+
+    def __load(self):
+        """
+        Load the index from disk, starting empty if it can not be read.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if not self.index_file or not os.path.isfile(self.index_file):
+            return
+        try:
+            with open(self.index_file, 'r') as stream:
+                entries = json.load(stream)
+        except (IOError, OSError, ValueError) as ex:
+            self.logger.warning("Ignoring unreadable digest index `%s` with error %s",
+                                self.index_file, ex)
+            return
+        if isinstance(entries, dict):
+            self.__entries = entries
+
+    def save(self):
+        """
+        Write the index to disk if it changed.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if not self.index_file or not self.__dirty:
+            return
+        with self.__lock:
+            entries = dict(self.__entries)
+            self.__dirty = False
+        index_dir = os.path.dirname(os.path.abspath(self.index_file))
+        try:
+            if not os.path.isdir(index_dir):
+                os.makedirs(index_dir)
+            handle, temp_file = tempfile.mkstemp(dir=index_dir, prefix='.digests-')
+            with os.fdopen(handle, 'w') as stream:
+                json.dump(entries, stream)
+            os.rename(temp_file, self.index_file)
+        except (IOError, OSError) as ex:
+            self.logger.warning("Could not save digest index `%s` with error %s",
+                                self.index_file, ex)
+
+    def digest(self, path, stat_result=None):
+        """
+        Get the digest of a file, only hashing it if it changed since last time.
+        Args:
+            path (str): File to get the digest of.
+            stat_result (os.stat_result): Result of os.stat on the file, if known.
+        Returns:
+            str: Hex digest of the file.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        if stat_result is None:
+            stat_result = os.stat(path)
+        key = stat_key(stat_result) + [self.algorithm]
+        path = os.path.abspath(path)
+        with self.__lock:
+            entry = self.__entries.get(path)
+        if entry is not None and entry[:-1] == key:
+            return entry[-1]
+
+        file_digest = get_checksum(file_to_hash=path, algorithm=self.algorithm)
+        if time.time() - stat_result.st_mtime > RACY_WINDOW:
+            with self.__lock:
+                self.__entries[path] = key + [file_digest]
+                self.__dirty = True
+        return file_digest
@@ -4,16 +4,92 @@ Executable for Lego configuration management tool.
 
 
 import sys
+import atexit
+import json
 import logging
 import argparse
+from lego.agent import Agent
 from lego.builder import Builder
 from lego.common import LegoException
+from lego.context import BuildContext
+from lego.logs import LOG_FORMATS, configure_logging
+from lego.profiler import Profiler
+from lego.watcher import make_watcher
 
 
 SUPPORTED_COMMANDS = [
-    'build'
+    'build',
+    'validate',
+    'agent',
+    'check'
 ]
 
+# Exit codes of `lego check`, following diff(1).
+CHECK_IN_SYNC = 0
+CHECK_DRIFTED = 1
+CHECK_FAILED = 2
+
+
+def positive_int(value):
+    """
+    Parse a command line value that must be a positive integer.
+    Args:
+        value (str): Value given on the command line.
+    Returns:
+        int: Parsed value.
+    Raises:
+        argparse.ArgumentTypeError: Raises ArgumentTypeError if the value is not positive.
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError("`{0}` is not a positive integer".format(value))
+    return number
+
+
+def write_profile(profiler, path, logger):
+    """
+    Write the trace of a profiled build and log its slowest bricks.
+    Args:
+        profiler (Profiler): Profiler the build ran with.
+        path (str): File to write the Chrome trace to.
+        logger (logging.Logger): Logger for the summary.
+    Returns:
+        None
+    Raises:
+        None
+    """
+    try:
+        profiler.write_trace(path)
+    except (IOError, OSError) as ex:
+        logger.error("Could not write profile `%s` with error %s", path, ex)
+        return
+    logger.info("Wrote profile to `%s`, slowest bricks:\n%s", path, profiler.summary())
+
+
+def report_roots(results, logger):
+    """
+    Log the outcome of building every root.
+    Args:
+        results (list): RootResult of every root.
+        logger (logging.Logger): Logger for the report.
+    Returns:
+        None
+    Raises:
+        None
+    """
+    for result in results:
+        if result.succeeded:
+            logger.info("Root `%s` built in %.2f seconds", result.root, result.seconds)
+        else:
+            logger.error("Root `%s` failed after %.2f seconds with error %s",
+                         result.root, result.seconds, result.error)
+    logger.info("%s of %s root(s) built", sum(1 for result in results if result.succeeded),
+                len(results))
+
+
 def main():
     """
     Main function to run the Lego executable.
@@ -36,19 +112,60 @@ def main():
                         help="Builder file to run")
     parser.add_argument('--builder_file', dest='builder_file', default=None,
                         help="Builder file to run")
+    parser.add_argument('--apt-cache-ttl', dest='apt_cache_ttl', type=int, default=None,
+                        help="Skip refreshing apt package lists if they were updated "
+                        "within this many seconds")
+    parser.add_argument('--jobs', dest='jobs', type=positive_int, default=1,
+                        help="Number of bricks that may run at the same time")
+    parser.add_argument('--state-dir', dest='state_dir', default='/var/lib/lego',
+                        help="Directory to keep state between runs in")
+    parser.add_argument('--checksum', dest='checksum', default='md5',
+                        help="Checksum algorithm used to compare files, E.G md5 or blake2b")
+    parser.add_argument('--force', default=False, action='store_true',
+                        help="Run every brick, even if nothing changed since its last run")
+    parser.add_argument('--resume', default=False, action='store_true',
+                        help="Skip bricks that completed in the last build, if it failed")
+    parser.add_argument('--no-cache', dest='use_cache', default=True, action='store_false',
+                        help="Do not read or write the compiled brick set caches")
+    parser.add_argument('--no-prefetch', dest='prefetch', default=True, action='store_false',
+                        help="Do not download package archives in the background while "
+                        "other bricks run")
+    parser.add_argument('--stream', default=False, action='store_true',
+                        help="Load and run brick sets one at a time instead of validating "
+                        "the whole build first")
+    parser.add_argument('--root', dest='roots', action='append', default=None, metavar='DIR',
+                        help="Apply the build to this root instead of this system. May be "
+                        "given more than once to build several roots in parallel")
+    parser.add_argument('--processes', dest='processes', type=positive_int, default=None,
+                        help="Number of roots that may be built at the same time. "
+                        "Defaults to the number of CPUs")
+    parser.add_argument('--debounce', dest='debounce', type=float, default=0.2,
+                        help="Seconds `lego agent` waits for changes to settle before "
+                        "applying them")
+    parser.add_argument('--poll-interval', dest='poll_interval', type=float, default=1.0,
+                        help="Seconds between checks for changes by `lego agent` when "
+                        "inotify is not available")
+    parser.add_argument('--profile', dest='profile', default=None, metavar='PATH',
+                        help="Write a Chrome trace of the build to this file and log "
+                        "the slowest bricks")
     parser.add_argument('--debug', default=False, action='store_true',
                         help="Print debugging logs as well")
+    parser.add_argument('--log-format', dest='log_format', default='text', choices=LOG_FORMATS,
+                        help="Format of the logs, `json` writes a JSON object per line")
+    parser.add_argument('--async-logging', dest='async_logging', default=False,
+                        action='store_true',
+                        help="Format and write logs on a background thread")
+    parser.add_argument('--log-summary', dest='log_summary', default=False, action='store_true',
+                        help="Only log a summary of each brick instead of every file")
     args = parser.parse_args()
 
-    print args
-
-    if args.debug:
-        logging.basicConfig(level=logging.DEBUG)
-    else:
-        logging.basicConfig(level=logging.INFO)
+    listener = configure_logging(debug=args.debug, log_format=args.log_format,
+                                 queued=args.async_logging, summary=args.log_summary)
+    if listener is not None:
+        # Also runs on sys.exit, so no queued record is lost.
+        atexit.register(listener.stop)
     logger = logging.getLogger('lego.executable.main')
 
-
     if args.action not in SUPPORTED_COMMANDS:
         parser.print_help()
         sys.exit(1)
@@ -57,10 +174,80 @@ def main():
         if not args.builder_file:
             parser.print_help()
             sys.exit(1)
+        if args.stream and args.roots:
+            parser.error("--stream can not be used with --root")
+        profiler = Profiler() if args.profile else None
         try:
-            builder = Builder(builder_file=sys.argv[2])
-            builder.build()
+            context = BuildContext(apt_cache_ttl=args.apt_cache_ttl,
+                                   state_dir=args.state_dir,
+                                   checksum=args.checksum,
+                                   profiler=profiler,
+                                   prefetch=args.prefetch)
+            builder = Builder(builder_file=args.builder_file, context=context,
+                              use_cache=args.use_cache, lazy=args.stream)
+            if args.stream:
+                builder.stream(jobs=args.jobs, force=args.force, resume=args.resume)
+            elif args.roots:
+                report_roots(builder.build_roots(roots=args.roots, jobs=args.jobs,
+                                                 force=args.force, resume=args.resume,
+                                                 processes=args.processes), logger)
+            else:
+                builder.build(jobs=args.jobs, force=args.force, resume=args.resume)
         except LegoException as lego_ex:
             logger.error("Something went wrong while running `lego build` with error %s", lego_ex)
         except Exception as ex:  # pylint: disable=broad-except
             logger.error("Something badly went wrong while running 'lego build` with error %s", ex)
+        finally:
+            if profiler is not None:
+                write_profile(profiler, args.profile, logger)
+
+    if args.action == 'validate':
+        if not args.builder_file:
+            parser.print_help()
+            sys.exit(1)
+        try:
+            builder = Builder(builder_file=args.builder_file,
+                              context=BuildContext(state_dir=None),
+                              use_cache=args.use_cache)
+            builder.compile()
+        except LegoException as lego_ex:
+            logger.error("Something went wrong while running `lego validate` with error %s",
+                         lego_ex)
+            sys.exit(1)
+        logger.info("Builder file `%s` is valid", args.builder_file)
+
+    if args.action == 'agent':
+        if not args.builder_file:
+            parser.print_help()
+            sys.exit(1)
+        context = BuildContext(apt_cache_ttl=args.apt_cache_ttl,
+                               state_dir=args.state_dir,
+                               checksum=args.checksum,
+                               prefetch=args.prefetch)
+        agent = Agent(builder_file=args.builder_file, context=context,
+                      use_cache=args.use_cache, jobs=args.jobs, debounce=args.debounce,
+                      watcher=make_watcher(poll_interval=args.poll_interval))
+        agent.run()
+
+    if args.action == 'check':
+        if not args.builder_file:
+            parser.print_help()
+            sys.exit(CHECK_FAILED)
+        if args.roots and len(args.roots) > 1:
+            parser.error("`lego check` takes a single --root")
+        try:
+            context = BuildContext(state_dir=args.state_dir,
+                                   checksum=args.checksum,
+                                   root=args.roots[0] if args.roots else '/',
+                                   read_only=True)
+            builder = Builder(builder_file=args.builder_file, context=context,
+                              use_cache=args.use_cache)
+            report = builder.check(jobs=args.jobs)
+        except LegoException as lego_ex:
+            logger.error("Something went wrong while running `lego check` with error %s",
+                         lego_ex)
+            sys.exit(CHECK_FAILED)
+        sys.stdout.write(json.dumps(report, indent=2, separators=(',', ': ')) + '\n')
+        if report['errors']:
+            sys.exit(CHECK_FAILED)
+        sys.exit(CHECK_IN_SYNC if report['in_sync'] else CHECK_DRIFTED)
@@ -0,0 +1,181 @@
+"""
+Journal of brick fingerprints, used to skip bricks that have nothing to do.
+"""
+
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+
+def make_fingerprint(data):
+    """
+    Make a fingerprint out of any JSON serializable data.
+    Args:
+        data (object): Data describing a brick and the state of its targets.
+    Returns:
+        str: Hex digest of the data.
+    Raises:
+        None
+    """
+    serialized = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.md5(serialized.encode('utf-8')).hexdigest()
+
+
+class Journal(object):
+    """
+    Records the fingerprint of every brick after it ran successfully, and the
+    bricks that completed during a build that failed.
+    """
+
+    def __init__(self, journal_file=None):
+        self.logger = logging.getLogger('lego.journal.Journal')
+        self.journal_file = journal_file
+        self.__fingerprints = {}
+        self.__resumable = None
+        self.__completed = set()
+        self.__lock = threading.Lock()
+        self.__load()
+
+    def __load(self):
+        """
+        Load the journal from disk, starting empty if it can not be read.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if not self.journal_file or not os.path.isfile(self.journal_file):
+            return
+        try:
+            with open(self.journal_file, 'r') as stream:
+                journal = json.load(stream)
+            self.__fingerprints = dict(journal['fingerprints'])
+            if journal.get('resumable') is not None:
+                self.__resumable = set(journal['resumable'])
+        except (IOError, OSError, ValueError, KeyError, TypeError) as ex:
+            self.logger.warning("Ignoring unreadable journal `%s` with error %s",
+                                self.journal_file, ex)
+
+    def save(self):
+        """
+        Write the journal to disk.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if not self.journal_file:
+            return
+        with self.__lock:
+            journal = {
+                'fingerprints': dict(self.__fingerprints),
+                'resumable': sorted(self.__resumable) if self.__resumable is not None else None
+            }
+        journal_dir = os.path.dirname(os.path.abspath(self.journal_file))
+        try:
+            if not os.path.isdir(journal_dir):
+                os.makedirs(journal_dir)
+            handle, temp_file = tempfile.mkstemp(dir=journal_dir, prefix='.journal-')
+            with os.fdopen(handle, 'w') as stream:
+                json.dump(journal, stream)
+            os.rename(temp_file, self.journal_file)
+        except (IOError, OSError) as ex:
+            self.logger.warning("Could not save journal `%s` with error %s",
+                                self.journal_file, ex)
+
+    def is_unchanged(self, brick_id, fingerprint):
+        """
+        Check whether a brick has the same fingerprint as after its last successful run.
+        Args:
+            brick_id (str): Brick in the form `brick set/brick`.
+            fingerprint (str): Current fingerprint of the brick, None if it has none.
+        Returns:
+            bool: True if the brick can be skipped, false otherwise.
+        Raises:
+            None
+        """
+        if fingerprint is None:
+            return False
+        with self.__lock:
+            return self.__fingerprints.get(brick_id) == fingerprint
+
+    def completed_in_failed_build(self, brick_id):
+        """
+        Check whether a brick completed during the last build, if that build failed.
+        Args:
+            brick_id (str): Brick in the form `brick set/brick`.
+        Returns:
+            bool: True if the brick can be skipped when resuming, false otherwise.
+        Raises:
+            None
+        """
+        with self.__lock:
+            return self.__resumable is not None and brick_id in self.__resumable
+
+    def record(self, brick_id, fingerprint):
+        """
+        Record that a brick completed, with its fingerprint after running.
+        Args:
+            brick_id (str): Brick in the form `brick set/brick`.
+            fingerprint (str): Fingerprint of the brick, None if it has none.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.__lock:
+            self.__completed.add(brick_id)
+            if fingerprint is None:
+                self.__fingerprints.pop(brick_id, None)
+            else:
+                self.__fingerprints[brick_id] = fingerprint
+
+    def skip(self, brick_id):
+        """
+        Record that a brick was skipped because it had nothing to do.
+        Args:
+            brick_id (str): Brick in the form `brick set/brick`.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.__lock:
+            self.__completed.add(brick_id)
+
+    def forget(self, brick_id):
+        """
+        Forget the fingerprint of a brick, so it runs next time.
+        Args:
+            brick_id (str): Brick in the form `brick set/brick`.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.__lock:
+            self.__fingerprints.pop(brick_id, None)
+
+    def finish_build(self, succeeded):
+        """
+        Record the outcome of a build.
+        After a failed build, the bricks that completed can be skipped by a
+        resumed build. A successful build clears that list.
+        Args:
+            succeeded (bool): Whether the build succeeded.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.__lock:
+            self.__resumable = None if succeeded else self.__completed
+            self.__completed = set()
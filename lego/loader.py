@@ -0,0 +1,141 @@
+"""
+Loading of builder and brick set files, with a compiled cache next to each file.
+"""
+
+
+import logging
+import os
+import pickle
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+import oyaml as yaml
+from lego.common import LegoException
+from lego.digests import RACY_WINDOW, stat_key
+
+
+# Use the libyaml based loader when PyYAML was built with it.
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)  # pylint: disable=invalid-name
+
+# Whether plain dicts keep the order mappings are listed in.
+DICT_IS_ORDERED = sys.version_info >= (3, 7)
+
+# Bump when the layout of the cache files changes.
+CACHE_VERSION = 1
+
+LOGGER = logging.getLogger('lego.loader')
+
+
+def _map_constructor(loader, node):
+    """
+    Construct a YAML mapping as an OrderedDict, as oyaml does for the
+    pure Python loaders.
+    Args:
+        loader (yaml.Loader): Loader constructing the document.
+        node (yaml.MappingNode): Mapping to construct.
+    Returns:
+        OrderedDict: Mapping in the order it is listed.
+    Raises:
+        yaml.YAMLError: Raises YAMLError.
+    """
+    loader.flatten_mapping(node)
+    return OrderedDict(loader.construct_pairs(node))
+
+
+# oyaml only keeps the order of mappings for the pure Python loaders in
+# older releases, so bricks and brick sets would lose their order with libyaml.
+if not DICT_IS_ORDERED:
+    Loader.add_constructor('tag:yaml.org,2002:map', _map_constructor)
+
+
+def cache_path(path):
+    """
+    Get the path of the compiled cache of a YAML file.
+    Args:
+        path (str): YAML file.
+    Returns:
+        str: Path of the cache file, next to the YAML file.
+    Raises:
+        None
+    """
+    directory, name = os.path.split(path)
+    return os.path.join(directory, ".{0}.cache".format(name))
+
+
+def parse_yaml(stream):
+    """
+    Parse a YAML document, keeping the order of mappings.
+    Args:
+        stream (file): Open YAML file.
+    Returns:
+        object: Parsed document.
+    Raises:
+        yaml.YAMLError: Raises YAMLError.
+    """
+    return yaml.load(stream, Loader=Loader)
+
+
+def _read_cache(path, key):
+    try:
+        with open(cache_path(path), 'rb') as stream:
+            cached = pickle.load(stream)
+    except Exception:  # pylint: disable=broad-except
+        return None
+    if not isinstance(cached, dict) or cached.get('key') != key:
+        return None
+    return cached
+
+
+def _write_cache(path, key, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        handle, temp_file = tempfile.mkstemp(dir=directory, prefix='.lego-cache-')
+    except (IOError, OSError) as ex:
+        LOGGER.debug("Not caching `%s` with error %s", path, ex)
+        return
+    try:
+        with os.fdopen(handle, 'wb') as stream:
+            pickle.dump({'key': key, 'data': data}, stream, protocol=2)
+        os.rename(temp_file, cache_path(path))
+    except (IOError, OSError, pickle.PicklingError) as ex:
+        LOGGER.debug("Not caching `%s` with error %s", path, ex)
+        try:
+            os.unlink(temp_file)
+        except OSError:
+            pass
+
+
+def load_yaml(path, use_cache=True):
+    """
+    Load a YAML file, reusing its compiled cache while the file is unchanged.
+    The cache is keyed on the path, modification time and size of the file.
+    Args:
+        path (str): YAML file to load.
+        use_cache (bool): Whether to read and write the compiled cache.
+    Returns:
+        object: Parsed document.
+    Raises:
+        LegoException: Raises LegoException if the file can not be parsed.
+        IOError: Raises IOError if the file can not be read.
+    """
+    key = None
+    if use_cache:
+        path_stat = os.stat(path)
+        key = [CACHE_VERSION, os.path.abspath(path)] + stat_key(path_stat)
+        cached = _read_cache(path, key)
+        if cached is not None:
+            LOGGER.debug("Loaded `%s` from its compiled cache", path)
+            return cached['data']
+
+    with open(path, 'r') as stream:
+        try:
+            data = parse_yaml(stream)
+        except yaml.YAMLError as yaml_ex:
+            raise LegoException("Something went wrong while loading `{0}` "
+                                "with error {1}".format(path, yaml_ex))
+
+    # Another edit within the same timestamp tick would not change the key.
+    if use_cache and time.time() - path_stat.st_mtime > RACY_WINDOW:
+        _write_cache(path, key, data)
+    return data
@@ -0,0 +1,226 @@
+"""
+Logging setup for the Lego executable, optionally queued and as JSON lines.
+"""
+
+
+import copy
+import json
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue  # pylint: disable=import-error
+
+
+LOG_FORMATS = [
+    'text',
+    'json'
+]
+
+TEXT_FORMAT = '%(levelname)s:%(name)s:%(message)s'
+
+# Loggers that write a line for every file entry. With summaries only, they
+# are limited to warnings and the per brick lines are left.
+DETAIL_LOGGERS = [
+    'lego.brick_modules.files',
+    'lego.brick_modules.packages.AptPackage'
+]
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as a single line JSON object.
+    """
+
+    def format(self, record):
+        """
+        Format a record as JSON.
+        Args:
+            record (logging.LogRecord): Record to format.
+        Returns:
+            str: JSON object on a single line.
+        Raises:
+            None
+        """
+        entry = OrderedDict([('time', record.created),
+                             ('level', record.levelname),
+                             ('logger', record.name),
+                             ('thread', record.threadName),
+                             ('message', record.getMessage())])
+        # Records from the queue carry the exception already rendered.
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+def dispatch(record, handlers):
+    """
+    Pass a record to every handler whose level it meets.
+    Args:
+        record (logging.LogRecord): Record to write.
+        handlers (list): Handlers to write it with.
+    Returns:
+        None
+    Raises:
+        None
+    """
+    for handler in handlers:
+        if record.levelno >= handler.level:
+            handler.handle(record)
+
+
+class QueueHandler(logging.Handler):
+    """
+    Hands records over to a queue, so the thread logging does not wait for
+    them to be formatted and written. Forked processes, E.G the workers
+    building roots, do not have the thread reading the queue, so they write
+    their records with the handlers themselves.
+    """
+
+    def __init__(self, record_queue, handlers):
+        logging.Handler.__init__(self)
+        self.queue = record_queue
+        self.handlers = handlers
+        self.__pid = os.getpid()
+        self.__formatter = logging.Formatter()
+
+    def prepare(self, record):
+        """
+        Render the message and exception of a record, so arguments changed
+        after logging, or an exception gone by the time the record is
+        written, do not change what is written.
+        Args:
+            record (logging.LogRecord): Record to queue.
+        Returns:
+            logging.LogRecord: Copy of the record without arguments or exc_info.
+        Raises:
+            None
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.__formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        """
+        Put a record on the queue.
+        Args:
+            record (logging.LogRecord): Record to queue.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if os.getpid() != self.__pid:
+            dispatch(record, self.handlers)
+            return
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """
+    Formats and writes the records of a queue on a background thread.
+    """
+
+    def __init__(self, record_queue, handlers):
+        self.queue = record_queue
+        self.handlers = handlers
+        self.__thread = None
+
+    def start(self):
+        """
+        Start writing records in the background.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.__thread = threading.Thread(target=self.__run, name='lego-logging')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __run(self):
+        """
+        Write records until the stop marker is read.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            dispatch(record, self.handlers)
+
+    def stop(self):
+        """
+        Write the records still queued and stop the background thread.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if self.__thread is None:
+            return
+        self.queue.put(None)
+        self.__thread.join()
+        self.__thread = None
+        for handler in self.handlers:
+            handler.flush()
+
+
+def configure_logging(debug=False, log_format='text', queued=False, summary=False):
+    """
+    Set up the root logger for the executable.
+    Args:
+        debug (bool): Log debugging records as well.
+        log_format (str): `text`, or `json` for a JSON object per line.
+        queued (bool): Format and write records on a background thread.
+        summary (bool): Only log a summary of each brick instead of every file.
+    Returns:
+        QueueListener: Listener writing the records that must be stopped
+                       before exiting, or None if records are not queued.
+    Raises:
+        None
+    """
+    handler = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    if summary and not debug:
+        for name in DETAIL_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    if not queued:
+        root_logger.addHandler(handler)
+        return None
+    record_queue = queue.Queue()
+    listener = QueueListener(record_queue, [handler])
+    root_logger.addHandler(QueueHandler(record_queue, [handler]))
+    listener.start()
+    return listener
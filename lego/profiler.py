@@ -0,0 +1,181 @@
+"""
+Timing spans for builds, exported as a Chrome trace.
+"""
+
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Monotonic clock where available.
+CLOCK = getattr(time, 'perf_counter', time.time)
+
+
+class _NullSpan(object):  # pylint: disable=too-few-public-methods
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class NullProfiler(object):
+    """
+    Profiler that records nothing, used when profiling is off.
+    """
+
+    def span(self, name, category, **args):  # pylint: disable=unused-argument
+        """
+        Time a block of code. Does nothing.
+        Args:
+            name (str): Name of the span.
+            category (str): Category of the span, E.G brick or file.
+            args: Extra details to attach to the span.
+        Returns:
+            object: Context manager.
+        Raises:
+            None
+        """
+        return NULL_SPAN
+
+    def add_span(self, name, category, start, end, **args):
+        """
+        Record a span that was timed elsewhere. Does nothing.
+        Args:
+            name (str): Name of the span.
+            category (str): Category of the span.
+            start (float): Start time from CLOCK.
+            end (float): End time from CLOCK.
+            args: Extra details to attach to the span.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        pass
+
+
+class Profiler(NullProfiler):
+    """
+    Records timing spans from any thread.
+    Hooks are called with (name, category, seconds, args) for every span, E.G
+    to feed a metrics exporter.
+    """
+
+    def __init__(self):
+        self.__origin = CLOCK()
+        self.__events = []
+        self.__hooks = []
+        self.__lock = threading.Lock()
+
+    def add_hook(self, hook):
+        """
+        Call a function for every finished span.
+        Args:
+            hook (callable): Called with name, category, duration in seconds and args.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.__hooks.append(hook)
+
+    @contextmanager
+    def span(self, name, category, **args):
+        """
+        Time a block of code.
+        Args:
+            name (str): Name of the span.
+            category (str): Category of the span, E.G brick or file.
+            args: Extra details to attach to the span.
+        Returns:
+            object: Context manager.
+        Raises:
+            None
+        """
+        start = CLOCK()
+        try:
+            yield
+        finally:
+            self.add_span(name, category, start, CLOCK(), **args)
+
+    def add_span(self, name, category, start, end, **args):
+        """
+        Record a span that was timed elsewhere.
+        Args:
+            name (str): Name of the span.
+            category (str): Category of the span.
+            start (float): Start time from CLOCK.
+            end (float): End time from CLOCK.
+            args: Extra details to attach to the span.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int((start - self.__origin) * 1000000),
+            'dur': int((end - start) * 1000000),
+            'pid': os.getpid(),
+            'tid': threading.current_thread().ident,
+            'args': args
+        }
+        with self.__lock:
+            self.__events.append(event)
+        for hook in self.__hooks:
+            hook(name, category, end - start, args)
+
+    @property
+    def events(self):
+        """
+        Return the recorded spans as Chrome trace events.
+        Args:
+            None
+        Returns:
+            list: Trace events.
+        Raises:
+            None
+        """
+        with self.__lock:
+            return list(self.__events)
+
+    def write_trace(self, path):
+        """
+        Write the recorded spans as a Chrome trace event file, which can be
+        opened with chrome://tracing or Perfetto.
+        Args:
+            path (str): File to write.
+        Returns:
+            None
+        Raises:
+            IOError: Raises IOError if the file can not be written.
+        """
+        with open(path, 'w') as stream:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, stream)
+
+    def summary(self, category='brick', limit=10):
+        """
+        Make a table of the slowest spans of a category.
+        Args:
+            category (str): Category to summarise.
+            limit (int): Number of spans to list.
+        Returns:
+            str: Table of durations and names, slowest first.
+        Raises:
+            None
+        """
+        spans = sorted((event for event in self.events if event['cat'] == category),
+                       key=lambda event: event['dur'], reverse=True)[:limit]
+        lines = ["{0:>12}  {1}".format('seconds', category)]
+        for event in spans:
+            lines.append("{0:>12.3f}  {1}".format(event['dur'] / 1000000.0, event['name']))
+        return '\n'.join(lines)
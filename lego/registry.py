@@ -0,0 +1,143 @@
+"""
+Registry of brick types, importing their modules only when they are used.
+"""
+
+
+import importlib
+import logging
+from collections import OrderedDict
+from lego.common import LegoException
+
+
+# Entry point group third party packages register brick types under, E.G
+# entry_points={'lego.brick_types': ['service=lego_service:ServiceBrick']}
+ENTRY_POINT_GROUP = 'lego.brick_types'
+
+BUILTIN_BRICK_TYPES = OrderedDict([
+    ('package', 'lego.brick_modules.packages:PackageBrick'),
+    ('file', 'lego.brick_modules.files:FileBrick'),
+    ('command', 'lego.brick_modules.command:CommandBrick')
+])
+
+
+def iter_entry_points(group):
+    """
+    List the entry points installed for a group.
+    Args:
+        group (str): Entry point group.
+    Returns:
+        list: Tuples of (name, entry point) with a `load()` method.
+    Raises:
+        None
+    """
+    try:
+        from importlib import metadata  # pylint: disable=import-error
+    except ImportError:
+        metadata = None
+    if metadata is not None:
+        entry_points = metadata.entry_points()
+        if hasattr(entry_points, 'select'):
+            selected = entry_points.select(group=group)
+        else:
+            selected = entry_points.get(group, [])
+        return [(entry_point.name, entry_point) for entry_point in selected]
+    try:
+        import pkg_resources
+    except ImportError:
+        return []
+    return [(entry_point.name, entry_point)
+            for entry_point in pkg_resources.iter_entry_points(group)]
+
+
+class BrickRegistry(object):
+    """
+    Maps brick type names to brick classes.
+    Brick classes are created with `brick_set_name`, `provided_attributes` and
+    `context` keyword arguments.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('lego.registry.BrickRegistry')
+        self.__specs = OrderedDict(BUILTIN_BRICK_TYPES)
+        self.__classes = {}
+        self.__entry_points_loaded = False
+
+    def register(self, brick_type, brick_class):
+        """
+        Register a brick type.
+        Args:
+            brick_type (str): Name used as `type` in brick sets.
+            brick_class (class or str): Brick class, or `module:Class` to import on first use.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.__specs[brick_type] = brick_class
+        self.__classes.pop(brick_type, None)
+
+    def __load_entry_points(self):
+        """
+        Add brick types registered by installed packages, without importing them.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if self.__entry_points_loaded:
+            return
+        self.__entry_points_loaded = True
+        for name, entry_point in iter_entry_points(ENTRY_POINT_GROUP):
+            if name in self.__specs:
+                self.logger.debug("Ignoring entry point `%s`, brick type already registered",
+                                  name)
+                continue
+            self.__specs[name] = entry_point
+
+    @property
+    def brick_types(self):
+        """
+        Return the names of all known brick types.
+        Args:
+            None
+        Returns:
+            list: Brick type names.
+        Raises:
+            None
+        """
+        self.__load_entry_points()
+        return list(self.__specs.keys())
+
+    def get(self, brick_type):
+        """
+        Get the brick class of a brick type, importing it if needed.
+        Args:
+            brick_type (str): Name used as `type` in brick sets.
+        Returns:
+            class: Brick class.
+        Raises:
+            LegoException: Raises LegoException if the brick type is unknown.
+        """
+        if brick_type in self.__classes:
+            return self.__classes[brick_type]
+        if brick_type not in self.__specs:
+            self.__load_entry_points()
+        if brick_type not in self.__specs:
+            raise LegoException("Unknown brick type `{0}`. Only brick types {1} "
+                                "are supported".format(brick_type, self.brick_types))
+
+        spec = self.__specs[brick_type]
+        if hasattr(spec, 'load'):
+            brick_class = spec.load()
+        elif isinstance(spec, str):
+            module_name, class_name = spec.split(':', 1)
+            brick_class = getattr(importlib.import_module(module_name), class_name)
+        else:
+            brick_class = spec
+        self.__classes[brick_type] = brick_class
+        return brick_class
+
+
+REGISTRY = BrickRegistry()
@@ -0,0 +1,230 @@
+"""
+Removal engine for deleting files and large directory trees quickly.
+"""
+
+
+import errno
+import logging
+import os
+import stat
+import threading
+import uuid
+from lego.scheduler import run_keyed
+
+
+# Directories are split into at least this many subtrees per job, so jobs
+# stay busy when subtrees differ in size.
+SUBTREES_PER_JOB = 4
+
+# Directory file descriptors let a whole subtree be removed without resolving
+# its path again for every entry. Not available on Python 2 or every platform.
+DIR_FD_SUPPORTED = (hasattr(os, 'scandir') and
+                    os.scandir in getattr(os, 'supports_fd', set()) and
+                    os.open in getattr(os, 'supports_dir_fd', set()) and
+                    os.unlink in getattr(os, 'supports_dir_fd', set()) and
+                    os.rmdir in getattr(os, 'supports_dir_fd', set()))
+
+O_DIRECTORY = getattr(os, 'O_DIRECTORY', 0)
+O_NOFOLLOW = getattr(os, 'O_NOFOLLOW', 0)
+
+LOGGER = logging.getLogger('lego.remover')
+
+
+def _ignore_missing(func, *args, **kwargs):
+    """
+    Call a removal function, ignoring a path that is already gone.
+    Args:
+        func (callable): os.unlink or os.rmdir.
+    Returns:
+        None
+    Raises:
+        OSError: Raises OSError on any other error.
+    """
+    try:
+        func(*args, **kwargs)
+    except OSError as ex:
+        if ex.errno != errno.ENOENT:
+            raise
+
+
+def _entries(directory):
+    """
+    List the entries of a directory without following symlinks.
+    Args:
+        directory (str): Directory to list.
+    Returns:
+        list: Tuples of (name, whether the entry is a directory).
+    Raises:
+        OSError: Raises OSError.
+    """
+    scandir = getattr(os, 'scandir', None)
+    if scandir is not None:
+        return [(entry.name, entry.is_dir(follow_symlinks=False))
+                for entry in scandir(directory)]
+    entries = []
+    for name in os.listdir(directory):
+        try:
+            entries.append((name, stat.S_ISDIR(os.lstat(os.path.join(directory, name)).st_mode)))
+        except OSError as ex:
+            if ex.errno != errno.ENOENT:
+                raise
+    return entries
+
+
+def _remove_tree_at(parent_fd, name):
+    """
+    Remove a directory and everything in it, relative to its parent directory.
+    Args:
+        parent_fd (int): File descriptor of the parent directory.
+        name (str): Name of the directory in its parent.
+    Returns:
+        None
+    Raises:
+        OSError: Raises OSError.
+    """
+    try:
+        directory_fd = os.open(name, os.O_RDONLY | O_DIRECTORY | O_NOFOLLOW, dir_fd=parent_fd)
+    except OSError as ex:
+        if ex.errno == errno.ENOENT:
+            return
+        raise
+    try:
+        for entry in os.scandir(directory_fd):
+            if entry.is_dir(follow_symlinks=False):
+                _remove_tree_at(directory_fd, entry.name)
+            else:
+                _ignore_missing(os.unlink, entry.name, dir_fd=directory_fd)
+    finally:
+        os.close(directory_fd)
+    _ignore_missing(os.rmdir, name, dir_fd=parent_fd)
+
+
+def _remove_subtree(directory):
+    """
+    Remove a directory and everything in it on the calling thread.
+    Args:
+        directory (str): Directory to remove.
+    Returns:
+        None
+    Raises:
+        OSError: Raises OSError.
+    """
+    if DIR_FD_SUPPORTED:
+        parent, name = os.path.split(directory)
+        parent_fd = os.open(parent or '.', os.O_RDONLY | O_DIRECTORY)
+        try:
+            _remove_tree_at(parent_fd, name)
+        finally:
+            os.close(parent_fd)
+        return
+    try:
+        entries = _entries(directory)
+    except OSError as ex:
+        if ex.errno == errno.ENOENT:
+            return
+        raise
+    for name, is_dir in entries:
+        child = os.path.join(directory, name)
+        if is_dir:
+            _remove_subtree(child)
+        else:
+            _ignore_missing(os.unlink, child)
+    _ignore_missing(os.rmdir, directory)
+
+
+def remove_tree(directory, jobs=1):
+    """
+    Remove a directory and everything in it. With more than one job, the
+    top of the tree is split into subtrees that are removed at the same time.
+    Args:
+        directory (str): Directory to remove. Symlinks in it are not followed.
+        jobs (int): Maximum number of subtrees to remove at the same time.
+    Returns:
+        None
+    Raises:
+        OSError: Raises OSError with the first error met.
+    """
+    # A trailing slash would leave an empty name to remove from the parent.
+    directory = os.path.abspath(directory)
+    split = []
+    subtrees = [directory]
+    while jobs > 1 and subtrees and len(subtrees) < jobs * SUBTREES_PER_JOB:
+        next_subtrees = []
+        for each_directory in subtrees:
+            split.append(each_directory)
+            for name, is_dir in _entries(each_directory):
+                child = os.path.join(each_directory, name)
+                if is_dir:
+                    next_subtrees.append(child)
+                else:
+                    _ignore_missing(os.unlink, child)
+        subtrees = next_subtrees
+
+    if len(subtrees) == 1 or jobs <= 1:
+        for each_directory in subtrees:
+            _remove_subtree(each_directory)
+    else:
+        failures = run_keyed(items=subtrees, key=lambda each_directory: each_directory,
+                             func=_remove_subtree, jobs=jobs)
+        if failures:
+            raise failures[0][1]
+    # Directories that were split are empty now, deepest ones last in the list.
+    for each_directory in reversed(split):
+        _ignore_missing(os.rmdir, each_directory)
+
+
+def _remove_in_background(directory, jobs):
+    """
+    Remove a directory that was renamed aside, logging any failure.
+    Args:
+        directory (str): Directory to remove.
+        jobs (int): Maximum number of subtrees to remove at the same time.
+    Returns:
+        None
+    Raises:
+        None
+    """
+    try:
+        remove_tree(directory, jobs=jobs)
+        LOGGER.info("Removed `%s` in the background", directory)
+    except OSError as ex:
+        LOGGER.error("Failed to remove `%s` in the background with error %s", directory, ex)
+
+
+def remove(path, jobs=1, background=False):
+    """
+    Remove a file, symlink or directory tree. A path that does not exist is
+    left alone. In background mode a directory is renamed aside next to
+    itself, so it is gone at once, and deleted on another thread.
+    Args:
+        path (str): Path to remove. A symlink is removed, not its target.
+        jobs (int): Maximum number of subtrees to remove at the same time.
+        background (bool): Delete directories on a background thread.
+    Returns:
+        bool: True if anything was removed, false if the path did not exist.
+    Raises:
+        OSError: Raises OSError.
+    """
+    # Without a trailing slash, a symlink to a directory is not followed.
+    path = os.path.abspath(path)
+    try:
+        path_stat = os.lstat(path)
+    except OSError as ex:
+        if ex.errno == errno.ENOENT:
+            return False
+        raise
+    if not stat.S_ISDIR(path_stat.st_mode):
+        _ignore_missing(os.unlink, path)
+        return True
+    if not background:
+        remove_tree(path, jobs=jobs)
+        return True
+
+    parent, name = os.path.split(path)
+    aside = os.path.join(parent, ".{0}.lego-removed-{1}".format(name, uuid.uuid4().hex))
+    os.rename(path, aside)
+    # Not a daemon thread, so Lego finishes the removal before it exits.
+    remover = threading.Thread(target=_remove_in_background, args=(aside, jobs),
+                               name="lego-remove-{0}".format(name))
+    remover.start()
+    return True
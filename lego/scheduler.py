@@ -0,0 +1,270 @@
+"""
+Dependency aware scheduler for running bricks.
+"""
+
+
+import heapq
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from lego.common import LegoException
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue  # pylint: disable=import-error
+
+
+class Scheduler(object):
+    """
+    Runs tasks as a directed acyclic graph on a bounded pool of worker threads.
+    Tasks that do not depend on each other may run at the same time. Among the
+    tasks that are ready to run, the one added first always starts first.
+    """
+
+    def __init__(self, jobs=1):
+        self.logger = logging.getLogger('lego.scheduler.Scheduler')
+        self.jobs = max(1, jobs)
+        self.__tasks = OrderedDict()
+        self.__requires = {}
+
+    def add_task(self, task_id, func):
+        """
+        Add a task to the graph.
+        Args:
+            task_id (str): Unique name of the task.
+            func (callable): Function to call, without arguments, to run the task.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException if the task already exists.
+        """
+        if task_id in self.__tasks:
+            raise LegoException("Task `{0}` is defined more than once".format(task_id))
+        self.__tasks[task_id] = func
+        self.__requires[task_id] = set()
+
+    def add_dependency(self, task_id, required_task_id):
+        """
+        Make a task wait for another task to finish successfully.
+        Args:
+            task_id (str): Task that has the dependency.
+            required_task_id (str): Task that must run first.
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException if either task is unknown.
+        """
+        for each_task_id in (task_id, required_task_id):
+            if each_task_id not in self.__tasks:
+                raise LegoException("Unknown task `{0}`".format(each_task_id))
+        self.__requires[task_id].add(required_task_id)
+
+    def __graph(self):
+        """
+        Build the dependents map and in-degree counts, checking for cycles.
+        Args:
+            None
+        Returns:
+            tuple: Dependents map, in-degree map and task positions.
+        Raises:
+            LegoException: Raises LegoException if the graph has a cycle.
+        """
+        position = dict((task_id, index) for index, task_id in enumerate(self.__tasks))
+        dependents = dict((task_id, []) for task_id in self.__tasks)
+        in_degree = {}
+        for task_id, requires in self.__requires.items():
+            in_degree[task_id] = len(requires)
+            for required_task_id in requires:
+                dependents[required_task_id].append(task_id)
+
+        remaining = dict(in_degree)
+        ready = [task_id for task_id, count in remaining.items() if count == 0]
+        visited = 0
+        while ready:
+            task_id = ready.pop()
+            visited += 1
+            for dependent in dependents[task_id]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+        if visited != len(self.__tasks):
+            cyclic = [task_id for task_id, count in remaining.items() if count > 0]
+            raise LegoException("Dependency cycle detected between `{0}`".format(
+                sorted(cyclic, key=position.get)))
+        return dependents, in_degree, position
+
+    def check(self):
+        """
+        Check that the tasks can be run, without running them.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException if the graph has a cycle.
+        """
+        self.__graph()
+
+    def run(self):
+        """
+        Run all tasks.
+        With a single job tasks run one at a time in the calling thread and the
+        first failure is raised straight away. With more jobs, a failure only
+        cancels the tasks that depend on the failed task, and a LegoException
+        summarising all failures is raised once everything else has finished.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        dependents, in_degree, position = self.__graph()
+        ready = [(position[task_id], task_id)
+                 for task_id, count in in_degree.items() if count == 0]
+        heapq.heapify(ready)
+
+        if self.jobs == 1:
+            while ready:
+                _, task_id = heapq.heappop(ready)
+                self.__tasks[task_id]()
+                self.__release(task_id, dependents, in_degree, position, ready)
+            return
+
+        work = queue.Queue()
+        results = queue.Queue()
+        workers = []
+        for _ in range(min(self.jobs, len(self.__tasks))):
+            worker = threading.Thread(target=self.__work, args=(work, results))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        failed = OrderedDict()
+        finished = set()
+        running = 0
+        try:
+            while ready or running:
+                while ready and running < self.jobs:
+                    _, task_id = heapq.heappop(ready)
+                    work.put(task_id)
+                    running += 1
+                task_id, error = results.get()
+                running -= 1
+                finished.add(task_id)
+                if error is None:
+                    self.__release(task_id, dependents, in_degree, position, ready)
+                else:
+                    self.logger.error("Task `%s` failed with error %s", task_id, error)
+                    failed[task_id] = error
+        finally:
+            for _ in workers:
+                work.put(None)
+            for worker in workers:
+                worker.join()
+
+        if failed:
+            skipped = [task_id for task_id in self.__tasks
+                       if task_id not in finished]
+            raise LegoException("Failed tasks: {0}. Skipped because of failed "
+                                "dependencies: {1}".format(
+                                    ', '.join("`{0}` ({1})".format(task_id, error)
+                                              for task_id, error in failed.items()),
+                                    skipped))
+
+    @staticmethod
+    def __release(task_id, dependents, in_degree, position, ready):
+        for dependent in dependents[task_id]:
+            in_degree[dependent] -= 1
+            if in_degree[dependent] == 0:
+                heapq.heappush(ready, (position[dependent], dependent))
+
+    def __work(self, work, results):
+        while True:
+            task_id = work.get()
+            if task_id is None:
+                return
+            try:
+                self.__tasks[task_id]()
+            except Exception:  # pylint: disable=broad-except
+                results.put((task_id, sys.exc_info()[1]))
+            else:
+                results.put((task_id, None))
+
+
+def run_keyed(items, key, func, jobs):
+    """
+    Call a function on every item using a bounded pool of worker threads.
+    Items that share a key are run one after another, in the order they were
+    given. Items are read lazily, so at most `jobs` of them are in flight
+    besides the ones waiting behind a busy key.
+    Args:
+        items (iterable): Items to process.
+        key (callable): Function returning the ordering key of an item.
+        func (callable): Function to call with each item.
+        jobs (int): Maximum number of items to process at the same time, at least 1.
+    Returns:
+        list: Tuples of (item, exception) for every item that failed.
+    Raises:
+        None
+    """
+    jobs = max(1, jobs)
+    work = queue.Queue()
+    results = queue.Queue()
+    workers = []
+    waiting = {}
+    failures = []
+    state = {'in_flight': 0}
+
+    def work_loop():
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            try:
+                func(item)
+            except Exception:  # pylint: disable=broad-except
+                results.put((item, sys.exc_info()[1]))
+            else:
+                results.put((item, None))
+
+    def submit(item):
+        if len(workers) < jobs:
+            worker = threading.Thread(target=work_loop)
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        state['in_flight'] += 1
+        work.put(item)
+
+    def collect():
+        item, error = results.get()
+        state['in_flight'] -= 1
+        if error is not None:
+            failures.append((item, error))
+        item_key = key(item)
+        if waiting[item_key]:
+            submit(waiting[item_key].pop(0))
+        else:
+            del waiting[item_key]
+
+    try:
+        for item in items:
+            item_key = key(item)
+            if item_key in waiting:
+                waiting[item_key].append(item)
+                continue
+            while state['in_flight'] >= jobs:
+                collect()
+            waiting[item_key] = []
+            submit(item)
+        while state['in_flight']:
+            collect()
+    finally:
+        for _ in workers:
+            work.put(None)
+        for worker in workers:
+            worker.join()
+    return failures
@@ -0,0 +1,177 @@
+"""
+Templates for file contents, compiled once per template digest.
+"""
+
+
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from lego.common import LegoException
+from lego.digests import get_checksum
+
+
+# `{{ name }}` is replaced with the value of the variable `name`.
+TEMPLATE_TAG = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}')
+
+
+def compile_template(text):
+    """
+    Compile the text of a template.
+    Args:
+        text (str): Template text.
+    Returns:
+        tuple: Literal text at even indexes and variable names at odd indexes.
+    Raises:
+        None
+    """
+    return tuple(TEMPLATE_TAG.split(text))
+
+
+def template_variables(template):
+    """
+    Get the names of the variables a compiled template uses.
+    Args:
+        template (tuple): Compiled template.
+    Returns:
+        set: Variable names.
+    Raises:
+        None
+    """
+    return set(template[1::2])
+
+
+def render_template(template, variables):
+    """
+    Render a compiled template.
+    Args:
+        template (tuple): Compiled template.
+        variables (dict): Variable name to value.
+    Returns:
+        bytes: Rendered text, UTF-8 encoded.
+    Raises:
+        LegoException: Raises LegoException if a variable is not defined.
+    """
+    pieces = list(template)
+    for index in range(1, len(pieces), 2):
+        try:
+            pieces[index] = u"{0}".format(variables[pieces[index]])
+        except KeyError:
+            raise LegoException("Variable `{0}` is not defined".format(pieces[index]))
+    return u''.join(pieces).encode('utf-8')
+
+
+class TemplateCache(object):
+    """
+    Compiled templates keyed by the digest of the template file. They are
+    kept in memory and, if a cache directory is set, on disk between runs.
+    A read only cache uses the templates on disk without adding to them.
+    """
+
+    def __init__(self, cache_dir=None, digest_index=None, read_only=False):
+        self.logger = logging.getLogger('lego.templates.TemplateCache')
+        self.cache_dir = cache_dir
+        self.read_only = read_only
+        self.__digest_index = digest_index
+        self.__templates = {}
+        self.__lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Get a compiled template, compiling it only if it is not cached.
+        Args:
+            path (str): Template file.
+        Returns:
+            tuple: Compiled template.
+        Raises:
+            LegoException: Raises LegoException.
+            IOError: Raises IOError if the template can not be read.
+        """
+        if self.__digest_index is not None:
+            digest = self.__digest_index.digest(path)
+        else:
+            digest = get_checksum(file_to_hash=path)
+        with self.__lock:
+            template = self.__templates.get(digest)
+        if template is not None:
+            return template
+
+        template = self.__load(digest)
+        if template is None:
+            with io.open(path, 'r', encoding='utf-8') as stream:
+                template = compile_template(stream.read())
+            self.__store(digest, template)
+        with self.__lock:
+            self.__templates[digest] = template
+        return template
+
+    def __cache_file(self, digest):
+        """
+        Get the path a compiled template is kept at on disk.
+        Args:
+            digest (str): Digest of the template file.
+        Returns:
+            str: Path of the cache file, or None if there is no cache directory.
+        Raises:
+            None
+        """
+        if not self.cache_dir:
+            return None
+        return os.path.join(self.cache_dir, "{0}.json".format(digest))
+
+    def __load(self, digest):
+        """
+        Read a compiled template from disk.
+        Args:
+            digest (str): Digest of the template file.
+        Returns:
+            tuple: Compiled template, or None if it is not cached.
+        Raises:
+            None
+        """
+        cache_file = self.__cache_file(digest)
+        if cache_file is None or not os.path.isfile(cache_file):
+            return None
+        try:
+            with io.open(cache_file, 'r', encoding='utf-8') as stream:
+                template = json.load(stream)
+        except (IOError, OSError, ValueError) as ex:
+            self.logger.warning("Ignoring unreadable compiled template `%s` with error %s",
+                                cache_file, ex)
+            return None
+        if not isinstance(template, list) or len(template) % 2 != 1:
+            return None
+        return tuple(template)
+
+    def __store(self, digest, template):
+        """
+        Write a compiled template to disk.
+        Args:
+            digest (str): Digest of the template file.
+            template (tuple): Compiled template.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        cache_file = self.__cache_file(digest)
+        if cache_file is None or self.read_only:
+            return
+        try:
+            if not os.path.isdir(self.cache_dir):
+                try:
+                    os.makedirs(self.cache_dir)
+                except OSError:
+                    # Another thread may have just created it.
+                    if not os.path.isdir(self.cache_dir):
+                        raise
+            handle, temp_file = tempfile.mkstemp(dir=self.cache_dir, prefix='.template-')
+            with os.fdopen(handle, 'w') as stream:
+                stream.write(json.dumps(list(template)))
+            os.rename(temp_file, cache_file)
+        except (IOError, OSError) as ex:
+            self.logger.warning("Could not save compiled template `%s` with error %s",
+                                cache_file, ex)
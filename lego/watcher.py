@@ -0,0 +1,313 @@
+"""
+Watching files for changes, with inotify where available and polling otherwise.
+"""
+
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+
+# inotify(7) event masks.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+# Header of every inotify event: watch descriptor, mask, cookie and name length.
+EVENT_HEADER = struct.Struct('=iIII')
+
+READ_SIZE = 64 * 1024
+
+LOGGER = logging.getLogger('lego.watcher')
+
+
+class InotifyWatcher(object):
+    """
+    Watches files through inotify on their directories, so files that are
+    replaced by a rename are still seen. A directory that does not exist yet,
+    or is removed, is waited for on its nearest existing ancestor and watched
+    again once it is created.
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.__libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.__libc.inotify_init1.argtypes = [ctypes.c_int]
+        self.__libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                                  ctypes.c_uint32]
+        self.__fd = self.__libc.inotify_init1(IN_CLOEXEC)
+        if self.__fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.__directories = {}
+        self.__watched_directories = set()
+        self.__watched = set()
+        # Watched paths that do not exist or whose directory is not watched yet.
+        self.__pending = set()
+
+    def watch(self, paths):
+        """
+        Start watching files or directories.
+        Args:
+            paths (iterable): Paths to watch. They and their directories may not exist yet.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        for path in paths:
+            path = os.path.abspath(path)
+            self.__watched.add(path)
+            self.__pending.add(path)
+        self.__arm()
+
+    def __arm(self):
+        """
+        Watch the directories of the pending paths. Where a directory does not
+        exist, its nearest existing ancestor is watched to see it created.
+        Args:
+            None
+        Returns:
+            set: Paths that exist and are now watched, which may have changed
+                 while they were not.
+        Raises:
+            None
+        """
+        armed = set()
+        for path in list(self.__pending):
+            directory = path if os.path.isdir(path) else os.path.dirname(path)
+            existing = directory
+            while not os.path.isdir(existing):
+                existing = os.path.dirname(existing)
+            if self.__watch_directory(existing) and existing == directory \
+                    and os.path.lexists(path):
+                self.__pending.discard(path)
+                armed.add(path)
+        return armed
+
+    def __watch_directory(self, directory):
+        """
+        Add an inotify watch on a directory, unless it has one.
+        Args:
+            directory (str): Directory to watch.
+        Returns:
+            bool: True if the directory is watched, false otherwise.
+        Raises:
+            None
+        """
+        if directory in self.__watched_directories:
+            return True
+        watch = self.__libc.inotify_add_watch(self.__fd, directory.encode('utf-8'), WATCH_MASK)
+        if watch < 0:
+            LOGGER.debug("Can not watch `%s` with error %s", directory,
+                         os.strerror(ctypes.get_errno()))
+            return False
+        self.__directories[watch] = directory
+        self.__watched_directories.add(directory)
+        return True
+
+    def wait(self, timeout=None):
+        """
+        Wait for changes to the watched paths.
+        Args:
+            timeout (float): Seconds to wait, None to wait until something changes.
+        Returns:
+            set: Changed paths, empty if nothing changed before the timeout.
+        Raises:
+            OSError: Raises OSError.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            try:
+                readable, _, _ = select.select([self.__fd], [], [], remaining)
+            except select.error as ex:  # pylint: disable=no-member
+                if ex.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not readable:
+                return set()
+            changed = self.__read_events()
+            if changed:
+                return changed
+
+    def __read_events(self):
+        """
+        Read the pending inotify events.
+        Args:
+            None
+        Returns:
+            set: Watched paths the events are about.
+        Raises:
+            OSError: Raises OSError.
+        """
+        data = os.read(self.__fd, READ_SIZE)
+        changed = set()
+        rearm = False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            watch, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'replace')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                LOGGER.warning("Too many changes to track one by one, treating every "
+                               "watched path as changed")
+                return set(self.__watched)
+            directory = self.__directories.get(watch)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                # The directory was removed, its paths are watched again once
+                # it is back.
+                self.__watched_directories.discard(self.__directories.pop(watch))
+                self.__pending.update(path for path in self.__watched
+                                      if directory in (path, os.path.dirname(path)))
+                rearm = True
+                continue
+            if mask & (IN_CREATE | IN_MOVED_TO) and self.__pending:
+                rearm = True
+            path = os.path.join(directory, name) if name else directory
+            if path in self.__watched:
+                changed.add(path)
+            if directory in self.__watched:
+                changed.add(directory)
+        if rearm:
+            changed.update(self.__arm())
+        return changed
+
+    def close(self):
+        """
+        Stop watching.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+
+class PollingWatcher(object):
+    """
+    Watches files by comparing their stat every interval.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.__snapshots = {}
+
+    @staticmethod
+    def __snapshot(path):
+        """
+        Describe the state of a path.
+        Args:
+            path (str): Path to describe.
+        Returns:
+            tuple: Inode, size, modification time, mode, owner and group, or
+                   for directories their entries. None if the path does not exist.
+        Raises:
+            None
+        """
+        try:
+            path_stat = os.lstat(path)
+        except OSError:
+            return None
+        snapshot = (path_stat.st_ino, path_stat.st_size, path_stat.st_mtime,
+                    path_stat.st_mode, path_stat.st_uid, path_stat.st_gid)
+        if os.path.isdir(path):
+            try:
+                snapshot += tuple(sorted(os.listdir(path)))
+            except OSError:
+                pass
+        return snapshot
+
+    def watch(self, paths):
+        """
+        Start watching files or directories.
+        Args:
+            paths (iterable): Paths to watch.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        for path in paths:
+            path = os.path.abspath(path)
+            if path not in self.__snapshots:
+                self.__snapshots[path] = self.__snapshot(path)
+
+    def wait(self, timeout=None):
+        """
+        Wait for changes to the watched paths.
+        Args:
+            timeout (float): Seconds to wait, None to wait until something changes.
+        Returns:
+            set: Changed paths, empty if nothing changed before the timeout.
+        Raises:
+            None
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = self.interval if deadline is None else \
+                min(self.interval, max(0, deadline - time.time()))
+            time.sleep(remaining)
+            changed = set()
+            for path, snapshot in self.__snapshots.items():
+                current = self.__snapshot(path)
+                if current != snapshot:
+                    self.__snapshots[path] = current
+                    changed.add(path)
+            if changed or (deadline is not None and time.time() >= deadline):
+                return changed
+
+    def close(self):
+        """
+        Stop watching.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.__snapshots = {}
+
+
+def make_watcher(poll_interval=1.0):
+    """
+    Create an inotify watcher, or a polling watcher where inotify is not available.
+    Args:
+        poll_interval (float): Seconds between checks of the polling watcher.
+    Returns:
+        InotifyWatcher or PollingWatcher: Watcher.
+    Raises:
+        None
+    """
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError) as ex:
+        LOGGER.info("inotify is not available, polling every %s seconds instead. "
+                    "Error: %s", poll_interval, ex)
+        return PollingWatcher(interval=poll_interval)
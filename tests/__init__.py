@@ -0,0 +1,3 @@
+"""
+Tests for the Lego configuration management tool.
+"""
@@ -0,0 +1,286 @@
+"""
+Fake python-apt module for tests. Like python-apt, a cache only sees what a
+commit changed once it is opened again. Package archives are downloaded by
+copying them from a mirror directory into an archive cache directory.
+"""
+
+
+import os
+import shutil
+import threading
+import time
+
+
+class FakePackage(object):
+    """
+    Package in a fake apt cache.
+    """
+
+    def __init__(self, cache, name):
+        self.cache = cache
+        self.name = name
+
+    @property
+    def is_installed(self):
+        """
+        Return whether the package was installed when the cache was opened.
+        Args:
+            None
+        Returns:
+            bool: True if the package is installed, false otherwise.
+        Raises:
+            None
+        """
+        return self.name in self.cache.installed
+
+    def mark_install(self):
+        """
+        Mark the package for install.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            SystemError: Raises SystemError if the package is broken.
+        """
+        if self.name in self.cache.system.broken:
+            raise SystemError("E:Unable to correct problems, you have held broken packages.")
+        self.cache.marks[self.name] = True
+
+    def mark_delete(self, auto_fix=True, purge=False):  # pylint: disable=unused-argument
+        """
+        Mark the package for removal.
+        Args:
+            auto_fix (bool): Ignored.
+            purge (bool): Ignored.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.cache.marks[self.name] = False
+
+
+class FakeConfig(object):
+    """
+    Apt configuration. Keys are not case sensitive, and setting a key ending
+    with `::` appends to a list.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.lists = {}
+
+    def set(self, key, value):
+        """
+        Set a value, or append it to a list.
+        Args:
+            key (str): Configuration key.
+            value (str): Value to set.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        key = key.lower()
+        if key.endswith('::'):
+            self.lists.setdefault(key[:-2], []).append(value)
+        else:
+            self.values[key] = value
+
+    def find(self, key, default=''):
+        """
+        Get a value.
+        Args:
+            key (str): Configuration key.
+            default (str): Value if the key is not set.
+        Returns:
+            str: Value of the key.
+        Raises:
+            None
+        """
+        return self.values.get(key.lower(), default)
+
+    def value_list(self, key):
+        """
+        Get the values of a list.
+        Args:
+            key (str): Configuration key.
+        Returns:
+            list: Values of the list.
+        Raises:
+            None
+        """
+        return list(self.lists.get(key.lower(), []))
+
+
+class FakeAptPkg(object):  # pylint: disable=too-few-public-methods
+    """
+    Stand in for the apt_pkg module, holding the apt configuration.
+    """
+
+    def __init__(self):
+        self.config = FakeConfig()
+
+
+class FakeCache(object):
+    """
+    Apt cache of a FakeApt system.
+    """
+
+    def __init__(self, system, rootdir=None):
+        self.system = system
+        self.rootdir = rootdir
+        if rootdir and system.apt_pkg is not None:
+            # As python-apt does, which runs the dpkg of the root.
+            system.apt_pkg.config.set('Dir', rootdir)
+            system.apt_pkg.config.set('Dir::bin::dpkg', os.path.join(rootdir, 'usr/bin/dpkg'))
+        self.marks = {}
+        self.installed = set()
+        self.open()
+
+    def update(self):
+        """
+        Count a package list update.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.system.lock:
+            self.system.updates += 1
+
+    def open(self, progress=None):  # pylint: disable=unused-argument
+        """
+        Read the installed packages of the system and drop all marks.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.system.lock:
+            self.installed = set(self.system.installed)
+        self.marks = {}
+
+    def clear(self):
+        """
+        Drop all marks.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.marks = {}
+
+    def __getitem__(self, name):
+        if name not in self.system.available:
+            raise KeyError(name)
+        return FakePackage(self, name)
+
+    def fetch_archives(self):
+        """
+        Download the archives of the packages marked for install.
+        Args:
+            None
+        Returns:
+            int: Number of packages marked for install.
+        Raises:
+            IOError: Raises IOError if an archive is not on the mirror.
+        """
+        if self.system.fetch_error is not None:
+            raise self.system.fetch_error
+        names = sorted(name for name, install in self.marks.items() if install)
+        for name in names:
+            self.system.download(name)
+        return len(names)
+
+    def commit(self):
+        """
+        Download the archives that are missing and apply the marked packages
+        to the system, leaving this cache as it is.
+        Args:
+            None
+        Returns:
+            bool: Always True.
+        Raises:
+            IOError: Raises IOError if an archive is not on the mirror.
+        """
+        for name in sorted(name for name, install in self.marks.items() if install):
+            self.system.download(name)
+        with self.system.lock:
+            self.system.events.append(('commit', dict(self.marks)))
+            self.system.commits.append(dict(self.marks))
+            for name, install in self.marks.items():
+                if install:
+                    self.system.installed.add(name)
+                else:
+                    self.system.installed.discard(name)
+        return True
+
+
+class FakeApt(object):
+    """
+    Stand in for the apt module, passed to AptCacheManager as `apt_module`.
+    """
+
+    def __init__(self, available, installed=(),  # pylint: disable=too-many-arguments
+                 mirror=None, archives=None, fetch_latency=0.0):
+        self.available = set(available)
+        self.installed = set(installed)
+        self.mirror = mirror
+        self.archives = archives
+        self.fetch_latency = fetch_latency
+        # Raised by fetch_archives, E.G to make a prefetch fail.
+        self.fetch_error = None
+        # Packages that can not be marked for install, as python-apt raises
+        # SystemError for a package with broken dependencies.
+        self.broken = set()
+        self.updates = 0
+        self.commits = []
+        # Downloads, with the thread that made them, and commits, in the order
+        # they happened.
+        self.events = []
+        self.lock = threading.Lock()
+        self.apt_pkg = FakeAptPkg()
+        # AptCacheManager opens caches with `apt_module.cache.Cache`.
+        self.cache = self
+
+    def Cache(self, rootdir=None, progress=None):  # pylint: disable=invalid-name,unused-argument
+        """
+        Open a cache of this system.
+        Args:
+            rootdir (str): Root the cache is for.
+            progress: Ignored.
+        Returns:
+            FakeCache: Opened cache.
+        Raises:
+            None
+        """
+        return FakeCache(self, rootdir=rootdir)
+
+    def download(self, name):
+        """
+        Copy the archive of a package from the mirror into the archive cache,
+        unless it is there already.
+        Args:
+            name (str): Package name.
+        Returns:
+            None
+        Raises:
+            IOError: Raises IOError if the archive is not on the mirror.
+        """
+        if self.mirror is None:
+            return
+        target = os.path.join(self.archives, "{0}.deb".format(name))
+        if os.path.exists(target):
+            return
+        time.sleep(self.fetch_latency)
+        shutil.copy(os.path.join(self.mirror, "{0}.deb".format(name)), target)
+        with self.lock:
+            self.events.append(('download', name, threading.current_thread().name))
@@ -0,0 +1,191 @@
+"""
+Tests for the agent that applies a builder file again when its inputs change.
+"""
+
+
+import grp
+import os
+import pwd
+import shutil
+import sys
+import tempfile
+import unittest
+from lego.agent import Agent
+from lego.context import BuildContext
+from tests.fake_apt import FakeApt
+
+
+BRICKS = '''---
+
+"Install Packages":
+  type: package
+  provider: apt
+  state: present
+  packages:
+    - vim
+    - curl
+'''
+
+TEMPLATE_BRICKS = '''---
+
+"Configure App":
+  type: file
+  state: present
+  owner: {owner}
+  group: {group}
+  mode: 0644
+  files:
+    - template: app.conf
+      destination: /etc/app.conf
+'''
+
+
+class RecordingWatcher(object):
+    """
+    Watcher that only records what it is asked to watch.
+    """
+
+    def __init__(self):
+        self.watched = set()
+
+    def watch(self, paths):
+        """
+        Record paths to watch.
+        Args:
+            paths (iterable): Paths to watch.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.watched.update(paths)
+
+    def wait(self, timeout=None):  # pylint: disable=unused-argument,no-self-use
+        """
+        Report that nothing changed.
+        Args:
+            timeout (float): Ignored.
+        Returns:
+            set: Always empty.
+        Raises:
+            None
+        """
+        return set()
+
+    def close(self):
+        """
+        Stop watching.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            None
+        """
+        self.watched = set()
+
+
+class AgentTest(unittest.TestCase):
+    """
+    Tests for Agent against a root with a fake apt module.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.temp_dir, 'root')
+        os.makedirs(os.path.join(self.root, 'var', 'lib', 'dpkg'))
+        self.status_file = os.path.join(self.root, 'var', 'lib', 'dpkg', 'status')
+        self.write_status(['vim'])
+        self.builder_file = os.path.join(self.temp_dir, 'server.yaml')
+        self.bricks_file = os.path.join(self.temp_dir, 'brick_sets', 'base', 'bricks.yaml')
+        os.makedirs(os.path.dirname(self.bricks_file))
+        with open(self.builder_file, 'w') as stream:
+            stream.write("---\n\nbrick_sets:\n  - base\n")
+        self.apt = FakeApt(available=['vim', 'curl'], installed=['vim'])
+        self.saved_apt = sys.modules.get('apt')
+        sys.modules['apt'] = self.apt
+        self.watcher = RecordingWatcher()
+        self.agent = Agent(builder_file=self.builder_file, use_cache=False,
+                           context=BuildContext(state_dir=None, root=self.root),
+                           watcher=self.watcher)
+
+    def tearDown(self):
+        if self.saved_apt is None:
+            del sys.modules['apt']
+        else:
+            sys.modules['apt'] = self.saved_apt
+        shutil.rmtree(self.temp_dir)
+
+    def write_status(self, installed):
+        """
+        Write the dpkg status file of the root.
+        Args:
+            installed (list): Names of the installed packages.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with open(self.status_file, 'w') as stream:
+            for package in installed:
+                stream.write("Package: {0}\nStatus: install ok installed\n\n".format(package))
+
+    def test_package_removed_by_hand_is_installed_again(self):
+        with open(self.bricks_file, 'w') as stream:
+            stream.write(BRICKS)
+        self.agent.apply()
+        self.assertEqual(self.apt.commits, [{'curl': True}])
+        self.assertIn(self.status_file, self.watcher.watched)
+
+        # dpkg removes vim, the apt cache kept by the agent still has it installed.
+        self.apt.installed.discard('vim')
+        self.write_status(['curl'])
+        self.agent.apply(set([self.status_file]))
+        self.assertEqual(self.apt.commits, [{'curl': True}, {'vim': True}])
+
+    def test_builder_file_is_watched_when_the_first_load_fails(self):
+        with open(self.bricks_file, 'w') as stream:
+            stream.write("---\n\n\"Broken\":\n  type: unknown\n")
+        self.agent.apply()
+        self.assertEqual(self.watcher.watched, set([self.builder_file, self.bricks_file]))
+        self.assertEqual(self.apt.commits, [])
+
+        with open(self.bricks_file, 'w') as stream:
+            stream.write(BRICKS)
+        self.agent.apply(set([self.bricks_file]))
+        self.assertEqual(self.apt.commits, [{'curl': True}])
+
+    def test_failed_reload_keeps_the_variables_of_the_last_good_build(self):
+        os.makedirs(os.path.join(self.root, 'etc'))
+        templates_dir = os.path.join(os.path.dirname(self.bricks_file), 'templates')
+        os.makedirs(templates_dir)
+        with open(os.path.join(templates_dir, 'app.conf'), 'w') as stream:
+            stream.write('listen {{ port }}\n')
+        with open(self.bricks_file, 'w') as stream:
+            stream.write(TEMPLATE_BRICKS.format(owner=pwd.getpwuid(os.getuid()).pw_name,
+                                                group=grp.getgrgid(os.getgid()).gr_name))
+        with open(self.builder_file, 'w') as stream:
+            stream.write("---\n\nvariables:\n  port: 8080\n\nbrick_sets:\n  - base\n")
+        self.agent.apply()
+        destination = os.path.join(self.root, 'etc', 'app.conf')
+        with open(destination, 'r') as stream:
+            self.assertEqual(stream.read(), 'listen 8080\n')
+
+        # The new variables come with a brick set that does not exist.
+        with open(self.builder_file, 'w') as stream:
+            stream.write("---\n\nvariables:\n  port: 9090\n\nbrick_sets:\n  - base\n"
+                         "  - missing\n")
+        os.remove(destination)
+        self.agent.apply(set([self.builder_file]))
+        with open(destination, 'r') as stream:
+            self.assertEqual(stream.read(), 'listen 8080\n')
+
+    def test_unreadable_builder_file_is_watched(self):
+        with open(self.builder_file, 'w') as stream:
+            stream.write("---\n\nnot_brick_sets: []\n")
+        self.agent.apply()
+        self.assertEqual(self.watcher.watched, set([self.builder_file]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,533 @@
+"""
+Tests for the builder.
+"""
+
+
+import grp
+import json
+import os
+import pwd
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from lego.brick import Brick
+from lego.builder import Builder
+from lego.common import LegoException
+from lego.context import BuildContext
+from lego.profiler import Profiler
+from lego.registry import BrickRegistry
+
+
+BRICKS = '''---
+
+"Configure App":
+  type: file
+  state: present
+  owner: {owner}
+  group: {group}
+  mode: 0640
+  files:
+    - source: app.conf
+      destination: /etc/app.conf
+'''
+
+CUSTOM_BRICK = '''
+"Custom":
+  type: custom
+'''
+
+OPT_BRICK = '''
+"Configure Opt":
+  type: file
+  state: present
+  owner: {owner}
+  group: {group}
+  mode: 0640
+  files:
+    - source: app.conf
+      destination: /opt/app.conf
+'''
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CustomBrick(Brick):  # pylint: disable=too-few-public-methods
+    """
+    Brick type that does not implement `check`.
+    """
+
+    def __init__(self, brick_set_name, provided_attributes, context=None):
+        self.brick_set_name = brick_set_name
+        super(CustomBrick, self).__init__(name='custom_brick',
+                                          provided_attributes=provided_attributes,
+                                          supported_attributes=['type'],
+                                          compulsory_attributes=['type'],
+                                          context=context)
+
+
+class BuilderTestCase(unittest.TestCase):
+    """
+    Writes a builder file with a single `app` brick set to a temporary directory.
+    """
+
+    bricks = BRICKS
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        brick_set_dir = os.path.join(self.temp_dir, 'brick_sets', 'app')
+        os.makedirs(os.path.join(brick_set_dir, 'files'))
+        with open(os.path.join(brick_set_dir, 'files', 'app.conf'), 'w') as stream:
+            stream.write('listen 8080\n')
+        # Old enough for its digest to be kept in the digest index.
+        os.utime(os.path.join(brick_set_dir, 'files', 'app.conf'), (1, 1))
+        with open(os.path.join(brick_set_dir, 'bricks.yaml'), 'w') as stream:
+            stream.write(self.bricks.format(owner=pwd.getpwuid(os.getuid()).pw_name,
+                                            group=grp.getgrgid(os.getgid()).gr_name))
+        self.builder_file = os.path.join(self.temp_dir, 'server.yaml')
+        with open(self.builder_file, 'w') as stream:
+            stream.write("---\n\nbrick_sets:\n  - app\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_root(self, name, directories=('etc',)):
+        """
+        Make a root directory to build into.
+        Args:
+            name (str): Name of the root.
+            directories (tuple): Directories to create in the root.
+        Returns:
+            str: Path of the root.
+        Raises:
+            None
+        """
+        root = os.path.join(self.temp_dir, name)
+        os.makedirs(root)
+        for directory in directories:
+            os.makedirs(os.path.join(root, directory))
+        return root
+
+
+class BuildRootsTest(BuilderTestCase):
+    """
+    Tests for applying one builder file to several roots.
+    """
+
+    def test_destinations_and_state_are_per_root(self):
+        roots = [self.make_root('first'), self.make_root('second')]
+        builder = Builder(builder_file=self.builder_file, use_cache=False,
+                          context=BuildContext())
+        results = builder.build_roots(roots, processes=2)
+        self.assertEqual([result.root for result in results], roots)
+        self.assertEqual([result.succeeded for result in results], [True, True])
+        for root in roots:
+            with open(os.path.join(root, 'etc', 'app.conf'), 'r') as stream:
+                self.assertEqual(stream.read(), 'listen 8080\n')
+            self.assertEqual(os.stat(os.path.join(root, 'etc', 'app.conf')).st_mode & 0o777,
+                             0o640)
+            state_dir = os.path.join(root, 'var', 'lib', 'lego')
+            self.assertTrue(os.path.isfile(os.path.join(state_dir, 'journal.json')))
+            self.assertTrue(os.path.isfile(os.path.join(state_dir, 'digests.json')))
+
+    def test_failed_root_does_not_stop_the_others(self):
+        roots = [self.make_root('broken', directories=()), self.make_root('good'),
+                 os.path.join(self.temp_dir, 'missing')]
+        builder = Builder(builder_file=self.builder_file, use_cache=False,
+                          context=BuildContext())
+        results = builder.build_roots(roots, processes=2)
+        self.assertEqual([result.succeeded for result in results], [False, True, False])
+        self.assertIsNotNone(results[0].error)
+        self.assertIn('is not a directory', results[2].error)
+        self.assertTrue(os.path.isfile(os.path.join(roots[1], 'etc', 'app.conf')))
+
+    def test_single_root_is_built_in_process(self):
+        root = self.make_root('only')
+        context = BuildContext()
+        results = Builder(builder_file=self.builder_file, use_cache=False,
+                          context=context).build_roots([root])
+        self.assertTrue(results[0].succeeded)
+        self.assertEqual(context.root, root)
+        self.assertTrue(os.path.isfile(os.path.join(root, 'etc', 'app.conf')))
+
+
+class JournalTest(BuilderTestCase):
+    """
+    Tests for skipping bricks with the journal.
+    """
+
+    bricks = BRICKS + OPT_BRICK
+
+    def setUp(self):
+        super(JournalTest, self).setUp()
+        self.root = self.make_root('root', directories=('etc', 'opt'))
+
+    def build(self, **arguments):
+        """
+        Build the root, capturing what the builder logs.
+        Args:
+            arguments (dict): Arguments of `Builder.build`.
+        Returns:
+            list: Messages logged by the builder.
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        builder = Builder(builder_file=self.builder_file, use_cache=False,
+                          context=BuildContext(root=self.root))
+        with self.assertLogs('lego.builder.Builder', level='INFO') as logs:
+            builder.build(**arguments)
+        return [record.getMessage() for record in logs.records]
+
+    def test_unchanged_bricks_are_skipped(self):
+        self.assertNotIn('Skipping brick `app/Configure App`, nothing changed since its last run',
+                         self.build())
+        self.assertIn('Skipping brick `app/Configure App`, nothing changed since its last run',
+                      self.build())
+
+    def test_changed_destination_runs_again(self):
+        self.build()
+        destination = os.path.join(self.root, 'etc', 'app.conf')
+        os.chmod(destination, 0o600)
+        messages = self.build()
+        self.assertNotIn('Skipping brick `app/Configure App`, nothing changed since its last run',
+                         messages)
+        self.assertIn('Skipping brick `app/Configure Opt`, nothing changed since its last run',
+                      messages)
+        self.assertEqual(os.stat(destination).st_mode & 0o777, 0o640)
+
+    def test_force_runs_every_brick(self):
+        self.build()
+        self.assertEqual([message for message in self.build(force=True)
+                          if message.startswith('Skipping')], [])
+
+    def test_resume_skips_bricks_completed_in_the_failed_build(self):
+        os.rmdir(os.path.join(self.root, 'opt'))
+        with self.assertRaises(OSError):
+            self.build()
+        os.chmod(os.path.join(self.root, 'etc', 'app.conf'), 0o600)
+        os.makedirs(os.path.join(self.root, 'opt'))
+        self.assertIn('Skipping brick `app/Configure App`, it completed in the failed build '
+                      'being resumed', self.build(resume=True))
+        self.assertTrue(os.path.isfile(os.path.join(self.root, 'opt', 'app.conf')))
+        # The resumed build succeeded, so there is nothing left to resume.
+        self.assertNotIn('Skipping brick `app/Configure App`, it completed in the failed build '
+                         'being resumed', self.build(resume=True))
+
+
+class CompileTest(BuilderTestCase):
+    """
+    Tests for compiling a builder file into an execution plan.
+    """
+
+    def write_bricks(self, bricks):
+        """
+        Replace the bricks of the brick set.
+        Args:
+            bricks (str): Bricks appended to the `Configure App` brick.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with open(os.path.join(self.temp_dir, 'brick_sets', 'app', 'bricks.yaml'), 'w') as stream:
+            stream.write(BRICKS.format(owner=pwd.getpwuid(os.getuid()).pw_name,
+                                       group=grp.getgrgid(os.getgid()).gr_name) + bricks)
+
+    def compile(self, bricks):
+        """
+        Replace the bricks of the brick set and compile the builder file.
+        Args:
+            bricks (str): Bricks appended to the `Configure App` brick.
+        Returns:
+            ExecutionPlan: Compiled plan.
+        Raises:
+            LegoException: Raises LegoException if any brick is invalid.
+        """
+        self.write_bricks(bricks)
+        return Builder(builder_file=self.builder_file, use_cache=False,
+                       context=BuildContext()).compile()
+
+    def test_requires_and_before(self):
+        plan = self.compile('''
+"Restart App":
+  type: command
+  commands: ['true']
+  requires: ['Configure App']
+  before: ['Reload App']
+
+"Reload App":
+  type: command
+  commands: ['true']
+''')
+        self.assertEqual([(planned_brick.brick_id, sorted(planned_brick.requires))
+                          for planned_brick in plan.bricks],
+                         [('app/Configure App', []),
+                          ('app/Restart App', ['app/Configure App']),
+                          ('app/Reload App', ['app/Restart App'])])
+        self.assertEqual(plan.brick_sets, (('app', ('app/Configure App', 'app/Restart App',
+                                                    'app/Reload App')),))
+
+    def test_invalid_bricks_are_reported_together(self):
+        with self.assertRaises(LegoException) as raised:
+            self.compile('''
+"No Commands":
+  type: command
+
+"Unknown Type":
+  type: service
+''')
+        message = str(raised.exception)
+        self.assertIn('`app/No Commands`', message)
+        self.assertIn('`app/Unknown Type`: Unknown brick type `service`', message)
+
+    def test_nothing_runs_when_invalid(self):
+        self.write_bricks('''
+"Unknown Type":
+  type: service
+''')
+        root = self.make_root('root')
+        with self.assertRaises(LegoException):
+            Builder(builder_file=self.builder_file, use_cache=False,
+                    context=BuildContext(root=root)).build()
+        self.assertEqual(os.listdir(os.path.join(root, 'etc')), [])
+
+    def test_unknown_reference(self):
+        with self.assertRaises(LegoException) as raised:
+            self.compile('''
+"Restart App":
+  type: command
+  commands: ['true']
+  requires: ['db/Configure DB']
+''')
+        self.assertIn('Unknown brick or brick set `db/Configure DB` referenced from `app`',
+                      str(raised.exception))
+
+    def test_cycle(self):
+        with self.assertRaises(LegoException) as raised:
+            self.compile('''
+"Restart App":
+  type: command
+  commands: ['true']
+  requires: ['Reload App']
+
+"Reload App":
+  type: command
+  commands: ['true']
+  requires: ['Restart App']
+''')
+        self.assertIn('Dependency cycle detected', str(raised.exception))
+
+
+class ProfileTest(BuilderTestCase):
+    """
+    Tests for profiling a build.
+    """
+
+    def test_bricks_brick_sets_and_files_are_timed(self):
+        root = self.make_root('root')
+        profiler = Profiler()
+        Builder(builder_file=self.builder_file, use_cache=False,
+                context=BuildContext(root=root, profiler=profiler)).build()
+        spans = [(event['cat'], event['name']) for event in profiler.events]
+        self.assertIn(('brick', 'app/Configure App'), spans)
+        self.assertIn(('brick_set', 'app'), spans)
+        self.assertIn(('file', os.path.join(root, 'etc', 'app.conf')), spans)
+
+
+class StreamTest(BuilderTestCase):
+    """
+    Tests for streaming brick sets one at a time.
+    """
+
+    def setUp(self):
+        super(StreamTest, self).setUp()
+        self.root = self.make_root('root')
+        with open(self.builder_file, 'w') as stream:
+            stream.write("---\n\nbrick_sets:\n  - app\n  - db\n")
+        os.makedirs(os.path.join(self.temp_dir, 'brick_sets', 'db'))
+
+    def write_db_bricks(self, bricks):
+        """
+        Write the bricks of the `db` brick set, listed after `app`.
+        Args:
+            bricks (str): Bricks of the brick set.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with open(os.path.join(self.temp_dir, 'brick_sets', 'db', 'bricks.yaml'), 'w') as stream:
+            stream.write(bricks)
+
+    def stream(self):
+        """
+        Stream the brick sets into the root.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        Builder(builder_file=self.builder_file, use_cache=False, lazy=True,
+                context=BuildContext(root=self.root)).stream()
+
+    def test_brick_sets_run_in_order(self):
+        self.write_db_bricks('''
+"Check App":
+  type: command
+  commands: ['test -f {0}']
+  requires: ['app/Configure App']
+'''.format(os.path.join(self.root, 'etc', 'app.conf')))
+        self.stream()
+
+    def test_later_brick_set_is_loaded_after_earlier_ones_ran(self):
+        self.write_db_bricks('''
+"Broken":
+  type: service
+''')
+        with self.assertRaises(LegoException) as raised:
+            self.stream()
+        self.assertIn('Unknown brick type `service`', str(raised.exception))
+        self.assertTrue(os.path.isfile(os.path.join(self.root, 'etc', 'app.conf')))
+
+    def test_requiring_a_later_brick_set(self):
+        with open(os.path.join(self.temp_dir, 'brick_sets', 'app', 'bricks.yaml'), 'a') as stream:
+            stream.write("  requires: ['db']\n")
+        self.write_db_bricks('''
+"Check App":
+  type: command
+  commands: ['true']
+''')
+        with self.assertRaises(LegoException) as raised:
+            self.stream()
+        self.assertIn('`db` is listed later, so it can not be required when brick sets are '
+                      'streamed', str(raised.exception))
+        self.assertEqual(os.listdir(os.path.join(self.root, 'etc')), [])
+
+    def test_coming_before_a_brick_set_that_ran(self):
+        self.write_db_bricks('''
+"Check App":
+  type: command
+  commands: ['true']
+  before: ['app']
+''')
+        with self.assertRaises(LegoException) as raised:
+            self.stream()
+        self.assertIn('`app` already ran, so it can not come after this when brick sets are '
+                      'streamed', str(raised.exception))
+
+
+class CheckTest(BuilderTestCase):
+    """
+    Tests for checking a root for drift.
+    """
+
+    def setUp(self):
+        super(CheckTest, self).setUp()
+        self.root = self.make_root('root')
+        self.state_dir = os.path.join(self.root, 'var', 'lib', 'lego')
+
+    def check(self):
+        """
+        Check the root.
+        Args:
+            None
+        Returns:
+            dict: Report of the check.
+        Raises:
+            LegoException: Raises LegoException if the build is invalid.
+        """
+        context = BuildContext(root=self.root, read_only=True)
+        return Builder(builder_file=self.builder_file, use_cache=False,
+                       context=context).check(jobs=2)
+
+    def run_check(self, builder_file=None):
+        """
+        Run `lego check` against the root.
+        Args:
+            builder_file (str): Builder file to check, the test one by default.
+        Returns:
+            tuple: Exit code and the standard output.
+        Raises:
+            None
+        """
+        environment = dict(os.environ, PYTHONPATH=REPOSITORY_DIR)
+        process = subprocess.Popen(
+            [sys.executable, '-c', 'from lego.executable import main; main()', 'check',
+             builder_file or self.builder_file, '--root', self.root, '--no-cache'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environment)
+        output, _ = process.communicate()
+        return process.returncode, output.decode('utf-8')
+
+    def build(self):
+        """
+        Build the root.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            LegoException: Raises LegoException.
+        """
+        Builder(builder_file=self.builder_file, use_cache=False,
+                context=BuildContext(root=self.root)).build()
+
+    def test_report_shape(self):
+        self.build()
+        report = self.check()
+        self.assertEqual(list(report), ['builder_file', 'root', 'in_sync', 'drift',
+                                        'unchecked', 'errors'])
+        self.assertEqual(report['root'], self.root)
+        self.assertTrue(report['in_sync'])
+        self.assertEqual((report['drift'], report['unchecked'], report['errors']),
+                         ({}, [], {}))
+
+    def test_drift_is_reported(self):
+        self.build()
+        destination = os.path.join(self.root, 'etc', 'app.conf')
+        os.chmod(destination, 0o600)
+        report = self.check()
+        self.assertFalse(report['in_sync'])
+        self.assertEqual(report['drift'], {'app/Configure App': [
+            {'target': destination, 'attribute': 'mode', 'expected': '0640',
+             'actual': '0600'}]})
+
+    def test_nothing_is_written(self):
+        report = self.check()
+        self.assertEqual(report['drift']['app/Configure App'][0]['attribute'], 'exists')
+        self.assertFalse(os.path.exists(self.state_dir))
+        self.assertEqual(os.listdir(os.path.join(self.root, 'etc')), [])
+
+    def test_exit_codes(self):
+        return_code, output = self.run_check()
+        self.assertEqual(return_code, 1)
+        self.assertFalse(json.loads(output)['in_sync'])
+        self.build()
+        return_code, output = self.run_check()
+        self.assertEqual(return_code, 0)
+        self.assertTrue(json.loads(output)['in_sync'])
+        return_code, _ = self.run_check(os.path.join(self.temp_dir, 'missing.yaml'))
+        self.assertEqual(return_code, 2)
+
+
+class CheckUncheckedTest(BuilderTestCase):
+    """
+    Tests for checking bricks whose type can not be checked.
+    """
+
+    bricks = BRICKS + CUSTOM_BRICK
+
+    def test_custom_bricks_are_unchecked(self):
+        registry = BrickRegistry()
+        registry.register('custom', CustomBrick)
+        root = self.make_root('root')
+        report = Builder(builder_file=self.builder_file, use_cache=False, registry=registry,
+                         context=BuildContext(root=root, read_only=True)).check()
+        self.assertEqual(report['unchecked'], ['app/Custom'])
+        self.assertEqual(list(report['drift']), ['app/Configure App'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Tests for command bricks and the engine that runs their commands.
+"""
+
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from lego.brick_modules.command import CommandBrick, run_command
+from lego.common import LegoException
+from lego.context import BuildContext
+
+
+class RunCommandTest(unittest.TestCase):
+    """
+    Tests for run_command.
+    """
+
+    def test_captures_output_and_exit_code(self):
+        self.assertEqual(run_command('echo out; echo err >&2; exit 3', capture=True),
+                         (3, 'out\nerr\n'))
+
+    def test_timeout_kills_the_command_and_its_children(self):
+        start = time.time()
+        with self.assertRaises(LegoException):
+            run_command('sleep 30 & sleep 30', timeout=0.2, capture=True)
+        self.assertLess(time.time() - start, 10)
+
+
+class CommandBrickTest(unittest.TestCase):
+    """
+    Tests for CommandBrick.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.context = BuildContext(state_dir=None)
+        self.log = os.path.join(self.temp_dir, 'log')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_brick(self, commands, **attributes):
+        """
+        Make a command brick.
+        Args:
+            commands (list): Command entries.
+            attributes (dict): Other attributes of the brick.
+        Returns:
+            CommandBrick: Command brick.
+        Raises:
+            LegoException: Raises LegoException if the brick is invalid.
+        """
+        attributes.update(type='command', commands=commands)
+        return CommandBrick(attributes, context=self.context)
+
+    def ran(self):
+        """
+        Read which commands appended to the log.
+        Args:
+            None
+        Returns:
+            list: Lines of the log.
+        Raises:
+            None
+        """
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log, 'r') as stream:
+            return stream.read().split()
+
+    def test_invalid_timeouts(self):
+        for timeout in ('abc', -1, 0, True):
+            with self.assertRaises(LegoException):
+                self.make_brick(['true'], timeout=timeout)
+            with self.assertRaises(LegoException):
+                self.make_brick([{'command': 'true', 'timeout': timeout}])
+
+    def test_valid_timeouts(self):
+        self.make_brick(['true'], timeout=1.5)
+        self.make_brick([{'command': 'true', 'timeout': 10}])
+
+    def test_invalid_parallel_and_attributes(self):
+        with self.assertRaises(LegoException):
+            self.make_brick(['true'], parallel=-1)
+        with self.assertRaises(LegoException):
+            self.make_brick([{'command': 'true', 'retries': 3}])
+        with self.assertRaises(LegoException):
+            self.make_brick([{'creates': '/tmp'}])
+
+    def test_guards(self):
+        self.make_brick([
+            {'command': "echo creates >> {0}".format(self.log), 'creates': self.temp_dir},
+            {'command': "echo onlyif >> {0}".format(self.log), 'onlyif': 'false'},
+            {'command': "echo unless >> {0}".format(self.log), 'unless': 'true'},
+            {'command': "echo runs >> {0}".format(self.log), 'onlyif': 'true',
+             'unless': 'false'}
+        ]).run_brick()
+        self.assertEqual(self.ran(), ['runs'])
+
+    def test_check_reports_commands_that_would_run(self):
+        drift = self.make_brick([
+            'true',
+            {'command': 'first', 'creates': self.temp_dir},
+            {'command': 'second', 'creates': os.path.join(self.temp_dir, 'missing')}
+        ]).check()
+        self.assertEqual([difference['target'] for difference in drift], ['second'])
+
+    def test_brick_timeout_applies_to_every_command(self):
+        brick = self.make_brick(['sleep 30'], timeout=0.2)
+        with self.assertRaises(LegoException):
+            brick.run_brick()
+
+    def test_first_failure_stops_serial_commands(self):
+        with self.assertRaises(LegoException):
+            self.make_brick(['false', "echo after >> {0}".format(self.log)]).run_brick()
+        self.assertEqual(self.ran(), [])
+
+    def test_parallel_failures_are_reported_together(self):
+        with self.assertRaises(LegoException) as raised:
+            self.make_brick(['exit 1', 'exit 2', "echo ok >> {0}".format(self.log)],
+                            parallel=3).run_brick()
+        self.assertIn('2 command(s) failed', str(raised.exception))
+        self.assertEqual(self.ran(), ['ok'])
+
+
+if __name__ == '__main__':
+    unittest.main()
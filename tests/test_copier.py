@@ -0,0 +1,288 @@
+"""
+Tests for the copy engine that materializes files.
+"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+from lego import copier
+from lego.brick_modules.files import create_file
+
+
+class CopierTestCase(unittest.TestCase):
+    """
+    Makes a temporary directory with a source file.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source = self.path('source')
+        self.destination = self.path('destination')
+        self.write(self.source, b'source\n' * 1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def path(self, name):
+        """
+        Get the path of a file in the temporary directory.
+        Args:
+            name (str): File name.
+        Returns:
+            str: Path of the file.
+        Raises:
+            None
+        """
+        return os.path.join(self.temp_dir, name)
+
+    @staticmethod
+    def write(path, data):
+        """
+        Write a file.
+        Args:
+            path (str): File to write.
+            data (bytes): Contents of the file.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with open(path, 'wb') as stream:
+            stream.write(data)
+
+    @staticmethod
+    def read(path):
+        """
+        Read a file.
+        Args:
+            path (str): File to read.
+        Returns:
+            bytes: Contents of the file.
+        Raises:
+            None
+        """
+        with open(path, 'rb') as stream:
+            return stream.read()
+
+
+class CopyDataTest(CopierTestCase):
+    """
+    Tests for copy_data and its fallbacks.
+    """
+
+    def copy(self):
+        """
+        Copy the source into an empty destination with copy_data.
+        Args:
+            None
+        Returns:
+            str: Name of the method that did the copy.
+        Raises:
+            None
+        """
+        source_fd = os.open(self.source, os.O_RDONLY)
+        destination_fd = os.open(self.destination, os.O_WRONLY | os.O_CREAT)
+        try:
+            return copier.copy_data(source_fd, destination_fd, os.fstat(source_fd).st_size)
+        finally:
+            os.close(source_fd)
+            os.close(destination_fd)
+
+    def test_copy(self):
+        self.assertIn(self.copy(), ['reflink', 'copy_file_range', 'sendfile', 'read'])
+        self.assertEqual(self.read(self.destination), self.read(self.source))
+
+    def test_read_and_write_fallback(self):
+        saved = (copier.fcntl, getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None))
+        copier.fcntl = None
+        for name in ('copy_file_range', 'sendfile'):
+            if hasattr(os, name):
+                delattr(os, name)
+        try:
+            self.assertEqual(self.copy(), 'read')
+        finally:
+            copier.fcntl = saved[0]
+            for name, function in zip(('copy_file_range', 'sendfile'), saved[1:]):
+                if function is not None:
+                    setattr(os, name, function)
+        self.assertEqual(self.read(self.destination), self.read(self.source))
+
+
+class AtomicCopyTest(CopierTestCase):
+    """
+    Tests for atomic_copy and atomic_write.
+    """
+
+    def assert_no_temp_files(self):
+        """
+        Check that no temporary file was left next to the destination.
+        Args:
+            None
+        Returns:
+            None
+        Raises:
+            AssertionError: Raises AssertionError if one was left.
+        """
+        self.assertEqual([name for name in os.listdir(self.temp_dir) if '.lego-' in name], [])
+
+    def test_new_file_gets_the_mode(self):
+        copier.atomic_copy(self.source, self.destination, mode=0o640)
+        self.assertEqual(self.read(self.destination), self.read(self.source))
+        self.assertEqual(os.stat(self.destination).st_mode & 0o7777, 0o640)
+        self.assert_no_temp_files()
+
+    def test_replaced_file_is_a_new_inode_with_its_old_mode(self):
+        self.write(self.destination, b'old\n')
+        os.chmod(self.destination, 0o600)
+        old_inode = os.stat(self.destination).st_ino
+        with open(self.destination, 'rb') as reader:
+            copier.atomic_copy(self.source, self.destination)
+            # A reader of the old file still sees it whole.
+            self.assertEqual(reader.read(), b'old\n')
+        self.assertNotEqual(os.stat(self.destination).st_ino, old_inode)
+        self.assertEqual(os.stat(self.destination).st_mode & 0o7777, 0o600)
+        self.assert_no_temp_files()
+
+    def test_symlinked_destination_replaces_the_target(self):
+        target = self.path('target')
+        self.write(target, b'old\n')
+        os.symlink(target, self.destination)
+        copier.atomic_write(b'new\n', self.destination, mode=0o644)
+        self.assertTrue(os.path.islink(self.destination))
+        self.assertEqual(self.read(target), b'new\n')
+
+    def test_failed_copy_leaves_nothing_behind(self):
+        with self.assertRaises(OSError):
+            copier.atomic_copy(self.path('missing'), self.destination)
+        self.assertFalse(os.path.exists(self.destination))
+        self.assert_no_temp_files()
+
+
+class PatchBlocksTest(CopierTestCase):
+    """
+    Tests for patch_blocks.
+    """
+
+    def patch(self):
+        """
+        Patch the destination from the source, in blocks of 1 KiB.
+        Args:
+            None
+        Returns:
+            int: Number of bytes written.
+        Raises:
+            None
+        """
+        source_fd = os.open(self.source, os.O_RDONLY)
+        destination_fd = os.open(self.destination, os.O_RDWR)
+        try:
+            return copier.patch_blocks(source_fd, destination_fd, block_size=1024)
+        finally:
+            os.close(source_fd)
+            os.close(destination_fd)
+
+    def test_only_changed_blocks_are_written(self):
+        data = bytearray(self.read(self.source))
+        data[4100] = ord('X')
+        self.write(self.destination, bytes(data))
+        self.assertEqual(self.patch(), 1024)
+        self.assertEqual(self.read(self.destination), self.read(self.source))
+
+    def test_identical_file_is_not_written(self):
+        shutil.copy(self.source, self.destination)
+        self.assertEqual(self.patch(), 0)
+
+    def test_longer_destination_is_truncated(self):
+        self.write(self.destination, self.read(self.source) + b'trailing\n')
+        self.assertEqual(self.patch(), 0)
+        self.assertEqual(self.read(self.destination), self.read(self.source))
+
+    def test_shorter_destination_is_extended(self):
+        self.write(self.destination, self.read(self.source)[:3000])
+        # The block the destination ends in and every block after it.
+        self.assertEqual(self.patch(), 7000 - 2048)
+        self.assertEqual(self.read(self.destination), self.read(self.source))
+
+    def test_empty_source(self):
+        self.write(self.source, b'')
+        self.write(self.destination, b'old\n')
+        self.assertEqual(self.patch(), 0)
+        self.assertEqual(self.read(self.destination), b'')
+
+
+class DeltaCopyTest(CopierTestCase):
+    """
+    Tests for delta_copy.
+    """
+
+    def setUp(self):
+        super(DeltaCopyTest, self).setUp()
+        self.write(self.destination, b'old\n' * 10)
+        os.chmod(self.destination, 0o600)
+
+    def test_destination_is_updated(self):
+        copier.delta_copy(self.source, self.destination, mode=0o644)
+        self.assertEqual(self.read(self.destination), self.read(self.source))
+        self.assertEqual(os.stat(self.destination).st_mode & 0o7777, 0o644)
+
+    def test_patched_in_place_without_reflinks(self):
+        saved_clone_file = copier.clone_file
+        copier.clone_file = lambda source_fd, destination_fd: False
+        inode = os.stat(self.destination).st_ino
+        try:
+            copier.delta_copy(self.source, self.destination)
+        finally:
+            copier.clone_file = saved_clone_file
+        self.assertEqual(self.read(self.destination), self.read(self.source))
+        self.assertEqual(os.stat(self.destination).st_ino, inode)
+        # The mode of the existing file is kept.
+        self.assertEqual(os.stat(self.destination).st_mode & 0o7777, 0o600)
+        self.assertEqual([name for name in os.listdir(self.temp_dir) if '.lego-' in name], [])
+
+    def test_symlinked_destination_updates_the_target(self):
+        link = self.path('link')
+        os.symlink(self.destination, link)
+        copier.delta_copy(self.source, link)
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(self.read(self.destination), self.read(self.source))
+
+
+class CreateFileTest(CopierTestCase):
+    """
+    Tests for create_file.
+    """
+
+    def test_identical_destination_is_left_alone(self):
+        shutil.copy(self.source, self.destination)
+        inode = os.stat(self.destination).st_ino
+        self.assertFalse(create_file(self.destination, source=self.source, mode=0o644))
+        self.assertEqual(os.stat(self.destination).st_ino, inode)
+
+    def test_different_destination_is_replaced(self):
+        self.write(self.destination, b'x' * len(self.read(self.source)))
+        self.assertTrue(create_file(self.destination, source=self.source, mode=0o644))
+        self.assertEqual(self.read(self.destination), self.read(self.source))
+
+    def test_delta_updates_the_destination(self):
+        data = bytearray(self.read(self.source))
+        data[0] = ord('S')
+        self.write(self.destination, bytes(data))
+        self.assertTrue(create_file(self.destination, source=self.source, mode=0o640,
+                                    delta=True))
+        self.assertEqual(self.read(self.destination), self.read(self.source))
+        self.assertEqual(os.stat(self.destination).st_mode & 0o7777, 0o640)
+
+    def test_delta_creates_a_missing_destination(self):
+        self.assertTrue(create_file(self.destination, source=self.source, mode=0o644,
+                                    delta=True))
+        self.assertEqual(self.read(self.destination), self.read(self.source))
+
+    def test_no_source(self):
+        self.assertFalse(create_file(self.destination))
+        self.assertFalse(os.path.exists(self.destination))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+Tests for file digests and the digest index kept across runs.
+"""
+
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from lego.common import LegoException
+from lego.digests import DigestIndex, get_checksum, get_data_checksum
+
+
+class ChecksumTest(unittest.TestCase):
+    """
+    Tests for get_checksum and get_data_checksum.
+    """
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        with os.fdopen(handle, 'wb') as stream:
+            stream.write(b'lego\n')
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_algorithms(self):
+        for algorithm in ('md5', 'sha256'):
+            expected = hashlib.new(algorithm, b'lego\n').hexdigest()
+            self.assertEqual(get_checksum(self.path, algorithm=algorithm), expected)
+            self.assertEqual(get_data_checksum(b'lego\n', algorithm=algorithm), expected)
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(LegoException):
+            get_checksum(self.path, algorithm='no-such-hash')
+        with self.assertRaises(LegoException):
+            get_data_checksum(b'', algorithm='no-such-hash')
+
+
+class DigestIndexTest(unittest.TestCase):
+    """
+    Tests for DigestIndex.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'app.conf')
+        self.index_file = os.path.join(self.temp_dir, 'state', 'digests.json')
+        self.write(b'first\n', mtime=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write(self, data, mtime=None):
+        """
+        Write the test file in place, keeping its inode.
+        Args:
+            data (bytes): Contents of the file.
+            mtime (int): Modification time to set, None to leave it as written.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with open(self.path, 'wb') as stream:
+            stream.write(data)
+        if mtime is not None:
+            os.utime(self.path, (mtime, mtime))
+
+    def test_unchanged_file_is_not_hashed_again(self):
+        index = DigestIndex()
+        first = index.digest(self.path)
+        # Same inode, size and modification time, so the index can not tell.
+        self.write(b'other\n', mtime=1)
+        self.assertEqual(index.digest(self.path), first)
+
+    def test_changed_file_is_hashed_again(self):
+        index = DigestIndex()
+        index.digest(self.path)
+        self.write(b'second\n', mtime=2)
+        self.assertEqual(index.digest(self.path), hashlib.md5(b'second\n').hexdigest())
+
+    def test_recently_modified_file_is_not_cached(self):
+        index = DigestIndex()
+        self.write(b'fresh\n')
+        self.assertEqual(index.digest(self.path), hashlib.md5(b'fresh\n').hexdigest())
+        self.write(b'FRESH\n')
+        self.assertEqual(index.digest(self.path), hashlib.md5(b'FRESH\n').hexdigest())
+
+    def test_index_is_kept_across_runs(self):
+        index = DigestIndex(index_file=self.index_file, algorithm='sha256')
+        digest = index.digest(self.path)
+        index.save()
+        with open(self.index_file, 'r') as stream:
+            entries = json.load(stream)
+        self.assertEqual(entries[os.path.abspath(self.path)][-2:], ['sha256', digest])
+
+        self.write(b'other\n', mtime=1)
+        self.assertEqual(DigestIndex(index_file=self.index_file,
+                                     algorithm='sha256').digest(self.path), digest)
+        # Digests of another algorithm are not reused.
+        self.assertEqual(DigestIndex(index_file=self.index_file).digest(self.path),
+                         hashlib.md5(b'other\n').hexdigest())
+
+    def test_unchanged_index_is_not_written(self):
+        DigestIndex(index_file=self.index_file).save()
+        self.assertFalse(os.path.exists(self.index_file))
+
+    def test_unreadable_index_is_ignored(self):
+        os.makedirs(os.path.dirname(self.index_file))
+        with open(self.index_file, 'w') as stream:
+            stream.write('not json')
+        self.assertEqual(DigestIndex(index_file=self.index_file).digest(self.path),
+                         hashlib.md5(b'first\n').hexdigest())
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(LegoException):
+            DigestIndex(algorithm='no-such-hash')
+
+
+if __name__ == '__main__':
+    unittest.main()
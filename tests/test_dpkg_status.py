@@ -0,0 +1,146 @@
+"""
+Tests for reading package states from the dpkg status file, and the package
+brick fast path that relies on it.
+"""
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from lego.brick_modules.packages import DpkgStatus, PackageBrick, read_dpkg_status
+from lego.context import BuildContext
+from tests.fake_apt import FakeApt
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'dpkg_status')
+
+
+class ReadDpkgStatusTest(unittest.TestCase):
+    """
+    Tests for read_dpkg_status against a fixture status file.
+    """
+
+    def setUp(self):
+        self.packages = read_dpkg_status(FIXTURE)
+
+    def test_installed(self):
+        self.assertIs(self.packages['vim'], True)
+        self.assertIs(self.packages['vim:amd64'], True)
+        self.assertIs(self.packages['curl'], True)
+
+    def test_multi_arch(self):
+        self.assertIs(self.packages['libc6'], True)
+        self.assertIs(self.packages['libc6:amd64'], True)
+        self.assertIs(self.packages['libc6:i386'], True)
+
+    def test_config_files_are_not_installed(self):
+        self.assertIs(self.packages['apache2'], False)
+        self.assertIs(self.packages['libssl3:i386'], False)
+        # Installed for one architecture is enough for the plain name.
+        self.assertIs(self.packages['libssl3:amd64'], True)
+        self.assertIs(self.packages['libssl3'], True)
+
+    def test_half_installed_is_uncertain(self):
+        self.assertIsNone(self.packages['php'])
+        self.assertIsNone(self.packages['php:amd64'])
+
+    def test_continuation_lines_are_not_fields(self):
+        self.assertNotIn('not-a-package', self.packages)
+
+    def test_empty_file(self):
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            self.assertEqual(read_dpkg_status(path), {})
+        finally:
+            os.remove(path)
+
+
+class DpkgStatusTest(unittest.TestCase):
+    """
+    Tests for DpkgStatus.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'status')
+        shutil.copy(FIXTURE, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_unknown_package_is_not_installed(self):
+        self.assertIs(DpkgStatus(self.path).is_installed('emacs'), False)
+
+    def test_file_is_read_again_when_it_changes(self):
+        dpkg_status = DpkgStatus(self.path)
+        self.assertIs(dpkg_status.is_installed('apache2'), False)
+        with open(self.path, 'a') as stream:
+            stream.write("\nPackage: apache2\nStatus: install ok installed\n")
+        self.assertIs(dpkg_status.is_installed('apache2'), True)
+
+    def test_unreadable_file_is_uncertain(self):
+        dpkg_status = DpkgStatus(os.path.join(self.temp_dir, 'missing'))
+        self.assertIsNone(dpkg_status.is_installed('vim'))
+
+
+class PackageBrickFastPathTest(unittest.TestCase):
+    """
+    Tests for package bricks using dpkg before apt.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'var', 'lib', 'dpkg'))
+        shutil.copy(FIXTURE, os.path.join(self.root, 'var', 'lib', 'dpkg', 'status'))
+        self.apt = FakeApt(available=['vim', 'libc6', 'php', 'apache2'],
+                           installed=['vim', 'libc6'])
+        self.saved_apt = sys.modules.get('apt')
+        sys.modules['apt'] = self.apt
+        self.context = BuildContext(state_dir=None, root=self.root)
+
+    def tearDown(self):
+        if self.saved_apt is None:
+            del sys.modules['apt']
+        else:
+            sys.modules['apt'] = self.saved_apt
+        shutil.rmtree(self.root)
+
+    def make_brick(self, state, packages):
+        """
+        Make a package brick for the test root.
+        Args:
+            state (str): `present` or `absent`.
+            packages (list): Package names.
+        Returns:
+            PackageBrick: Package brick.
+        Raises:
+            None
+        """
+        return PackageBrick({'type': 'package', 'provider': 'apt', 'state': state,
+                             'packages': packages}, context=self.context)
+
+    def test_installed_packages_skip_apt(self):
+        self.make_brick('present', ['vim', 'libc6:i386']).run_brick()
+        self.make_brick('absent', ['apache2', 'emacs']).run_brick()
+        self.assertEqual(self.apt.updates, 0)
+        self.assertEqual(self.apt.commits, [])
+
+    def test_half_installed_package_falls_back_to_apt(self):
+        self.make_brick('present', ['vim', 'php']).run_brick()
+        self.assertEqual(self.apt.updates, 1)
+        self.assertEqual(self.apt.commits, [{'php': True}])
+
+    def test_check_asks_apt_when_dpkg_is_uncertain(self):
+        self.apt.installed.add('php')
+        self.assertEqual(self.make_brick('present', ['vim', 'php']).check(), [])
+        self.apt.installed.discard('php')
+        self.context.apt_cache_manager.cache.open()
+        drift = self.make_brick('present', ['vim', 'php']).check()
+        self.assertEqual([difference['target'] for difference in drift], ['php'])
+
+
+if __name__ == '__main__':
+    unittest.main()
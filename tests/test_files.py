@@ -0,0 +1,336 @@
+"""
+Tests for file bricks.
+"""
+
+
+import grp
+import os
+import pwd
+import shutil
+import tempfile
+import unittest
+from lego.brick_modules.files import FileBrick, IdResolver, read_id_database, reconcile_metadata
+from lego.common import LegoException
+from lego.context import BuildContext
+
+
+class FileBrickTestCase(unittest.TestCase):
+    """
+    Makes a brick set with a `files` directory and an output directory to
+    create files in, in a temporary directory.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.brick_set_dir = os.path.join(self.temp_dir, 'brick_sets', 'app')
+        self.files_dir = os.path.join(self.brick_set_dir, 'files')
+        self.output_dir = os.path.join(self.temp_dir, 'output')
+        os.makedirs(self.files_dir)
+        os.makedirs(self.output_dir)
+        self.context = BuildContext(state_dir=None)
+        self.context.brick_sets_dir = os.path.join(self.temp_dir, 'brick_sets')
+        self.owner = pwd.getpwuid(os.getuid()).pw_name
+        self.group = grp.getgrgid(os.getgid()).gr_name
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_source(self, name, content):
+        """
+        Write a source file of the brick set.
+        Args:
+            name (str): Path of the source, relative to the `files` directory.
+            content (str): Contents of the source.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        path = os.path.join(self.files_dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as stream:
+            stream.write(content)
+
+    def output(self, name):
+        """
+        Get the path of a file in the output directory.
+        Args:
+            name (str): Path relative to the output directory.
+        Returns:
+            str: Path of the file.
+        Raises:
+            None
+        """
+        return os.path.join(self.output_dir, name)
+
+    def read(self, name):
+        """
+        Read a file in the output directory.
+        Args:
+            name (str): Path relative to the output directory.
+        Returns:
+            str: Contents of the file.
+        Raises:
+            None
+        """
+        with open(self.output(name), 'r') as stream:
+            return stream.read()
+
+    def make_brick(self, files, **attributes):
+        """
+        Make a file brick owned by the user running the tests.
+        Args:
+            files (list): File entries.
+            attributes (dict): Attributes overriding the defaults.
+        Returns:
+            FileBrick: File brick.
+        Raises:
+            LegoException: Raises LegoException if the brick is invalid.
+        """
+        provided_attributes = {'type': 'file', 'state': 'present', 'owner': self.owner,
+                               'group': self.group, 'mode': 0o644, 'files': files}
+        provided_attributes.update(attributes)
+        return FileBrick(brick_set_name='app', provided_attributes=provided_attributes,
+                         context=self.context)
+
+
+class ConcurrentFileBrickTest(FileBrickTestCase):
+    """
+    Tests for managing the files of a brick on several threads.
+    """
+
+    def test_every_file_is_created(self):
+        files = []
+        for index in range(20):
+            self.write_source("{0}.conf".format(index), "file {0}\n".format(index))
+            files.append({'source': "{0}.conf".format(index),
+                          'destination': self.output("{0}.conf".format(index))})
+        self.make_brick(files, concurrency=4).run_brick()
+        for index in range(20):
+            self.assertEqual(self.read("{0}.conf".format(index)), "file {0}\n".format(index))
+
+    def test_same_destination_keeps_its_order(self):
+        self.write_source('first', 'first\n')
+        self.write_source('second', 'second\n')
+        files = [{'source': 'first', 'destination': self.output('app.conf')},
+                 {'source': 'second', 'destination': self.output('app.conf')}] * 5
+        self.make_brick(files, concurrency=4).run_brick()
+        self.assertEqual(self.read('app.conf'), 'second\n')
+
+    def test_failures_are_reported_together(self):
+        self.write_source('app.conf', 'app\n')
+        files = [{'source': 'app.conf', 'destination': self.output('app.conf')},
+                 {'source': 'app.conf', 'destination': self.output('missing/a.conf')},
+                 {'source': 'app.conf', 'destination': self.output('missing/b.conf')}]
+        with self.assertRaises(LegoException) as raised:
+            self.make_brick(files, concurrency=3).run_brick()
+        self.assertIn('Failed to manage 2 file(s)', str(raised.exception))
+        self.assertEqual(self.read('app.conf'), 'app\n')
+
+    def test_invalid_concurrency(self):
+        for concurrency in (-1, 'two'):
+            with self.assertRaises(LegoException):
+                self.make_brick([], concurrency=concurrency)
+
+
+class TemplateFileTest(FileBrickTestCase):
+    """
+    Tests for file entries rendered from templates.
+    """
+
+    def setUp(self):
+        super(TemplateFileTest, self).setUp()
+        os.makedirs(os.path.join(self.brick_set_dir, 'templates'))
+        with open(os.path.join(self.brick_set_dir, 'templates', 'app.conf'), 'w') as stream:
+            stream.write('listen {{ host }}:{{ port }}\n')
+        self.context.variables = {'host': 'localhost', 'port': 8080}
+
+    def test_template_is_rendered_with_the_builder_file_variables(self):
+        self.make_brick([{'template': 'app.conf',
+                          'destination': self.output('app.conf')}]).run_brick()
+        self.assertEqual(self.read('app.conf'), 'listen localhost:8080\n')
+
+    def test_entry_variables_override_the_builder_file_variables(self):
+        self.make_brick([{'template': 'app.conf', 'destination': self.output('app.conf'),
+                          'variables': {'port': 9090}}]).run_brick()
+        self.assertEqual(self.read('app.conf'), 'listen localhost:9090\n')
+
+    def test_undefined_variables(self):
+        self.context.variables = {}
+        with self.assertRaises(LegoException) as raised:
+            self.make_brick([{'template': 'app.conf', 'destination': self.output('app.conf')}])
+        self.assertIn("uses undefined variables `['host', 'port']`", str(raised.exception))
+
+    def test_invalid_entries(self):
+        self.write_source('app.conf', 'app\n')
+        for each_file in ({'template': 'missing.conf', 'destination': self.output('app.conf')},
+                          {'template': 'app.conf', 'source': 'app.conf',
+                           'destination': self.output('app.conf')},
+                          {'template': 'app.conf', 'delta': True,
+                           'destination': self.output('app.conf')},
+                          {'template': 'app.conf', 'variables': ['port'],
+                           'destination': self.output('app.conf')},
+                          {'source': 'app.conf', 'variables': {'port': 9090},
+                           'destination': self.output('app.conf')}):
+            with self.assertRaises(LegoException):
+                self.make_brick([each_file])
+
+
+class ExpandedFileTest(FileBrickTestCase):
+    """
+    Tests for glob, directory and manifest file entries.
+    """
+
+    def setUp(self):
+        super(ExpandedFileTest, self).setUp()
+        for name in ('conf.d/a.conf', 'conf.d/b.conf', 'conf.d/sub/c.conf', 'conf.d/README'):
+            self.write_source(name, "{0}\n".format(name))
+
+    def write_manifest(self, content):
+        """
+        Write a manifest next to the bricks file of the brick set.
+        Args:
+            content (str): Contents of the manifest.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with open(os.path.join(self.brick_set_dir, 'files.manifest'), 'w') as stream:
+            stream.write(content)
+
+    def created(self):
+        """
+        List the files created in the output directory.
+        Args:
+            None
+        Returns:
+            list: Paths relative to the output directory, sorted.
+        Raises:
+            None
+        """
+        return sorted(os.path.relpath(os.path.join(current_dir, name), self.output_dir)
+                      for current_dir, _, names in os.walk(self.output_dir) for name in names)
+
+    def test_glob(self):
+        self.make_brick([{'glob': 'conf.d/*.conf',
+                          'destination': self.output('etc')}]).run_brick()
+        self.assertEqual(self.created(), ['etc/a.conf', 'etc/b.conf'])
+        self.assertEqual(self.read('etc/a.conf'), 'conf.d/a.conf\n')
+
+    def test_recursive_glob_keeps_the_layout_below_the_pattern(self):
+        self.make_brick([{'glob': 'conf.d/**/*.conf',
+                          'destination': self.output('etc')}]).run_brick()
+        self.assertEqual(self.created(), ['etc/a.conf', 'etc/b.conf', 'etc/sub/c.conf'])
+
+    def test_directory(self):
+        self.make_brick([{'directory': 'conf.d',
+                          'destination': self.output('etc/app')}]).run_brick()
+        self.assertEqual(self.created(), ['etc/app/README', 'etc/app/a.conf', 'etc/app/b.conf',
+                                          'etc/app/sub/c.conf'])
+        self.assertEqual(self.read('etc/app/sub/c.conf'), 'conf.d/sub/c.conf\n')
+
+    def test_manifest(self):
+        self.write_manifest("# Configuration\n\nconf.d/a.conf {0}\n  conf.d/sub/c.conf {1}\n"
+                            .format(self.output('etc/first.conf'), self.output('opt/c.conf')))
+        self.make_brick([{'manifest': 'files.manifest'}]).run_brick()
+        self.assertEqual(self.created(), ['etc/first.conf', 'opt/c.conf'])
+        self.assertEqual(self.read('opt/c.conf'), 'conf.d/sub/c.conf\n')
+
+    def test_invalid_manifest_lines(self):
+        for content in ("conf.d/a.conf\n", "conf.d/missing.conf {0}\n"):
+            self.write_manifest(content.format(self.output('app.conf')))
+            brick = self.make_brick([{'manifest': 'files.manifest'}])
+            with self.assertRaises(LegoException) as raised:
+                brick.run_brick()
+            self.assertIn('line 1 of manifest', str(raised.exception).lower())
+
+    def test_invalid_entries(self):
+        self.write_manifest('')
+        for each_file, message in (
+                ({'glob': '*.conf', 'directory': 'conf.d', 'destination': self.output('etc')},
+                 'can only have one of'),
+                ({'glob': '*.conf', 'destination': self.output('etc'), 'mode': 0o600},
+                 'Unknown attribute `mode`'),
+                ({'glob': '*.conf'}, 'must have a `destination`'),
+                ({'manifest': 'files.manifest', 'destination': self.output('etc')},
+                 'lists its own destinations'),
+                ({'manifest': 'missing.manifest'}, 'does not exist'),
+                ({'directory': 'missing', 'destination': self.output('etc')}, 'does not exist'),
+                ({'directory': 'conf.d', 'destination': self.output('etc'), 'delta': 'yes'},
+                 'must be true or false')):
+            with self.assertRaises(LegoException) as raised:
+                self.make_brick([each_file])
+            self.assertIn(message, str(raised.exception))
+
+
+class ReconcileMetadataTest(FileBrickTestCase):
+    """
+    Tests for reconcile_metadata.
+    """
+
+    def test_only_what_differs_is_changed(self):
+        path = self.output('app.conf')
+        with open(path, 'w') as stream:
+            stream.write('app\n')
+        os.chmod(path, 0o600)
+        self.assertTrue(reconcile_metadata(path, 0o644, os.getuid(), os.getgid()))
+        self.assertEqual(os.stat(path).st_mode & 0o7777, 0o644)
+        self.assertFalse(reconcile_metadata(path, 0o644, os.getuid(), os.getgid()))
+
+    def test_symlink_target_is_not_changed(self):
+        target = self.output('target')
+        with open(target, 'w') as stream:
+            stream.write('target\n')
+        os.chmod(target, 0o600)
+        os.symlink(target, self.output('link'))
+        self.assertFalse(reconcile_metadata(self.output('link'), 0o644, os.getuid(),
+                                            os.getgid()))
+        self.assertEqual(os.stat(target).st_mode & 0o7777, 0o600)
+
+    def test_invalid_mode(self):
+        with self.assertRaises(LegoException):
+            reconcile_metadata(self.output_dir, '0644', os.getuid(), os.getgid())
+
+
+class IdResolverTest(FileBrickTestCase):
+    """
+    Tests for IdResolver.
+    """
+
+    def setUp(self):
+        super(IdResolverTest, self).setUp()
+        self.root = os.path.join(self.temp_dir, 'root')
+        os.makedirs(os.path.join(self.root, 'etc'))
+        with open(os.path.join(self.root, 'etc', 'passwd'), 'w') as stream:
+            stream.write("# comment\nroot:x:0:0::/root:/bin/sh\nwww:x:33:33::/var/www:/bin/sh\n")
+        with open(os.path.join(self.root, 'etc', 'group'), 'w') as stream:
+            stream.write("root:x:0:\nwww:x:33:\nbroken:x:id:\n")
+
+    def test_read_id_database(self):
+        self.assertEqual(read_id_database(os.path.join(self.root, 'etc', 'group')),
+                         {'root': 0, 'www': 33})
+
+    def test_names_are_resolved_in_the_root(self):
+        resolver = IdResolver(root=self.root)
+        self.assertEqual((resolver.uid('www'), resolver.gid('www')), (33, 33))
+        with self.assertRaises(LegoException):
+            resolver.uid('nobody')
+
+    def test_names_are_looked_up_once(self):
+        resolver = IdResolver(root=self.root)
+        resolver.uid('www')
+        os.remove(os.path.join(self.root, 'etc', 'passwd'))
+        self.assertEqual(resolver.uid('www'), 33)
+
+    def test_this_system(self):
+        resolver = IdResolver()
+        self.assertEqual((resolver.uid(self.owner), resolver.gid(self.group)),
+                         (os.getuid(), os.getgid()))
+        with self.assertRaises(LegoException):
+            resolver.gid('no-such-lego-group')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Tests for the journal of brick fingerprints.
+"""
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+from lego.journal import Journal, make_fingerprint
+
+
+class MakeFingerprintTest(unittest.TestCase):
+    """
+    Tests for make_fingerprint.
+    """
+
+    def test_key_order_does_not_matter(self):
+        self.assertEqual(make_fingerprint(OrderedDict([('a', 1), ('b', [2, 3])])),
+                         make_fingerprint(OrderedDict([('b', [2, 3]), ('a', 1)])))
+
+    def test_values_matter(self):
+        self.assertNotEqual(make_fingerprint({'mode': 0o644}), make_fingerprint({'mode': 0o600}))
+
+
+class JournalTest(unittest.TestCase):
+    """
+    Tests for Journal.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.journal_file = os.path.join(self.temp_dir, 'state', 'journal.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_recorded_fingerprint_is_unchanged(self):
+        journal = Journal()
+        journal.record('app/config', 'abc')
+        self.assertTrue(journal.is_unchanged('app/config', 'abc'))
+        self.assertFalse(journal.is_unchanged('app/config', 'def'))
+        self.assertFalse(journal.is_unchanged('app/other', 'abc'))
+
+    def test_bricks_without_fingerprint_always_run(self):
+        journal = Journal()
+        journal.record('app/command', None)
+        self.assertFalse(journal.is_unchanged('app/command', None))
+
+    def test_forgotten_brick_runs_again(self):
+        journal = Journal()
+        journal.record('app/config', 'abc')
+        journal.forget('app/config')
+        self.assertFalse(journal.is_unchanged('app/config', 'abc'))
+
+    def test_journal_is_kept_across_runs(self):
+        journal = Journal(journal_file=self.journal_file)
+        journal.record('app/config', 'abc')
+        journal.finish_build(True)
+        journal.save()
+        self.assertTrue(Journal(journal_file=self.journal_file).is_unchanged('app/config', 'abc'))
+
+    def test_completed_bricks_of_a_failed_build_are_resumable(self):
+        journal = Journal(journal_file=self.journal_file)
+        journal.record('app/first', 'abc')
+        journal.skip('app/second')
+        journal.finish_build(False)
+        journal.save()
+
+        journal = Journal(journal_file=self.journal_file)
+        self.assertTrue(journal.completed_in_failed_build('app/first'))
+        self.assertTrue(journal.completed_in_failed_build('app/second'))
+        self.assertFalse(journal.completed_in_failed_build('app/third'))
+        journal.finish_build(True)
+        self.assertFalse(journal.completed_in_failed_build('app/first'))
+
+    def test_unreadable_journal_is_ignored(self):
+        os.makedirs(os.path.dirname(self.journal_file))
+        with open(self.journal_file, 'w') as stream:
+            json.dump({'unexpected': True}, stream)
+        self.assertFalse(Journal(journal_file=self.journal_file).is_unchanged('app/config',
+                                                                              'abc'))
+
+
+if __name__ == '__main__':
+    unittest.main()
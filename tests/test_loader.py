@@ -0,0 +1,86 @@
+"""
+Tests for loading builder and brick set files.
+"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+from lego import loader
+from lego.common import LegoException
+
+
+DOCUMENT = '''---
+
+"Zebra":
+  type: command
+"Apple":
+  type: file
+"Mango":
+  type: package
+'''
+
+
+class OrderedLoader(loader.Loader):  # pylint: disable=too-many-ancestors
+    """
+    Loader of this module with the mapping constructor used on interpreters
+    whose dicts are not ordered.
+    """
+
+
+OrderedLoader.add_constructor('tag:yaml.org,2002:map',
+                              loader._map_constructor)  # pylint: disable=protected-access
+
+
+class LoadYamlTest(unittest.TestCase):
+    """
+    Tests for load_yaml and its compiled cache.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'bricks.yaml')
+        with open(self.path, 'w') as stream:
+            stream.write(DOCUMENT)
+        # Old enough for the cache to be written.
+        os.utime(self.path, (1, 1))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_mapping_order_is_kept(self):
+        self.assertEqual(list(loader.load_yaml(self.path, use_cache=False)),
+                         ['Zebra', 'Apple', 'Mango'])
+
+    def test_map_constructor_makes_ordered_dicts(self):
+        data = loader.yaml.load(DOCUMENT, Loader=OrderedLoader)
+        self.assertIsInstance(data, OrderedDict)
+        self.assertIsInstance(data['Zebra'], OrderedDict)
+        self.assertEqual(list(data), ['Zebra', 'Apple', 'Mango'])
+
+    def test_cache_is_used_while_the_file_is_unchanged(self):
+        first = loader.load_yaml(self.path)
+        self.assertTrue(os.path.isfile(loader.cache_path(self.path)))
+        with open(loader.cache_path(self.path), 'rb') as stream:
+            self.assertIn(b'Zebra', stream.read())
+        self.assertEqual(loader.load_yaml(self.path), first)
+        self.assertEqual(list(loader.load_yaml(self.path)), ['Zebra', 'Apple', 'Mango'])
+
+    def test_changed_file_is_parsed_again(self):
+        loader.load_yaml(self.path)
+        with open(self.path, 'w') as stream:
+            stream.write("---\n\n\"Only\":\n  type: file\n")
+        os.utime(self.path, (2, 2))
+        self.assertEqual(list(loader.load_yaml(self.path)), ['Only'])
+
+    def test_invalid_yaml(self):
+        with open(self.path, 'w') as stream:
+            stream.write("\"Broken\": [\n")
+        with self.assertRaises(LegoException):
+            loader.load_yaml(self.path, use_cache=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+"""
+Tests for the queued logging setup.
+"""
+
+
+import json
+import logging
+import unittest
+from lego.logs import JsonFormatter, QueueHandler
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue  # pylint: disable=import-error
+
+
+class QueueHandlerTest(unittest.TestCase):
+    """
+    Tests for QueueHandler.
+    """
+
+    def setUp(self):
+        self.queue = queue.Queue()
+        self.logger = logging.getLogger('lego.tests.logs')
+        self.logger.propagate = False
+        self.handler = QueueHandler(self.queue, [])
+        self.logger.addHandler(self.handler)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.propagate = True
+
+    def test_arguments_are_rendered_when_logged(self):
+        packages = ['vim']
+        self.logger.warning("Installing %s", packages)
+        packages.append('php')
+        record = self.queue.get_nowait()
+        self.assertEqual(record.getMessage(), "Installing ['vim']")
+        self.assertIsNone(record.args)
+
+    def test_exception_is_rendered_when_logged(self):
+        try:
+            raise ValueError('broken brick')
+        except ValueError:
+            self.logger.exception("Brick failed")
+        record = self.queue.get_nowait()
+        self.assertIsNone(record.exc_info)
+        self.assertIn('ValueError: broken brick', record.exc_text)
+        self.assertIn('ValueError: broken brick', logging.Formatter().format(record))
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertIn('ValueError: broken brick', entry['exception'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""
+Tests for the apt cache shared by package bricks.
+"""
+
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from lego.brick_modules.packages import AptCacheManager, AptPackageManager, PackageBrick
+from lego.common import LegoException
+from lego.context import BuildContext
+from tests.fake_apt import FakeApt
+
+
+class AptCacheManagerTest(unittest.TestCase):
+    """
+    Tests for AptCacheManager and AptPackageManager against a fake apt module.
+    """
+
+    def setUp(self):
+        self.apt = FakeApt(available=['vim', 'php', 'curl'], installed=['curl'])
+        self.manager = AptCacheManager(apt_module=self.apt)
+
+    def test_lists_are_updated_once(self):
+        for package in ('vim', 'php'):
+            AptPackageManager(cache_manager=self.manager).install(package)
+        self.assertEqual(self.apt.updates, 1)
+        self.assertEqual(self.apt.installed, set(['curl', 'vim', 'php']))
+
+    def test_fresh_lists_skip_update(self):
+        lists_dir = tempfile.mkdtemp()
+        try:
+            open(os.path.join(lists_dir, 'Packages'), 'w').close()
+            manager = AptCacheManager(ttl=3600, lists_dir=lists_dir, apt_module=self.apt)
+            AptPackageManager(cache_manager=manager).install('vim')
+        finally:
+            shutil.rmtree(lists_dir)
+        self.assertEqual(self.apt.updates, 0)
+
+    def test_later_brick_sees_earlier_commit(self):
+        AptPackageManager(cache_manager=self.manager).install('vim')
+        later = AptPackageManager(cache_manager=self.manager)
+        self.assertTrue(later.is_installed('vim'))
+        later.uninstall('vim')
+        self.assertEqual(self.apt.commits, [{'vim': True}, {'vim': False}])
+        self.assertEqual(self.apt.installed, set(['curl']))
+
+    def test_marks_are_not_applied_again(self):
+        AptPackageManager(cache_manager=self.manager).install('vim')
+        AptPackageManager(cache_manager=self.manager).install('php')
+        self.assertEqual(self.apt.commits, [{'vim': True}, {'php': True}])
+
+    def test_root_is_changed_by_dpkg_of_this_system(self):
+        root = tempfile.mkdtemp()
+        try:
+            for _ in range(2):
+                manager = AptCacheManager(apt_module=self.apt, root=root)
+                AptPackageManager(cache_manager=manager).install('vim')
+        finally:
+            shutil.rmtree(root)
+        config = self.apt.apt_pkg.config
+        self.assertEqual(config.find('Dir::Bin::dpkg'), '/usr/bin/dpkg')
+        self.assertEqual(config.value_list('DPkg::Options'),
+                         ["--root={0}".format(os.path.abspath(root))])
+
+    def test_root_needs_dpkg_configuration(self):
+        self.apt.apt_pkg = None
+        manager = AptCacheManager(apt_module=self.apt, root=tempfile.gettempdir())
+        with self.assertRaises(LegoException):
+            AptPackageManager(cache_manager=manager).install('vim')
+        self.assertEqual(self.apt.commits, [])
+
+    def test_unknown_package(self):
+        with self.assertRaises(LegoException):
+            AptPackageManager(cache_manager=self.manager).install('emacs')
+
+    def test_unknown_package_drops_earlier_marks(self):
+        failed = AptPackageManager(cache_manager=self.manager)
+        failed.mark_install('vim')
+        with self.assertRaises(LegoException):
+            failed.mark_install('emacs')
+        AptPackageManager(cache_manager=self.manager).install('php')
+        self.assertEqual(self.apt.commits, [{'php': True}])
+        self.assertEqual(self.apt.installed, set(['curl', 'php']))
+
+
+class PackageBrickMarkingTest(unittest.TestCase):
+    """
+    Tests for package bricks that fail while marking packages.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.apt = FakeApt(available=['vim', 'php', 'curl'])
+        self.saved_apt = sys.modules.get('apt')
+        sys.modules['apt'] = self.apt
+        self.context = BuildContext(state_dir=None, root=self.root)
+
+    def tearDown(self):
+        if self.saved_apt is None:
+            del sys.modules['apt']
+        else:
+            sys.modules['apt'] = self.saved_apt
+        shutil.rmtree(self.root)
+
+    def make_brick(self, packages):
+        """
+        Make a package brick installing packages in the test root.
+        Args:
+            packages (list): Package names.
+        Returns:
+            PackageBrick: Package brick.
+        Raises:
+            None
+        """
+        return PackageBrick({'type': 'package', 'provider': 'apt', 'state': 'present',
+                             'packages': packages}, context=self.context)
+
+    def test_failed_mark_drops_earlier_marks(self):
+        self.apt.broken.add('php')
+        with self.assertRaises(SystemError):
+            self.make_brick(['vim', 'php']).run_brick()
+        self.make_brick(['curl']).run_brick()
+        self.assertEqual(self.apt.commits, [{'curl': True}])
+        self.assertEqual(self.apt.installed, set(['curl']))
+
+
+class PrefetchTest(unittest.TestCase):
+    """
+    Tests for downloading package archives in the background.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        mirror = os.path.join(self.temp_dir, 'mirror')
+        archives = os.path.join(self.temp_dir, 'archives')
+        os.makedirs(mirror)
+        os.makedirs(archives)
+        for package in ('vim', 'php'):
+            with open(os.path.join(mirror, "{0}.deb".format(package)), 'w') as stream:
+                stream.write(package)
+        self.apt = FakeApt(available=['vim', 'php'], mirror=mirror, archives=archives,
+                           fetch_latency=0.2)
+        self.manager = AptCacheManager(apt_module=self.apt)
+
+    def tearDown(self):
+        self.manager.wait_for_prefetch()
+        shutil.rmtree(self.temp_dir)
+
+    def test_commit_waits_for_prefetch(self):
+        self.manager.prefetch(['vim', 'php'])
+        AptPackageManager(cache_manager=self.manager).install('vim')
+        self.assertEqual(self.apt.events, [('download', 'php', 'lego-apt-prefetch'),
+                                           ('download', 'vim', 'lego-apt-prefetch'),
+                                           ('commit', {'vim': True})])
+
+    def test_failed_prefetch_falls_back_to_commit(self):
+        self.apt.fetch_error = IOError('mirror unreachable')
+        self.manager.prefetch(['vim'])
+        AptPackageManager(cache_manager=self.manager).install('vim')
+        self.assertEqual(self.apt.events, [('download', 'vim', threading.current_thread().name),
+                                           ('commit', {'vim': True})])
+        self.assertEqual(self.apt.installed, set(['vim']))
+
+    def test_unknown_package_is_not_prefetched(self):
+        self.manager.prefetch(['emacs', 'vim'])
+        self.manager.wait_for_prefetch()
+        self.assertEqual(self.apt.events, [('download', 'vim', 'lego-apt-prefetch')])
+
+
+if __name__ == '__main__':
+    unittest.main()
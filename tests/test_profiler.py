@@ -0,0 +1,93 @@
+"""
+Tests for the build profiler.
+"""
+
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from lego.profiler import NullProfiler, Profiler
+
+
+class ProfilerTest(unittest.TestCase):
+    """
+    Tests for Profiler.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_span_is_a_trace_event(self):
+        profiler = Profiler()
+        with profiler.span('app/Configure App', 'brick', brick_set='app'):
+            pass
+        event, = profiler.events
+        self.assertEqual((event['name'], event['cat'], event['ph'], event['args']),
+                         ('app/Configure App', 'brick', 'X', {'brick_set': 'app'}))
+        self.assertEqual((event['pid'], event['tid']),
+                         (os.getpid(), threading.current_thread().ident))
+        self.assertGreaterEqual(event['ts'], 0)
+        self.assertGreaterEqual(event['dur'], 0)
+
+    def test_span_is_recorded_when_the_block_fails(self):
+        profiler = Profiler()
+        with self.assertRaises(ValueError):
+            with profiler.span('app/Broken', 'brick'):
+                raise ValueError('broken')
+        self.assertEqual([event['name'] for event in profiler.events], ['app/Broken'])
+
+    def test_hooks_get_every_span(self):
+        profiler = Profiler()
+        spans = []
+        profiler.add_hook(lambda name, category, seconds, args: spans.append(
+            (name, category, seconds, args)))
+        start = 100.0
+        profiler.add_span('app', 'brick_set', start, start + 1.5, bricks=2)
+        self.assertEqual(spans, [('app', 'brick_set', 1.5, {'bricks': 2})])
+        self.assertEqual(profiler.events[0]['dur'], 1500000)
+
+    def test_write_trace(self):
+        profiler = Profiler()
+        with profiler.span('/etc/app.conf', 'file'):
+            pass
+        path = os.path.join(self.temp_dir, 'trace.json')
+        profiler.write_trace(path)
+        with open(path, 'r') as stream:
+            trace = json.load(stream)
+        self.assertEqual(trace['displayTimeUnit'], 'ms')
+        self.assertEqual(trace['traceEvents'], profiler.events)
+
+    def test_summary_lists_the_slowest_spans_of_a_category(self):
+        profiler = Profiler()
+        start = 100.0
+        profiler.add_span('app/Fast', 'brick', start, start + 0.5)
+        profiler.add_span('app/Slow', 'brick', start, start + 2)
+        profiler.add_span('app/Medium', 'brick', start, start + 1)
+        profiler.add_span('/etc/app.conf', 'file', start, start + 3)
+        self.assertEqual(profiler.summary(limit=2).split('\n'),
+                         ['     seconds  brick',
+                          '       2.000  app/Slow',
+                          '       1.000  app/Medium'])
+
+
+class NullProfilerTest(unittest.TestCase):
+    """
+    Tests for NullProfiler.
+    """
+
+    def test_nothing_is_recorded(self):
+        profiler = NullProfiler()
+        with profiler.span('app/Configure App', 'brick'):
+            pass
+        profiler.add_span('app', 'brick_set', 0, 1)
+        self.assertFalse(hasattr(profiler, 'events'))
+
+
+if __name__ == '__main__':
+    unittest.main()
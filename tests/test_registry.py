@@ -0,0 +1,123 @@
+"""
+Tests for the registry of brick types.
+"""
+
+
+import os
+import subprocess
+import sys
+import unittest
+from lego import registry
+from lego.brick_modules.command import CommandBrick
+from lego.brick_modules.files import FileBrick
+from lego.common import LegoException
+from lego.registry import BrickRegistry
+
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeEntryPoint(object):  # pylint: disable=too-few-public-methods
+    """
+    Entry point that records whether it was loaded.
+    """
+
+    def __init__(self, brick_class):
+        self.brick_class = brick_class
+        self.loaded = False
+
+    def load(self):
+        """
+        Load the brick class.
+        Args:
+            None
+        Returns:
+            class: Brick class.
+        Raises:
+            None
+        """
+        self.loaded = True
+        return self.brick_class
+
+
+class BrickRegistryTest(unittest.TestCase):
+    """
+    Tests for BrickRegistry.
+    """
+
+    def setUp(self):
+        self.service_entry_point = FakeEntryPoint(CommandBrick)
+        self.file_entry_point = FakeEntryPoint(CommandBrick)
+        self.groups = []
+        self.saved_iter_entry_points = registry.iter_entry_points
+        registry.iter_entry_points = self.iter_entry_points
+
+    def tearDown(self):
+        registry.iter_entry_points = self.saved_iter_entry_points
+
+    def iter_entry_points(self, group):
+        """
+        List the fake entry points, recording the group asked for.
+        Args:
+            group (str): Entry point group.
+        Returns:
+            list: Tuples of (name, entry point).
+        Raises:
+            None
+        """
+        self.groups.append(group)
+        return [('service', self.service_entry_point), ('file', self.file_entry_point)]
+
+    def test_builtin_types(self):
+        brick_registry = BrickRegistry()
+        self.assertIs(brick_registry.get('file'), FileBrick)
+        self.assertIs(brick_registry.get('command'), CommandBrick)
+        # Built in types are found without looking at entry points.
+        self.assertEqual(self.groups, [])
+
+    def test_register_class_or_import_path(self):
+        brick_registry = BrickRegistry()
+        brick_registry.register('service', FileBrick)
+        brick_registry.register('task', 'lego.brick_modules.command:CommandBrick')
+        self.assertIs(brick_registry.get('service'), FileBrick)
+        self.assertIs(brick_registry.get('task'), CommandBrick)
+
+    def test_registering_again_replaces_the_class(self):
+        brick_registry = BrickRegistry()
+        brick_registry.get('file')
+        brick_registry.register('file', CommandBrick)
+        self.assertIs(brick_registry.get('file'), CommandBrick)
+
+    def test_entry_points_are_loaded_on_first_use(self):
+        brick_registry = BrickRegistry()
+        self.assertIn('service', brick_registry.brick_types)
+        self.assertEqual(self.groups, [registry.ENTRY_POINT_GROUP])
+        self.assertFalse(self.service_entry_point.loaded)
+        self.assertIs(brick_registry.get('service'), CommandBrick)
+        self.assertTrue(self.service_entry_point.loaded)
+
+    def test_entry_points_do_not_replace_registered_types(self):
+        brick_registry = BrickRegistry()
+        brick_registry.get('service')
+        self.assertIs(brick_registry.get('file'), FileBrick)
+        self.assertFalse(self.file_entry_point.loaded)
+
+    def test_unknown_type(self):
+        with self.assertRaises(LegoException) as raised:
+            BrickRegistry().get('service-unknown')
+        self.assertIn("['package', 'file', 'command', 'service']", str(raised.exception))
+
+    def test_brick_modules_are_imported_on_first_use(self):
+        environment = dict(os.environ, PYTHONPATH=REPOSITORY_DIR)
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             'import sys; from lego.registry import REGISTRY; '
+             'print("lego.brick_modules.packages" in sys.modules); '
+             'REGISTRY.get("package"); '
+             'print("lego.brick_modules.packages" in sys.modules)'],
+            env=environment)
+        self.assertEqual(output.decode('utf-8').split(), ['False', 'True'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""
+Tests for the removal engine.
+"""
+
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from lego import remover
+
+
+def make_tree(directory, depth=3, width=3):
+    """
+    Create a nested tree of directories with a file in each.
+    Args:
+        directory (str): Directory to create the tree in.
+        depth (int): Number of nested levels.
+        width (int): Number of subdirectories in each directory.
+    Returns:
+        None
+    Raises:
+        OSError: Raises OSError.
+    """
+    os.makedirs(directory)
+    with open(os.path.join(directory, 'file'), 'w') as stream:
+        stream.write('data')
+    if depth:
+        for index in range(width):
+            make_tree(os.path.join(directory, "dir{0}".format(index)), depth - 1, width)
+
+
+class RemoveTest(unittest.TestCase):
+    """
+    Tests for remover.remove.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.tree = os.path.join(self.temp_dir, 'tree')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_nested_tree(self):
+        for jobs in (1, 4):
+            make_tree(self.tree)
+            self.assertTrue(remover.remove(self.tree, jobs=jobs))
+            self.assertFalse(os.path.exists(self.tree))
+
+    def test_trailing_slash(self):
+        for jobs in (1, 4):
+            make_tree(self.tree)
+            self.assertTrue(remover.remove(self.tree + '/', jobs=jobs))
+            self.assertFalse(os.path.exists(self.tree))
+
+    def test_trailing_slash_in_background(self):
+        make_tree(self.tree)
+        self.assertTrue(remover.remove(self.tree + '/', jobs=2, background=True))
+        self.assertFalse(os.path.exists(self.tree))
+        for thread in threading.enumerate():
+            if thread.name.startswith('lego-remove-'):
+                thread.join()
+        self.assertEqual(os.listdir(self.temp_dir), [])
+
+    def test_symlink_is_not_followed(self):
+        make_tree(self.tree)
+        link = os.path.join(self.temp_dir, 'link')
+        os.symlink(self.tree, link)
+        self.assertTrue(remover.remove(link + '/'))
+        self.assertFalse(os.path.lexists(link))
+        self.assertTrue(os.path.isfile(os.path.join(self.tree, 'file')))
+
+    def test_missing_path(self):
+        self.assertFalse(remover.remove(self.tree))
+
+    def test_file(self):
+        path = os.path.join(self.temp_dir, 'file')
+        with open(path, 'w') as stream:
+            stream.write('data')
+        self.assertTrue(remover.remove(path))
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+"""
+Tests for the scheduler helpers.
+"""
+
+
+import threading
+import unittest
+from lego.common import LegoException
+from lego.scheduler import Scheduler, run_keyed
+
+
+class RunKeyedTest(unittest.TestCase):
+    """
+    Tests for run_keyed.
+    """
+
+    def test_jobs_below_one_run_one_at_a_time(self):
+        for jobs in (0, -1):
+            done = []
+            failures = run_keyed(items=range(5), key=lambda item: item,
+                                 func=done.append, jobs=jobs)
+            self.assertEqual(failures, [])
+            self.assertEqual(sorted(done), list(range(5)))
+
+    def test_items_with_the_same_key_keep_their_order(self):
+        done = []
+        lock = threading.Lock()
+
+        def record(item):
+            with lock:
+                done.append(item)
+
+        run_keyed(items=[('a', 1), ('b', 1), ('a', 2), ('a', 3), ('b', 2)],
+                  key=lambda item: item[0], func=record, jobs=4)
+        self.assertEqual([item for item in done if item[0] == 'a'],
+                         [('a', 1), ('a', 2), ('a', 3)])
+        self.assertEqual([item for item in done if item[0] == 'b'], [('b', 1), ('b', 2)])
+
+    def test_failures_are_collected(self):
+        def fail_odd(item):
+            if item % 2:
+                raise ValueError(item)
+
+        failures = run_keyed(items=range(6), key=lambda item: item, func=fail_odd, jobs=3)
+        self.assertEqual(sorted(item for item, _ in failures), [1, 3, 5])
+
+
+class SchedulerTest(unittest.TestCase):
+    """
+    Tests for Scheduler.
+    """
+
+    @staticmethod
+    def make_scheduler(jobs, done, fail=()):
+        """
+        Make a scheduler where `b` requires `a` and `c` is independent.
+        Args:
+            jobs (int): Maximum number of tasks to run at the same time.
+            done (list): List every task that ran is appended to.
+            fail (tuple): Tasks that raise ValueError instead of running.
+        Returns:
+            Scheduler: Scheduler with the tasks added.
+        Raises:
+            None
+        """
+        scheduler = Scheduler(jobs=jobs)
+
+        def make_task(task_id):
+            def task():
+                if task_id in fail:
+                    raise ValueError(task_id)
+                done.append(task_id)
+            return task
+
+        for task_id in ('a', 'b', 'c'):
+            scheduler.add_task(task_id, make_task(task_id))
+        scheduler.add_dependency('b', 'a')
+        return scheduler
+
+    def test_jobs_below_one_run_one_at_a_time(self):
+        self.assertEqual(Scheduler(jobs=0).jobs, 1)
+
+    def test_one_job_runs_in_order_added(self):
+        done = []
+        scheduler = self.make_scheduler(1, done)
+        scheduler.add_dependency('a', 'c')
+        scheduler.run()
+        self.assertEqual(done, ['c', 'a', 'b'])
+
+    def test_one_job_stops_at_the_first_failure(self):
+        done = []
+        with self.assertRaises(ValueError):
+            self.make_scheduler(1, done, fail=('a',)).run()
+        self.assertEqual(done, [])
+
+    def test_more_jobs_only_skip_dependents_of_a_failure(self):
+        done = []
+        with self.assertRaises(LegoException) as raised:
+            self.make_scheduler(3, done, fail=('a',)).run()
+        self.assertEqual(done, ['c'])
+        self.assertIn("['b']", str(raised.exception))
+
+    def test_more_jobs_respect_dependencies(self):
+        done = []
+        lock = threading.Lock()
+
+        def record(index):
+            with lock:
+                done.append(index)
+
+        scheduler = Scheduler(jobs=4)
+        for index in range(8):
+            scheduler.add_task(index, lambda index=index: record(index))
+            if index:
+                scheduler.add_dependency(index, index - 1)
+        scheduler.run()
+        self.assertEqual(done, list(range(8)))
+
+    def test_cycle_is_rejected(self):
+        scheduler = self.make_scheduler(1, [])
+        scheduler.add_dependency('a', 'b')
+        with self.assertRaises(LegoException):
+            scheduler.check()
+
+    def test_unknown_and_duplicate_tasks(self):
+        scheduler = self.make_scheduler(1, [])
+        with self.assertRaises(LegoException):
+            scheduler.add_task('a', lambda: None)
+        with self.assertRaises(LegoException):
+            scheduler.add_dependency('a', 'missing')
+
+
+if __name__ == '__main__':
+    unittest.main()
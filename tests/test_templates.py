@@ -0,0 +1,96 @@
+"""
+Tests for file templates.
+"""
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from lego.common import LegoException
+from lego.digests import DigestIndex, get_checksum
+from lego.templates import TemplateCache, compile_template, render_template, template_variables
+
+
+class TemplateTest(unittest.TestCase):
+    """
+    Tests for compiling and rendering templates.
+    """
+
+    def test_compile_and_render(self):
+        template = compile_template(u'listen {{ port }}\nhost {{host}} # {{ port }}\n')
+        self.assertEqual(template, (u'listen ', u'port', u'\nhost ', u'host', u' # ', u'port',
+                                    u'\n'))
+        self.assertEqual(template_variables(template), set(['port', 'host']))
+        self.assertEqual(render_template(template, {'port': 8080, 'host': u'caf\xe9'}),
+                         u'listen 8080\nhost caf\xe9 # 8080\n'.encode('utf-8'))
+
+    def test_text_without_variables(self):
+        template = compile_template(u'{ not a variable }\n{{ 1st }}\n')
+        self.assertEqual(template_variables(template), set())
+        self.assertEqual(render_template(template, {}), b'{ not a variable }\n{{ 1st }}\n')
+
+    def test_undefined_variable(self):
+        with self.assertRaises(LegoException) as raised:
+            render_template(compile_template(u'listen {{ port }}\n'), {'host': 'localhost'})
+        self.assertEqual(str(raised.exception), 'Variable `port` is not defined')
+
+
+class TemplateCacheTest(unittest.TestCase):
+    """
+    Tests for TemplateCache.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'app.conf')
+        self.cache_dir = os.path.join(self.temp_dir, 'state', 'templates')
+        with open(self.path, 'w') as stream:
+            stream.write('listen {{ port }}\n')
+        self.cache_file = os.path.join(self.cache_dir,
+                                       "{0}.json".format(get_checksum(file_to_hash=self.path)))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_compiled_template_is_kept_on_disk(self):
+        template = TemplateCache(cache_dir=self.cache_dir).get(self.path)
+        self.assertEqual(template, ('listen ', 'port', '\n'))
+        with open(self.cache_file, 'r') as stream:
+            self.assertEqual(json.load(stream), list(template))
+
+    def test_compiled_template_is_loaded_from_disk(self):
+        os.makedirs(self.cache_dir)
+        with open(self.cache_file, 'w') as stream:
+            json.dump(['cached ', 'port', '\n'], stream)
+        self.assertEqual(TemplateCache(cache_dir=self.cache_dir).get(self.path),
+                         ('cached ', 'port', '\n'))
+
+    def test_unreadable_compiled_template_is_ignored(self):
+        os.makedirs(self.cache_dir)
+        with open(self.cache_file, 'w') as stream:
+            stream.write('not json')
+        self.assertEqual(TemplateCache(cache_dir=self.cache_dir).get(self.path),
+                         ('listen ', 'port', '\n'))
+
+    def test_changed_template_is_compiled_again(self):
+        cache = TemplateCache(cache_dir=self.cache_dir, digest_index=DigestIndex())
+        cache.get(self.path)
+        with open(self.path, 'w') as stream:
+            stream.write('listen {{ address }}:{{ port }}\n')
+        self.assertEqual(template_variables(cache.get(self.path)), set(['address', 'port']))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_read_only_cache_writes_nothing(self):
+        cache = TemplateCache(cache_dir=self.cache_dir, read_only=True)
+        self.assertEqual(cache.get(self.path), ('listen ', 'port', '\n'))
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_memory_only_cache(self):
+        cache = TemplateCache()
+        self.assertIs(cache.get(self.path), cache.get(self.path))
+
+
+if __name__ == '__main__':
+    unittest.main()
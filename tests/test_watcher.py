@@ -0,0 +1,122 @@
+"""
+Tests for watching files for changes.
+"""
+
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from lego.watcher import InotifyWatcher, PollingWatcher
+
+
+class WatcherTests(object):
+    """
+    Tests shared by every watcher, watching a file in a temporary `etc`
+    directory. Mixed into a TestCase that makes the watcher.
+    """
+
+    def setUp(self):
+        self.watcher = self.make_watcher()
+        self.temp_dir = tempfile.mkdtemp()
+        self.etc_dir = os.path.join(self.temp_dir, 'etc')
+        self.path = os.path.join(self.etc_dir, 'app.conf')
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.temp_dir)
+
+    def make_watcher(self):
+        """
+        Create the watcher under test.
+        Args:
+            None
+        Returns:
+            object: Watcher.
+        Raises:
+            None
+        """
+        raise NotImplementedError
+
+    def write(self, content):
+        """
+        Write the watched file.
+        Args:
+            content (str): Contents of the file.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with open(self.path, 'w') as stream:
+            stream.write(content)
+
+    def wait_for(self, path, timeout=5.0):
+        """
+        Wait until a path is reported as changed.
+        Args:
+            path (str): Path expected to change.
+            timeout (float): Seconds to wait at most.
+        Returns:
+            bool: True if the path was reported, false if the timeout passed.
+        Raises:
+            None
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if path in self.watcher.wait(max(0, deadline - time.time())):
+                return True
+        return False
+
+    def test_changed_file(self):
+        os.makedirs(self.etc_dir)
+        self.write('first\n')
+        self.watcher.watch([self.path])
+        self.write('second\n')
+        self.assertTrue(self.wait_for(self.path))
+
+    def test_directory_created_after_watching(self):
+        self.watcher.watch([self.path])
+        os.makedirs(self.etc_dir)
+        self.write('first\n')
+        self.assertTrue(self.wait_for(self.path))
+        self.write('second\n')
+        self.assertTrue(self.wait_for(self.path))
+
+    def test_directory_removed_and_created_again(self):
+        os.makedirs(self.etc_dir)
+        self.write('first\n')
+        self.watcher.watch([self.path])
+        shutil.rmtree(self.etc_dir)
+        self.assertTrue(self.wait_for(self.path))
+        os.makedirs(self.etc_dir)
+        self.write('second\n')
+        self.assertTrue(self.wait_for(self.path))
+        self.write('third\n')
+        self.assertTrue(self.wait_for(self.path))
+
+
+class InotifyWatcherTest(WatcherTests, unittest.TestCase):
+    """
+    Tests for InotifyWatcher.
+    """
+
+    def make_watcher(self):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            self.skipTest('inotify is not available')
+
+
+class PollingWatcherTest(WatcherTests, unittest.TestCase):
+    """
+    Tests for PollingWatcher.
+    """
+
+    def make_watcher(self):
+        return PollingWatcher(interval=0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()